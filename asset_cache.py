@@ -0,0 +1,207 @@
+# asset_cache.py
+"""
+Общий дисковый кэш статических ресурсов SoundCloud. JS/CSS-бандлы с a-v2.sndcdn.com/assets/ содержат хеш
+в имени и не меняются, но каждый новый контекст браузера начинается с пустого HTTP-кэша и скачивает их
+заново через прокси. Слой context.route отдает такие ресурсы из локального хранилища, общего для всех
+контекстов и воркеров машины; промахи скачиваются через маршрут контекста (его прокси) и сохраняются.
+
+Размер ограничен ASSET_CACHE_MAX_MB: вытесняются давно не использованные файлы (время использования - mtime).
+Перехват запросов отключает HTTP-кэш Chromium в контексте, поэтому кэшировать стоит все тяжелые неизменяемые ресурсы.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+from metrics_utils import report_counters
+
+logger = logging.getLogger(__name__)
+
+# --- Настройки (переопределяются через переменные окружения) ---
+# 1 - бандлы отдаются из общего дискового кэша, 0 - каждый контекст скачивает их сам (как раньше)
+ASSET_CACHE_MODE = os.environ.get('ASSET_CACHE_MODE', '1') == '1'
+ASSET_CACHE_DIR = os.environ.get('ASSET_CACHE_DIR', os.path.join("output_files", "asset_cache"))
+ASSET_CACHE_MAX_MB = float(os.environ.get('ASSET_CACHE_MAX_MB', 512))
+# Какие URL кэшировать: только неизменяемые ресурсы (с хешем содержимого в имени)
+ASSET_CACHE_URL_PATTERN = re.compile(os.environ.get('ASSET_CACHE_URL_PATTERN', r'^https://a-v2\.sndcdn\.com/assets/'))
+# После вытеснения кэш занимает не больше этой доли лимита, чтобы не чистить его при каждой записи
+ASSET_CACHE_EVICT_TO_FRACTION = 0.9
+# Другие процессы тоже пишут в кэш: размер пересчитывается по каталогу не реже этого интервала
+ASSET_CACHE_RESCAN_SECONDS = 60
+# Незавершенные временные файлы (процесс остановлен во время записи) удаляются при вытеснении
+ASSET_CACHE_STALE_TMP_SECONDS = 3600
+ASSET_CACHE_FILE_SUFFIX = '.asset'
+# Заголовки, сохраняемые вместе с телом (тело хранится уже распакованным, поэтому без content-encoding/length)
+ASSET_CACHE_STORED_HEADERS = ('content-type', 'cache-control', 'access-control-allow-origin', 'timing-allow-origin')
+STAT_KEYS = ('hits', 'misses', 'bytes_saved', 'bytes_stored', 'evicted')
+
+
+def _page_closed(request) -> bool:
+    try:
+        return request.frame.page.is_closed()
+    except Exception:
+        return False  # запрос не из страницы (напр. service worker)
+
+
+class AssetCache:
+    """Кэш ресурсов процесса-воркера поверх общего каталога. Подключается к контексту через attach()."""
+
+    def __init__(self, cache_dir: str = ASSET_CACHE_DIR, max_bytes: int = int(ASSET_CACHE_MAX_MB * 2**20)):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self.stats = dict.fromkeys(STAT_KEYS, 0)
+        self._reported = dict.fromkeys(STAT_KEYS, 0)
+        # Запись и вытеснение идут в потоках (asyncio.to_thread)
+        self._size_lock = threading.Lock()
+        self._size_estimate = self._scan()[0]
+        self._scanned_at = time.monotonic()
+
+    async def attach(self, context):
+        await context.route(ASSET_CACHE_URL_PATTERN, self._handle_route)
+
+    def _path(self, url: str) -> str:
+        return os.path.join(self.cache_dir, hashlib.sha256(url.encode('utf-8')).hexdigest() + ASSET_CACHE_FILE_SUFFIX)
+
+    def _read(self, path: str) -> tuple[dict, bytes] | None:
+        """Заголовки и тело из кэша или None. Файл: строка JSON с заголовками, затем тело."""
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)  # отметка использования для LRU
+        except OSError:
+            return None
+        header_line, separator, body = data.partition(b'\n')
+        if not separator:
+            return None
+        try:
+            return json.loads(header_line), body
+        except ValueError:
+            return None
+
+    def _write(self, path: str, headers: dict, body: bytes):
+        # Через временный файл: другие процессы никогда не видят записанный наполовину ресурс
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(json.dumps(headers).encode('utf-8') + b'\n')
+            f.write(body)
+        os.replace(tmp_path, path)
+        with self._size_lock:
+            self.stats['bytes_stored'] += len(body)
+            if time.monotonic() - self._scanned_at > ASSET_CACHE_RESCAN_SECONDS:
+                self._size_estimate, _ = self._scan()
+                self._scanned_at = time.monotonic()
+            else:
+                self._size_estimate += len(body)
+            if self._size_estimate > self.max_bytes:
+                self._evict()
+
+    def _scan(self) -> tuple[int, list[tuple[float, int, str]]]:
+        """Общий размер кэша и его файлы (mtime, size, path); заодно удаляет брошенные временные файлы."""
+        total, entries = 0, []
+        now = time.time()
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue  # вытеснен другим процессом
+                if entry.name.endswith(ASSET_CACHE_FILE_SUFFIX):
+                    total += stat.st_size
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                elif entry.name.endswith('.tmp') and now - stat.st_mtime > ASSET_CACHE_STALE_TMP_SECONDS:
+                    try: os.remove(entry.path)
+                    except OSError: pass
+        return total, entries
+
+    def _evict(self):
+        total, entries = self._scan()
+        target = self.max_bytes * ASSET_CACHE_EVICT_TO_FRACTION
+        entries.sort()
+        for _mtime, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                self.stats['evicted'] += 1
+            except FileNotFoundError:
+                pass  # уже вытеснен другим процессом
+            total -= size
+        self._size_estimate = total
+        self._scanned_at = time.monotonic()
+
+    async def _handle_route(self, route):
+        request = route.request
+        try:
+            if request.method != 'GET':
+                await route.fallback()
+                return
+            path = self._path(request.url)
+            cached = await asyncio.to_thread(self._read, path)
+            if cached:
+                headers, body = cached
+                self.stats['hits'] += 1
+                self.stats['bytes_saved'] += len(body)
+                await route.fulfill(status=200, headers=headers, body=body)
+                return
+            self.stats['misses'] += 1
+            response = await route.fetch()
+            body = await response.body()
+            if response.status == 200 and body:
+                headers = {name: value for name, value in response.headers.items() if name.lower() in ASSET_CACHE_STORED_HEADERS}
+                try:
+                    await asyncio.to_thread(self._write, path, headers, body)
+                except OSError as e:
+                    logger.warning("[%s] Не удалось сохранить ресурс в кэш: %s", request.url, e)
+            await route.fulfill(response=response, body=body)
+        except Exception as e:
+            logger.debug("[%s] Кэш ресурсов: запрос через кэш не выполнен: %s", request.url, e)
+            # Страница закрыта - запрос больше не нужен; иначе он идет обычным путем, без кэша
+            if not _page_closed(request):
+                try:
+                    await route.fallback()
+                    return
+                except Exception:
+                    pass
+            try: await route.abort()
+            except Exception: pass
+
+    def report(self, worker: str):
+        """Отправляет в метрики приращения счетчиков с прошлого вызова."""
+        deltas = {f"asset_cache_{key}": self.stats[key] - self._reported[key] for key in STAT_KEYS if self.stats[key] != self._reported[key]}
+        self._reported = dict(self.stats)
+        report_counters(worker, deltas)
+
+    def log_summary(self, worker_name: str):
+        requests_total = self.stats['hits'] + self.stats['misses']
+        if not requests_total:
+            return
+        logger.info("Воркер %s: Кэш ресурсов (с запуска процесса): попаданий %s из %s (%.0f%%), сэкономлено %.1f МБ, сохранено %.1f МБ, вытеснено файлов: %s.",
+                    worker_name, self.stats['hits'], requests_total, 100 * self.stats['hits'] / requests_total,
+                    self.stats['bytes_saved'] / 2**20, self.stats['bytes_stored'] / 2**20, self.stats['evicted'])
+
+
+_process_cache: AssetCache | None = None
+_process_cache_created = False
+
+
+def get_asset_cache() -> AssetCache | None:
+    """
+    Кэш ресурсов процесса-воркера, если включен ASSET_CACHE_MODE (None - кэш выключен или каталог недоступен).
+    Создается при первом вызове и переиспользуется всеми задачами процесса: каталог сканируется один раз.
+    """
+    global _process_cache, _process_cache_created
+    if _process_cache_created:
+        return _process_cache
+    _process_cache_created = True
+    if not ASSET_CACHE_MODE:
+        return None
+    try:
+        _process_cache = AssetCache()
+    except OSError as e:
+        logger.warning("Кэш ресурсов отключен: каталог %s недоступен (%s).", ASSET_CACHE_DIR, e)
+    return _process_cache
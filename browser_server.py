@@ -0,0 +1,165 @@
+# browser_server.py
+"""
+Общие серверы браузеров Playwright: оркестратор заранее запускает несколько Chromium через
+`python -m playwright launch-server`, а воркеры подключаются к ним через chromium.connect(ws_endpoint)
+вместо собственного запуска браузера. Супервизор проверяет серверы и перезапускает упавшие.
+"""
+import json
+import logging
+import os
+import secrets
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from resource_utils import process_tree_rss
+
+logger = logging.getLogger(__name__)
+
+# --- Настройки (переопределяются через переменные окружения) ---
+# 1 - воркеры подключаются к общим серверам браузеров, 0 - каждый воркер запускает свой браузер (как раньше)
+BROWSER_SERVER_MODE = os.environ.get('BROWSER_SERVER_MODE', '0') == '1'
+BROWSER_SERVER_COUNT = max(1, int(os.environ.get('BROWSER_SERVER_COUNT', 2)))
+BROWSER_SERVER_BASE_PORT = int(os.environ.get('BROWSER_SERVER_BASE_PORT', 9300))
+BROWSER_SERVER_HEALTH_INTERVAL_SECONDS = float(os.environ.get('BROWSER_SERVER_HEALTH_INTERVAL_SECONDS', 15))
+# Сколько проверок подряд сервер может не принимать соединения, прежде чем будет перезапущен
+BROWSER_SERVER_MAX_FAILED_CHECKS = 3
+BROWSER_SERVER_START_TIMEOUT_SECONDS = 60
+BROWSER_SERVER_HOST = '127.0.0.1'
+
+
+def _port_accepts_connections(port: int, timeout: float = 2.0) -> bool:
+    try:
+        with socket.create_connection((BROWSER_SERVER_HOST, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+class BrowserServerSupervisor(threading.Thread):
+    """Запускает BROWSER_SERVER_COUNT серверов браузеров, следит за ними и перезапускает упавшие."""
+
+    def __init__(self, count: int = BROWSER_SERVER_COUNT, base_port: int = BROWSER_SERVER_BASE_PORT, log_dir: str | None = None):
+        super().__init__(name="BrowserServerSupervisor", daemon=True)
+        self.log_dir = log_dir
+        self.config_dir = tempfile.mkdtemp(prefix="browser_servers_")
+        self.servers = [
+            {'index': idx, 'port': base_port + idx, 'endpoint': None, 'process': None,
+             'failed_checks': 0, 'restarts': 0, 'log_file': None}
+            for idx in range(count)
+        ]
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._next_server = 0
+
+    def _launch(self, server: dict):
+        # Новый путь при каждом запуске: воркеры со старым адресом не подключатся к чужому серверу
+        ws_path = f"/{secrets.token_hex(8)}"
+        config_path = os.path.join(self.config_dir, f"server_{server['index']}.json")
+        with open(config_path, 'w', encoding='utf-8') as f:
+            json.dump({'headless': True, 'host': BROWSER_SERVER_HOST, 'port': server['port'], 'wsPath': ws_path}, f)
+        if server['log_file'] is None and self.log_dir:
+            os.makedirs(self.log_dir, exist_ok=True)
+            server['log_file'] = open(os.path.join(self.log_dir, f"browser_server_{server['index']}.log"), 'ab')
+        server['process'] = subprocess.Popen(
+            [sys.executable, '-m', 'playwright', 'launch-server', '--browser', 'chromium', '--config', config_path],
+            stdout=subprocess.DEVNULL, stderr=server['log_file'] or subprocess.DEVNULL,
+        )
+        deadline = time.time() + BROWSER_SERVER_START_TIMEOUT_SECONDS
+        while time.time() < deadline:
+            if server['process'].poll() is not None:
+                break
+            if _port_accepts_connections(server['port'], timeout=0.5):
+                with self._lock:
+                    server['endpoint'] = f"ws://{BROWSER_SERVER_HOST}:{server['port']}{ws_path}"
+                    server['failed_checks'] = 0
+                logger.info("Сервер браузера %s запущен: %s (pid %s).", server['index'], server['endpoint'], server['process'].pid)
+                return
+            time.sleep(0.5)
+        logger.error("Сервер браузера %s не запустился за %s сек. (код выхода: %s).",
+                     server['index'], BROWSER_SERVER_START_TIMEOUT_SECONDS, server['process'].poll())
+        self._terminate(server)
+
+    def _terminate(self, server: dict):
+        with self._lock:
+            server['endpoint'] = None
+        process = server['process']
+        if process and process.poll() is None:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait(timeout=5)
+        server['process'] = None
+
+    def _restart(self, server: dict, reason: str):
+        logger.warning("Перезапуск сервера браузера %s (%s).", server['index'], reason)
+        self._terminate(server)
+        server['restarts'] += 1
+        self._launch(server)
+
+    def start(self):
+        for server in self.servers:
+            self._launch(server)
+        super().start()
+
+    def run(self):
+        while not self._stop_event.wait(BROWSER_SERVER_HEALTH_INTERVAL_SECONDS):
+            for server in self.servers:
+                if self._stop_event.is_set():
+                    break
+                self._check(server)
+
+    def _check(self, server: dict):
+        process = server['process']
+        if process is None:
+            self._restart(server, "сервер не запущен")
+            return
+        exit_code = process.poll()
+        if exit_code is not None:
+            self._restart(server, f"процесс завершился с кодом {exit_code}")
+            return
+        if _port_accepts_connections(server['port']):
+            server['failed_checks'] = 0
+            rss, _ = process_tree_rss(process.pid, include_root=True)
+            logger.debug("Сервер браузера %s: RSS %.0f МБ.", server['index'], rss / 2**20)
+            return
+        server['failed_checks'] += 1
+        logger.warning("Сервер браузера %s не принимает соединения (%s/%s).",
+                       server['index'], server['failed_checks'], BROWSER_SERVER_MAX_FAILED_CHECKS)
+        if server['failed_checks'] >= BROWSER_SERVER_MAX_FAILED_CHECKS:
+            self._restart(server, "не отвечает")
+
+    def endpoint_for_worker(self) -> str | None:
+        """Адрес работающего сервера для очередного воркера (по кругу). None - серверов нет, воркер запустит свой браузер."""
+        with self._lock:
+            alive = [server['endpoint'] for server in self.servers if server['endpoint']]
+            if not alive:
+                return None
+            endpoint = alive[self._next_server % len(alive)]
+            self._next_server += 1
+            return endpoint
+
+    def stop(self):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout=BROWSER_SERVER_START_TIMEOUT_SECONDS)
+        for server in self.servers:
+            self._terminate(server)
+            if server['log_file']:
+                server['log_file'].close()
+        restarts = sum(server['restarts'] for server in self.servers)
+        logger.info("Серверы браузеров остановлены (перезапусков: %s).", restarts)
+
+
+def start_browser_supervisor(log_dir: str) -> BrowserServerSupervisor | None:
+    """Запускает серверы браузеров и супервизор, если включен BROWSER_SERVER_MODE."""
+    if not BROWSER_SERVER_MODE:
+        return None
+    supervisor = BrowserServerSupervisor(log_dir=log_dir)
+    supervisor.start()
+    return supervisor
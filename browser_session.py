@@ -0,0 +1,237 @@
+# browser_session.py
+import asyncio
+import logging
+import os
+
+from resource_utils import child_trees_rss
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/100.0.4896.127 Safari/537.36"
+
+# --- Политика пересоздания (переопределяется через переменные окружения, 0 - отключено) ---
+# Пересоздать контекст после N обработанных в нем страниц
+CONTEXT_RECYCLE_PAGES = int(os.environ.get('CONTEXT_RECYCLE_PAGES', 50))
+# Перезапустить браузер после M обработанных в нем страниц
+BROWSER_RESTART_PAGES = int(os.environ.get('BROWSER_RESTART_PAGES', 300))
+# Перезапустить браузер, если RSS процессов браузера (и драйвера) превысил порог, МБ
+BROWSER_RSS_LIMIT_MB = int(os.environ.get('BROWSER_RSS_LIMIT_MB', 1500))
+# Как часто (в страницах) замерять RSS: обход /proc не бесплатный
+BROWSER_RSS_CHECK_EVERY_PAGES = int(os.environ.get('BROWSER_RSS_CHECK_EVERY_PAGES', 5))
+# Драйвер Playwright - дочерний процесс воркера с этим аргументом; Chromium запускается его потомком
+PLAYWRIGHT_DRIVER_CMDLINE_MARKER = 'run-driver'
+
+
+class ContextSlot:
+    """
+    Контекст браузера, привязанный к одному маршруту (прокси или прямое подключение).
+    spare - запасной контекст на другом маршруте: страницы в нем открываются только для дублей (хеджирования).
+    """
+    __slots__ = ('index', 'proxy_config', 'label', 'context', 'active_pages', 'context_pages', 'recycle_reason', 'recycles', 'spare')
+
+    def __init__(self, index: int, proxy_config: dict | None, spare: bool = False):
+        self.index = index
+        self.spare = spare
+        self.proxy_config = proxy_config
+        self.label = proxy_config.get('server', '') if proxy_config else 'direct'
+        self.context = None
+        self.active_pages = 0
+        self.context_pages = 0
+        self.recycle_reason: str | None = None
+        self.recycles = 0
+
+
+class BrowserSession:
+    """
+    Один браузер воркера и набор контекстов - по одному на маршрут (прокси из proxy_configs или прямое подключение).
+    Если маршрут один, прокси задается при запуске браузера (как раньше); если несколько -
+    браузер запускается без прокси, а каждый контекст получает свой прокси, и страницы распределяются по ним.
+
+    Если задан ws_endpoint, браузер не запускается, а берется у общего сервера (browser_server.py) через
+    chromium.connect; прокси тогда всегда задаются на уровне контекстов. При недоступности сервера
+    браузер запускается локально.
+
+    Если задан asset_cache (asset_cache.py), он подключается к каждому новому контексту.
+    hedge_spare_context - при одном маршруте создать запасной контекст на другом маршруте, чтобы дублю было куда уйти
+    от медленного прокси основной попытки: hedge_proxy_config, а если его нет и основной маршрут - прокси, то напрямую.
+    Прокси тогда задаются на уровне контекстов. Без другого маршрута запасной контекст не создается.
+
+    Страницы берутся через acquire_page/release_page. Когда срабатывает порог пересоздания, новые страницы
+    ждут, пока текущие закроются, после чего контекст (или весь браузер) пересоздается.
+    Для кода, обрабатывающего URL, пересоздание незаметно.
+    """
+
+    def __init__(self, playwright, proxy_configs: list[dict | None], worker_name: str, ws_endpoint: str | None = None,
+                 asset_cache=None, hedge_spare_context: bool = False, hedge_proxy_config: dict | None = None):
+        self.playwright = playwright
+        self.worker_name = worker_name
+        self.ws_endpoint = ws_endpoint
+        self.asset_cache = asset_cache
+        self.slots = [ContextSlot(idx, cfg) for idx, cfg in enumerate(proxy_configs or [None])]
+        if hedge_spare_context and len(self.slots) == 1:
+            primary_config = self.slots[0].proxy_config
+            if hedge_proxy_config and hedge_proxy_config != primary_config:
+                self.slots.append(ContextSlot(1, hedge_proxy_config, spare=True))
+            elif primary_config:
+                # Другого прокси нет - дубль идет напрямую
+                self.slots.append(ContextSlot(1, None, spare=True))
+        # Один маршрут - прокси на уровне браузера, несколько (в т.ч. запасной для дублей или чужой браузер) - на уровне контекстов
+        self.per_context_proxy = len(self.slots) > 1 or bool(ws_endpoint)
+        self.browser = None
+        self._cond = asyncio.Condition()
+        self._active_pages = 0
+        self._browser_pages = 0
+        self._pages_since_rss_check = 0
+        self._next_slot = 0
+        self._restart_reason: str | None = None
+        self.browser_restarts = 0
+
+    async def start(self):
+        await self._launch_browser()
+        for slot in self.slots:
+            await self._new_context(slot)
+
+    async def _launch_browser(self):
+        if self.ws_endpoint:
+            try:
+                self.browser = await self.playwright.chromium.connect(self.ws_endpoint, timeout=30000)
+                self._browser_pages = 0
+                logger.info("Воркер %s: Подключен к серверу браузера %s (маршрутов: %s).", self.worker_name, self.ws_endpoint, len(self.slots))
+                return
+            except Exception as e:
+                logger.warning("Воркер %s: Не удалось подключиться к серверу браузера %s (%s), запуск собственного браузера.",
+                               self.worker_name, self.ws_endpoint, e)
+                self.ws_endpoint = None
+        launch_options = {"headless": True}
+        if not self.per_context_proxy and self.slots[0].proxy_config:
+            launch_options["proxy"] = self.slots[0].proxy_config
+        self.browser = await self.playwright.chromium.launch(**launch_options)
+        self._browser_pages = 0
+        logger.info("Воркер %s: Браузер Chromium запущен (маршрутов: %s).", self.worker_name, len(self.slots))
+
+    async def _new_context(self, slot: ContextSlot):
+        context_options = {"user_agent": DEFAULT_USER_AGENT}
+        if self.per_context_proxy and slot.proxy_config:
+            context_options["proxy"] = slot.proxy_config
+        slot.context = await self.browser.new_context(**context_options)
+        if self.asset_cache:
+            await self.asset_cache.attach(slot.context)
+        slot.context_pages = 0
+        slot.recycle_reason = None
+        logger.info("Воркер %s: Контекст создан (маршрут: %s%s).", self.worker_name, slot.label, ", запасной" if slot.spare else "")
+
+    async def _close_context(self, slot: ContextSlot):
+        if slot.context:
+            try: await slot.context.close()
+            except Exception as e: logger.warning("Воркер %s: Ошибка при закрытии контекста (%s): %s", self.worker_name, slot.label, e)
+            slot.context = None
+
+    async def _close_browser(self):
+        for slot in self.slots:
+            await self._close_context(slot)
+        if self.browser:
+            try: await self.browser.close()
+            except Exception as e: logger.warning("Воркер %s: Ошибка при закрытии браузера: %s", self.worker_name, e)
+            self.browser = None
+
+    async def _restart_browser(self):
+        reason = self._restart_reason or "браузер недоступен после ошибки перезапуска"
+        self._restart_reason = None
+        logger.info("Воркер %s: Перезапуск браузера (%s).", self.worker_name, reason)
+        try:
+            await self._close_browser()
+            await self._launch_browser()
+            for slot in self.slots:
+                await self._new_context(slot)
+        except Exception:
+            await self._close_browser()
+            raise
+        self.browser_restarts += 1
+
+    async def _recycle_context(self, slot: ContextSlot):
+        logger.info("Воркер %s: Пересоздание контекста %s (%s).", self.worker_name, slot.label, slot.recycle_reason)
+        await self._close_context(slot)
+        await self._new_context(slot)
+        slot.recycles += 1
+
+    def _check_thresholds(self, slot: ContextSlot):
+        if self._restart_reason:
+            return
+        if BROWSER_RESTART_PAGES and self._browser_pages >= BROWSER_RESTART_PAGES:
+            self._restart_reason = f"обработано {self._browser_pages} страниц в браузере"
+            return
+        # Браузер сервера - не дочерний процесс воркера; его память контролирует супервизор серверов
+        if BROWSER_RSS_LIMIT_MB and not self.ws_endpoint and self._pages_since_rss_check >= BROWSER_RSS_CHECK_EVERY_PAGES:
+            self._pages_since_rss_check = 0
+            # Только драйвер и Chromium: процессы пула разбора HTML - тоже потомки воркера, но браузер их не освободит
+            rss, _ = child_trees_rss(os.getpid(), PLAYWRIGHT_DRIVER_CMDLINE_MARKER)
+            if rss > BROWSER_RSS_LIMIT_MB * 1024 * 1024:
+                self._restart_reason = f"RSS браузера {rss / 2**20:.0f} МБ > {BROWSER_RSS_LIMIT_MB} МБ"
+                return
+        if not slot.recycle_reason and CONTEXT_RECYCLE_PAGES and slot.context_pages >= CONTEXT_RECYCLE_PAGES:
+            slot.recycle_reason = f"обработано {slot.context_pages} страниц в контексте"
+
+    def _pick_slot(self, exclude: ContextSlot | None) -> ContextSlot:
+        """Наименее загруженный маршрут (по кругу при равенстве), предпочитая контексты, не ждущие пересоздания."""
+        count = len(self.slots)
+        ordered = [self.slots[(self._next_slot + k) % count] for k in range(count)]
+        candidates = [slot for slot in ordered if slot is not exclude] or ordered
+        # Запасной контекст - только для дублей, когда основной маршрут исключен
+        candidates = [slot for slot in candidates if not slot.spare] or candidates
+        ready = [slot for slot in candidates if not slot.recycle_reason] or candidates
+        chosen = min(ready, key=lambda slot: slot.active_pages)
+        self._next_slot = (chosen.index + 1) % count
+        return chosen
+
+    async def acquire_page(self, exclude: ContextSlot | None = None):
+        """Открывает страницу в одном из контекстов. Возвращает (page, slot); exclude - маршрут, которого следует избегать."""
+        async with self._cond:
+            # Пока ждем перезапуска браузера, новые страницы не открываются; текущие дорабатывают
+            while self._restart_reason and self._active_pages > 0:
+                await self._cond.wait()
+            if self.browser is not None and not self._restart_reason and not self.browser.is_connected():
+                # Сервер браузера перезапущен супервизором или браузер упал
+                self._restart_reason = "соединение с браузером потеряно"
+            if self._restart_reason or self.browser is None:
+                await self._restart_browser()
+            slot = self._pick_slot(exclude)
+            while slot.recycle_reason and slot.active_pages > 0:
+                await self._cond.wait()
+            if slot.recycle_reason or slot.context is None:
+                if slot.recycle_reason is None:
+                    slot.recycle_reason = "контекст недоступен после ошибки пересоздания"
+                await self._recycle_context(slot)
+            slot.active_pages += 1
+            self._active_pages += 1
+        page = None
+        try:
+            page = await slot.context.new_page()
+            return page, slot
+        finally:
+            if page is None:
+                # Страница не открыта: ошибка или отмена попытки (напр. проигравшего дубля) во время new_page.
+                # Счетчики откатываются сразу, без ожидания блокировки, иначе перезапуск браузера ждал бы вечно
+                slot.active_pages -= 1
+                self._active_pages -= 1
+                async with self._cond:
+                    self._cond.notify_all()
+
+    async def release_page(self, page, slot: ContextSlot, url: str = ''):
+        if page and not page.is_closed():
+            try: await page.close()
+            except Exception as e: logger.warning("[%s] Ошибка при закрытии страницы: %s", url, e)
+        async with self._cond:
+            slot.active_pages -= 1
+            slot.context_pages += 1
+            self._active_pages -= 1
+            self._browser_pages += 1
+            self._pages_since_rss_check += 1
+            self._check_thresholds(slot)
+            self._cond.notify_all()
+
+    async def close(self):
+        await self._close_browser()
+        context_recycles = sum(slot.recycles for slot in self.slots)
+        if context_recycles or self.browser_restarts:
+            logger.info("Воркер %s: Пересозданий контекстов: %s, перезапусков браузера: %s.",
+                        self.worker_name, context_recycles, self.browser_restarts)
@@ -13,8 +13,7 @@ TIMEOUT_SECONDS = 10
 MAX_WORKERS = 50     
 # -----------------
 
-# Настройка логирования: Устанавливаем уровень INFO, чтобы DEBUG логи не отображались по умолчанию
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(threadName)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
 
 # Отключаем излишние логи от urllib3, которые могут появляться при ошибках прокси
 logging.getLogger("urllib3").setLevel(logging.WARNING)
@@ -69,7 +68,7 @@ def check_proxy(proxy_string_raw: str) -> str | None:
         response.raise_for_status()  # Вызовет исключение для 4xx/5xx ошибок
         
         # Если исключения не было, прокси смог получить ответ от SoundCloud
-        logging.info(f"РАБОЧИЙ (для {CHECK_URL}): {proxy_string_raw} (Статус: {response.status_code}, время: {time.time() - start_time:.2f}с)")
+        logger.info("РАБОЧИЙ (для %s): %s (Статус: %s, время: %.2fс)", CHECK_URL, proxy_string_raw, response.status_code, time.time() - start_time)
         return proxy_string_raw # Возвращаем исходную строку прокси
 
     # Обрабатываем ошибки, не логируя их (кроме неожиданных)
@@ -83,14 +82,14 @@ def check_proxy(proxy_string_raw: str) -> str | None:
         #     logging.debug(f"НЕ РАБОЧИЙ (HTTP Error {e.response.status_code}): {proxy_string_raw}")
         return None
     except Exception as e:
-        logging.error(f"НЕОЖИДАННАЯ ОШИБКА при проверке {proxy_string_raw}: {e}", exc_info=False)
+        logger.error("НЕОЖИДАННАЯ ОШИБКА при проверке %s: %s", proxy_string_raw, e, exc_info=False)
         return None
 
 def load_raw_proxies(filepath: str) -> list[str]:
     """Загружает 'сырые' строки прокси из файла."""
     proxies = []
     if not os.path.exists(filepath):
-        logging.error(f"Файл с прокси не найден: {filepath}")
+        logger.error("Файл с прокси не найден: %s", filepath)
         return []
     try:
         with open(filepath, 'r') as f:
@@ -98,13 +97,16 @@ def load_raw_proxies(filepath: str) -> list[str]:
                 line = line.strip()
                 if line and not line.startswith('#'):
                     proxies.append(line)
-        logging.info(f"Загружено {len(proxies)} строк прокси из файла {filepath}")
+        logger.info("Загружено %s строк прокси из файла %s", len(proxies), filepath)
         return proxies
     except Exception as e:
-        logging.error(f"Ошибка при чтении файла прокси {filepath}: {e}")
+        logger.error("Ошибка при чтении файла прокси %s: %s", filepath, e)
         return []
 
 if __name__ == "__main__":
+    # Настройка логирования здесь, а не при импорте: check_proxy используется и фоновой перепроверкой пула в run_parser
+    # Устанавливаем уровень INFO, чтобы DEBUG логи не отображались по умолчанию
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(threadName)s - %(levelname)s - %(message)s')
     print(f"--- Проверка прокси из файла '{PROXY_FILE}' ---")
     print(f"URL для проверки: {CHECK_URL}")
     print(f"Таймаут: {TIMEOUT_SECONDS} сек")
@@ -144,9 +146,12 @@ if __name__ == "__main__":
             try:
                 # Сортируем для консистентности (опционально)
                 working_proxies.sort() 
-                with open(OUTPUT_WORKING_FILE, 'w') as f:
+                # Запись через временный файл: запущенный парсер следит за этим файлом и не должен прочитать его наполовину
+                tmp_output_file = OUTPUT_WORKING_FILE + '.tmp'
+                with open(tmp_output_file, 'w') as f:
                     for proxy in working_proxies:
                         f.write(proxy + '\n')
+                os.replace(tmp_output_file, OUTPUT_WORKING_FILE)
                 print(f"Список рабочих прокси сохранен в файл: '{OUTPUT_WORKING_FILE}'")
             except IOError as e:
                 print(f"Ошибка записи в файл '{OUTPUT_WORKING_FILE}': {e}")
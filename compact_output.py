@@ -0,0 +1,185 @@
+# compact_output.py
+"""
+Компактизация выходных CSV: из-за возобновления по батчам и ретраев один и тот же URL
+встречается в результатах несколько раз (в т.ч. строками с ошибкой).
+
+Для каждого URL остается одна запись: без ошибки лучше, чем с ошибкой; при равенстве - самая поздняя
+(позже в файле / в более позднем файле из списка). Файлы обрабатываются потоково внешней сортировкой
+слиянием: в памяти одновременно не больше --max-rows строк, отсортированные серии пишутся во временные файлы.
+
+Запуск: python compact_output.py output_files/soundcloud_profiles_clean.csv output_files/soundcloud_profiles_batched.csv
+"""
+import argparse
+import csv
+import heapq
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ROWS_IN_MEMORY = 200_000
+
+# Служебные колонки временных серий: ключ сортировки идет перед данными записи
+_RUN_KEY_COLUMNS = 3  # url, флаг ошибки (0 - без ошибки), отрицательный порядковый номер (новее - раньше)
+
+
+def row_preference_key(row: dict, seq: int) -> tuple[int, int]:
+    """
+    Порядок предпочтения записей одного URL (меньше - лучше): без ошибки лучше, чем с ошибкой;
+    при равенстве - более поздняя. seq - порядковый номер записи во входных данных.
+    """
+    return (1 if row.get('error') else 0, -seq)
+
+
+def best_rows_by_url(rows, urls: set | None = None) -> dict[str, dict]:
+    """Лучшая запись по каждому URL (см. row_preference_key) для строк, помещающихся в память."""
+    best: dict[str, tuple[tuple[int, int], dict]] = {}
+    for seq, row in enumerate(rows):
+        url = row.get('url')
+        if not url or (urls is not None and url not in urls):
+            continue
+        key = row_preference_key(row, seq)
+        current = best.get(url)
+        if current is None or key < current[0]:
+            best[url] = (key, row)
+    return {url: row for url, (_key, row) in best.items()}
+
+
+def _collect_fieldnames(input_files: list[str]) -> list[str]:
+    fieldnames: list[str] = []
+    for input_file in input_files:
+        with open(input_file, 'r', encoding='utf-8', newline='') as f:
+            header = next(csv.reader(f), [])
+        for name in header:
+            if name not in fieldnames:
+                fieldnames.append(name)
+    return fieldnames
+
+
+def _iter_keyed_rows(input_files: list[str], fieldnames: list[str]):
+    """Потоково отдает (url, err_flag, -seq, значения) для всех строк всех файлов."""
+    seq = 0
+    for input_file in input_files:
+        with open(input_file, 'r', encoding='utf-8', newline='') as f:
+            for row in csv.DictReader(f):
+                seq += 1
+                url = (row.get('url') or '').strip()
+                if not url:
+                    continue
+                yield (url, *row_preference_key(row, seq), [row.get(name) or '' for name in fieldnames])
+
+
+def _write_run(buffer: list, temp_dir: str) -> str:
+    """Сортирует буфер и пишет его как серию, сразу оставляя по одной лучшей записи на URL."""
+    buffer.sort(key=lambda item: item[:_RUN_KEY_COLUMNS])
+    fd, path = tempfile.mkstemp(prefix="compact_run_", suffix=".csv", dir=temp_dir)
+    with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        previous_url = None
+        for url, err_flag, neg_seq, values in buffer:
+            if url == previous_url:
+                continue
+            previous_url = url
+            writer.writerow([url, err_flag, neg_seq, *values])
+    return path
+
+
+def _read_run(path: str):
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        for record in csv.reader(f):
+            yield (record[0], int(record[1]), int(record[2]), record[_RUN_KEY_COLUMNS:])
+
+
+def compact_csv_files(input_files: list[str], output_file: str, max_rows_in_memory: int = DEFAULT_MAX_ROWS_IN_MEMORY,
+                      drop_errors: bool = False, temp_dir: str | None = None) -> dict:
+    """
+    Сливает input_files в output_file, оставляя лучшую запись по каждому URL.
+    drop_errors=True - URL, для которых есть только записи с ошибкой, в результат не попадают.
+    Возвращает статистику.
+    """
+    started_at = time.time()
+    fieldnames = _collect_fieldnames(input_files)
+    if 'url' not in fieldnames:
+        raise ValueError("Во входных файлах нет колонки 'url'.")
+    temp_dir = temp_dir or os.path.dirname(os.path.abspath(output_file))
+    os.makedirs(temp_dir, exist_ok=True)
+
+    run_paths: list[str] = []
+    input_rows = 0
+    buffer: list = []
+    try:
+        # Фаза 1: отсортированные серии ограниченного размера
+        for item in _iter_keyed_rows(input_files, fieldnames):
+            input_rows += 1
+            buffer.append(item)
+            if len(buffer) >= max_rows_in_memory:
+                run_paths.append(_write_run(buffer, temp_dir))
+                buffer = []
+        if buffer:
+            run_paths.append(_write_run(buffer, temp_dir))
+            buffer = []
+
+        # Фаза 2: k-way слияние серий; первая запись каждого URL - лучшая
+        unique_urls = 0
+        error_only_urls = 0
+        tmp_output = output_file + ".tmp"
+        with open(tmp_output, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(fieldnames)
+            previous_url = None
+            merged = heapq.merge(*(_read_run(path) for path in run_paths), key=lambda item: item[:_RUN_KEY_COLUMNS])
+            for url, err_flag, _neg_seq, values in merged:
+                if url == previous_url:
+                    continue
+                previous_url = url
+                unique_urls += 1
+                if err_flag:
+                    error_only_urls += 1
+                    if drop_errors:
+                        continue
+                writer.writerow(values)
+        os.replace(tmp_output, output_file)
+    finally:
+        for path in run_paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    stats = {
+        'input_files': len(input_files),
+        'input_rows': input_rows,
+        'unique_urls': unique_urls,
+        'duplicates_dropped': input_rows - unique_urls,
+        'error_only_urls': error_only_urls,
+        'error_rows_written': 0 if drop_errors else error_only_urls,
+        'rows_written': unique_urls - (error_only_urls if drop_errors else 0),
+        'sorted_runs': len(run_paths),
+        'seconds': round(time.time() - started_at, 2),
+    }
+    logger.info("Компактизация %s -> %s: %s", input_files, output_file, stats)
+    return stats
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    arg_parser = argparse.ArgumentParser(description="Компактизация выходных CSV: одна лучшая запись на URL.")
+    arg_parser.add_argument('output', help="Итоговый чистый CSV")
+    arg_parser.add_argument('inputs', nargs='+', help="Входные CSV (порядок важен: более поздние файлы считаются новее)")
+    arg_parser.add_argument('--max-rows', type=int, default=DEFAULT_MAX_ROWS_IN_MEMORY,
+                            help="Максимум строк в памяти при сортировке серии")
+    arg_parser.add_argument('--drop-errors', action='store_true', help="Не выводить URL, у которых есть только ошибки")
+    arg_parser.add_argument('--temp-dir', default=None, help="Каталог для временных серий (по умолчанию рядом с output)")
+    args = arg_parser.parse_args()
+
+    if os.path.abspath(args.output) in {os.path.abspath(path) for path in args.inputs}:
+        sys.exit("Итоговый файл не должен совпадать с входным.")
+    result_stats = compact_csv_files(args.inputs, args.output, args.max_rows, args.drop_errors, args.temp_dir)
+    stats_file = args.output + ".stats.json"
+    with open(stats_file, 'w', encoding='utf-8') as f:
+        json.dump(result_stats, f, ensure_ascii=False, indent=2)
+    print(f"Статистика: {result_stats} (сохранена в {stats_file})")
@@ -2,6 +2,10 @@
 import csv
 import logging
 import os
+
+from profile_record import ProfileRecord, EMAILS_SEPARATOR
+
+logger = logging.getLogger(__name__)
 # threading Lock не нужен, если используем mp.Lock из run_parser.py
 # import threading
 
@@ -16,7 +20,7 @@ def initialize_csv_file(filename: str, fieldnames: list, append_mode: bool = Fal
     try:
         os.makedirs(os.path.dirname(filename), exist_ok=True)
     except OSError as e:
-        logging.error(f"Не удалось создать директорию для CSV {os.path.dirname(filename)}: {e}")
+        logger.error("Не удалось создать директорию для CSV %s: %s", os.path.dirname(filename), e)
         raise # Передаем ошибку выше, это критично
 
     file_exists_and_not_empty = os.path.isfile(filename) and os.path.getsize(filename) > 0
@@ -33,31 +37,31 @@ def initialize_csv_file(filename: str, fieldnames: list, append_mode: bool = Fal
             if write_header:
                 writer.writeheader()
                 if open_mode == 'w' and not (append_mode and file_exists_and_not_empty):
-                    logging.info(f"CSV файл '{filename}' инициализирован/перезаписан с заголовком.")
+                    logger.info("CSV файл '%s' инициализирован/перезаписан с заголовком.", filename)
                 # Если append_mode=True, но файл был пуст/не существовал, заголовок также пишется
             elif append_mode and file_exists_and_not_empty:
-                logging.info(f"CSV файл '{filename}' открыт для дозаписи (заголовок не перезаписан).")
+                logger.info("CSV файл '%s' открыт для дозаписи (заголовок не перезаписан).", filename)
 
     except IOError as e:
-        logging.error(f"Ошибка IOError при инициализации/открытии CSV файла {filename}: {e}")
+        logger.error("Ошибка IOError при инициализации/открытии CSV файла %s: %s", filename, e)
         raise
 
-def append_to_csv(data_item: dict, filename: str, fieldnames: list, lock = None): # lock может быть mp.Lock
+def append_to_csv(data_item: ProfileRecord | dict, filename: str, fieldnames: list, lock = None): # lock может быть mp.Lock
     """
     Дописывает одну строку данных в CSV файл.
     Использует блокировку для безопасной записи из нескольких потоков/процессов.
+    data_item - ProfileRecord (строка собирается без промежуточного словаря) или словарь.
     """
-    if not isinstance(data_item, dict):
-        logging.warning(f"Пропуск несловарных данных при дозаписи в CSV: {data_item}")
+    if isinstance(data_item, ProfileRecord):
+        row_to_write = data_item.csv_row(fieldnames)
+    elif isinstance(data_item, dict):
+        row_to_write = [data_item.get(key, '') for key in fieldnames]
+        if 'emails' in fieldnames and isinstance(data_item.get('emails'), (list, tuple)):
+            row_to_write[fieldnames.index('emails')] = EMAILS_SEPARATOR.join(map(str, data_item['emails']))
+    else:
+        logger.warning("Пропуск данных неизвестного типа при дозаписи в CSV: %s", data_item)
         return
-
-    row_to_write = data_item.copy()
-    if 'emails' in row_to_write and isinstance(row_to_write.get('emails'), list):
-        row_to_write['emails'] = ', '.join(map(str, row_to_write['emails']))
-    
-    for key in fieldnames:
-        if key not in row_to_write:
-            row_to_write[key] = '' 
+    item_url = data_item.url if isinstance(data_item, ProfileRecord) else data_item.get('url')
 
     acquired_lock = False
     if lock:
@@ -65,7 +69,7 @@ def append_to_csv(data_item: dict, filename: str, fieldnames: list, lock = None)
             lock.acquire()
             acquired_lock = True
         else:
-            logging.warning("Переданный объект lock не похож на объект блокировки. Запись без блокировки.")
+            logger.warning("Переданный объект lock не похож на объект блокировки. Запись без блокировки.")
     
     try:
         # Проверка на необходимость записи заголовка, если файл был создан в режиме 'a' и он пуст
@@ -75,16 +79,16 @@ def append_to_csv(data_item: dict, filename: str, fieldnames: list, lock = None)
         header_needed = not file_exists or os.path.getsize(filename) == 0
 
         with open(filename, mode='a', newline='', encoding='utf-8') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames, extrasaction='ignore')
+            writer = csv.writer(csvfile)
             if header_needed:
-                writer.writeheader()
-                logging.info(f"Заголовок записан в '{filename}' при дозаписи (файл был пуст/отсутствовал).")
+                writer.writerow(fieldnames)
+                logger.info("Заголовок записан в '%s' при дозаписи (файл был пуст/отсутствовал).", filename)
             writer.writerow(row_to_write)
-        logging.debug(f"Данные для URL '{data_item.get('url')}' дописаны в {filename}")
+        logger.debug("Данные для URL '%s' дописаны в %s", item_url, filename)
     except IOError as e:
-        logging.error(f"Ошибка IOError при дозаписи в CSV файл {filename} для URL '{data_item.get('url')}': {e}")
+        logger.error("Ошибка IOError при дозаписи в CSV файл %s для URL '%s': %s", filename, item_url, e)
     except Exception as e:
-        logging.error(f"Непредвиденная ошибка при дозаписи в CSV файл {filename} для URL '{data_item.get('url')}': {e}")
+        logger.error("Непредвиденная ошибка при дозаписи в CSV файл %s для URL '%s': %s", filename, item_url, e)
     finally:
         if acquired_lock and lock and hasattr(lock, 'release'):
             lock.release()
@@ -115,6 +119,10 @@ if __name__ == '__main__':
     initialize_csv_file(test_filename, fields, append_mode=True) # Существующий, не пустой, заголовок не пишем
     test_data2 = {'url': 'url2', 'followers': '200', 'website': 'site2', 'error': 'err2'}
     append_to_csv(test_data2, test_filename, fields, test_lock)
+
+    print("Тест 3: Дозапись ProfileRecord")
+    test_record = ProfileRecord('url3', followers=300, website='site3', emails=('a@ex.com', 'b@ex.com'), extra={'extra': 'val3'})
+    append_to_csv(test_record, test_filename, fields, test_lock)
         
     print(f"Проверьте файл {test_filename}")
     # Почистить после теста
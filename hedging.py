@@ -0,0 +1,160 @@
+# hedging.py
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import deque
+
+from profile_record import ProfileRecord
+
+logger = logging.getLogger(__name__)
+
+# --- Настройки (переопределяются через переменные окружения) ---
+# Перцентиль длительности URL, после которого запускается дублирующая попытка на другом маршруте (0 - отключено)
+HEDGE_PERCENTILE = float(os.environ.get('HEDGE_PERCENTILE', 95))
+# Пока замеров меньше, чем HEDGE_MIN_SAMPLES, используется фиксированная задержка
+HEDGE_MIN_SAMPLES = int(os.environ.get('HEDGE_MIN_SAMPLES', 20))
+HEDGE_INITIAL_DELAY_SECONDS = float(os.environ.get('HEDGE_INITIAL_DELAY_SECONDS', 60))
+# Нижняя граница задержки: быстрые страницы не дублируются из-за случайного разброса
+HEDGE_MIN_DELAY_SECONDS = float(os.environ.get('HEDGE_MIN_DELAY_SECONDS', 10))
+# Не больше такой доли URL воркера получает дублирующую попытку
+HEDGE_BUDGET_FRACTION = float(os.environ.get('HEDGE_BUDGET_FRACTION', 0.1))
+HEDGE_WINDOW = int(os.environ.get('HEDGE_WINDOW', 200))
+# Сколько страниц сверх PAGES_PER_WORKER воркер может открыть под дубли одновременно (0 - хеджирование отключено)
+HEDGE_MAX_EXTRA_PAGES = int(os.environ.get('HEDGE_MAX_EXTRA_PAGES', 1))
+
+_logged_disable_reasons: set[str] = set()
+
+
+class HedgePolicy:
+    """
+    Порог хеджирования одного воркера: скользящее окно длительностей успешных URL и перцентиль по нему.
+    Считает запущенные дубли, выигравшие дубли и время, потраченное впустую проигравшими попытками.
+    Дубль имеет смысл только на другом маршруте: если его нет, хеджирование выключается через disable().
+    """
+
+    def __init__(self, percentile: float = HEDGE_PERCENTILE):
+        self.percentile = percentile
+        self.samples: deque[float] = deque(maxlen=max(1, HEDGE_WINDOW))
+        self.urls_started = 0
+        self.hedges_launched = 0
+        self.hedges_won = 0
+        self.wasted_seconds = 0.0
+        self.extra_pages_in_use = 0
+        self.disabled_reason: str | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.percentile > 0 and HEDGE_MAX_EXTRA_PAGES > 0 and self.disabled_reason is None
+
+    def disable(self, reason: str):
+        """Выключает хеджирование воркера; причина пишется в лог один раз на процесс."""
+        self.disabled_reason = reason
+        if reason not in _logged_disable_reasons:
+            _logged_disable_reasons.add(reason)
+            logger.warning("Хеджирование отключено: %s.", reason)
+
+    def observe_start(self):
+        self.urls_started += 1
+
+    def observe_latency(self, seconds: float):
+        self.samples.append(seconds)
+
+    def hedge_delay(self) -> float | None:
+        """Через сколько секунд запускать дубль для текущего URL (None - хеджирование отключено)."""
+        if not self.enabled:
+            return None
+        if len(self.samples) < HEDGE_MIN_SAMPLES:
+            return max(HEDGE_MIN_DELAY_SECONDS, HEDGE_INITIAL_DELAY_SECONDS)
+        ordered = sorted(self.samples)
+        rank = min(len(ordered) - 1, max(0, math.ceil(self.percentile / 100 * len(ordered)) - 1))
+        return max(HEDGE_MIN_DELAY_SECONDS, ordered[rank])
+
+    def try_acquire_budget(self) -> bool:
+        """
+        Разрешает очередной дубль, если доля дублей не превысила HEDGE_BUDGET_FRACTION и свободна одна из
+        HEDGE_MAX_EXTRA_PAGES страниц под дубли. Занятую страницу нужно вернуть через release_extra_page().
+        """
+        if self.extra_pages_in_use >= HEDGE_MAX_EXTRA_PAGES:
+            return False
+        if self.hedges_launched >= 1 + HEDGE_BUDGET_FRACTION * self.urls_started:
+            return False
+        self.hedges_launched += 1
+        self.extra_pages_in_use += 1
+        return True
+
+    def release_extra_page(self):
+        self.extra_pages_in_use -= 1
+
+    def record_hedge(self, hedge_won: bool, wasted_seconds: float):
+        if hedge_won:
+            self.hedges_won += 1
+        self.wasted_seconds += wasted_seconds
+
+    def log_summary(self, worker_name: str):
+        if not self.hedges_launched:
+            return
+        logger.info("Воркер %s: Хеджирование: дублей %s из %s URL, выиграли %s, впустую %.1f сек. (порог p%s: %.1f сек.)",
+                    worker_name, self.hedges_launched, self.urls_started, self.hedges_won,
+                    self.wasted_seconds, self.percentile, self.hedge_delay() or 0.0)
+
+
+async def run_hedged(policy: HedgePolicy, run_attempt, url: str, primary_state: dict) -> tuple[ProfileRecord, dict]:
+    """
+    Обрабатывает URL через run_attempt(url, state, exclude=None); если попытка дольше порога хеджирования,
+    запускает дубль на другом маршруте (exclude - маршрут основной попытки). Дубль занимает страницу сверх
+    PAGES_PER_WORKER из HEDGE_MAX_EXTRA_PAGES. Побеждает первый успешный результат, вторая попытка отменяется;
+    если обе неудачны, возвращается результат основной. Возвращает (result_data, состояние победителя).
+    """
+    primary = asyncio.create_task(run_attempt(url, primary_state))
+    hedge_delay = policy.hedge_delay()
+    if hedge_delay is None:
+        return await primary, primary_state
+    try:
+        done, _ = await asyncio.wait({primary}, timeout=hedge_delay)
+    except asyncio.CancelledError:
+        primary.cancel()
+        raise
+    if done or not policy.try_acquire_budget():
+        return await primary, primary_state
+
+    logger.info("[%s] Дольше %.1f сек. на маршруте %s, запуск дублирующей попытки на другом маршруте.",
+                url, hedge_delay, primary_state['slot'].label if primary_state['slot'] else '?')
+    hedge_state = {'slot': None, 'timings': {}}
+    hedge = asyncio.create_task(run_attempt(url, hedge_state, exclude=primary_state['slot']))
+    hedge_started_at = time.perf_counter()
+    outcomes = {}
+    winner = None
+    pending = {primary, hedge}
+    try:
+        while pending and winner is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                outcomes[task] = task.exception() or task.result()
+                if winner is None and isinstance(outcomes[task], ProfileRecord) and outcomes[task].ok:
+                    winner = task
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+        # Обе попытки завершены, страница дубля закрыта
+        policy.release_extra_page()
+
+    # Впустую потрачено время проигравшей попытки (или дубля, если успеха не было)
+    wasted_seconds = time.perf_counter() - hedge_started_at
+    if winner is hedge:
+        wasted_seconds += hedge_delay
+    policy.record_hedge(winner is hedge, wasted_seconds)
+    logger.info("[%s] Хеджирование: %s, впустую %.1f сек.", url,
+                "победил дубль" if winner is hedge else ("победила основная попытка" if winner else "обе попытки неудачны"),
+                wasted_seconds)
+
+    winner = winner or primary
+    outcome = outcomes.get(winner)
+    if isinstance(outcome, BaseException):
+        raise outcome
+    winner_state = hedge_state if winner is hedge else primary_state
+    winner_state['timings']['hedge_wasted'] = wasted_seconds
+    return outcome, winner_state
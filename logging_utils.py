@@ -0,0 +1,138 @@
+# logging_utils.py
+import json
+import logging
+import multiprocessing as mp
+import os
+import sys
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+# --- Настройки (переопределяются через переменные окружения) ---
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').strip().upper()
+# Уровни для отдельных модулей: "main_worker=WARNING,csv_utils=DEBUG"
+LOG_LEVELS = os.environ.get('LOG_LEVELS', '')
+# text - обычные строки, json - одна JSON-запись на строку
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text').strip().lower()
+# Сэмплирование повторяющихся сообщений уровня INFO и ниже: пропускается каждое N-е (1 - без сэмплирования)
+LOG_SAMPLE_EVERY = max(1, int(os.environ.get('LOG_SAMPLE_EVERY', 1)))
+# Логгеры, к которым применяется сэмплирование (сообщения по каждому URL)
+LOG_SAMPLED_LOGGERS = tuple(
+    name.strip() for name in os.environ.get('LOG_SAMPLED_LOGGERS', 'main_worker').split(',') if name.strip()
+)
+
+TEXT_FORMAT = '%(asctime)s - %(processName)s - %(name)s - %(levelname)s - %(message)s'
+
+# Очередь логов основного процесса (создается в start_logging_listener)
+_log_queue = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Форматирует запись лога в одну строку JSON."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            'ts': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'process': record.processName,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            payload['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            payload['exc'] = record.exc_text
+        return json.dumps(payload, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Пропускает только каждое N-е сообщение уровня INFO и ниже для заданных логгеров.
+    Ключ сэмплирования - шаблон сообщения (record.msg) до подстановки аргументов,
+    поэтому однотипные сообщения по разным URL считаются вместе. WARNING и выше проходят всегда.
+    """
+
+    def __init__(self, every: int, logger_prefixes: tuple[str, ...]):
+        super().__init__()
+        self.every = every
+        self.logger_prefixes = logger_prefixes
+        self._counters: dict[tuple[str, str], int] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.every <= 1 or record.levelno > logging.INFO:
+            return True
+        if not record.name.startswith(self.logger_prefixes):
+            return True
+        key = (record.name, str(record.msg))
+        with self._lock:
+            seen = self._counters.get(key, 0)
+            self._counters[key] = seen + 1
+        return seen % self.every == 0
+
+
+def _make_formatter() -> logging.Formatter:
+    if LOG_FORMAT == 'json':
+        return JsonFormatter()
+    return logging.Formatter(TEXT_FORMAT)
+
+
+def _parse_module_levels(spec: str) -> dict[str, int]:
+    levels = {}
+    for item in spec.split(','):
+        if '=' not in item:
+            continue
+        name, level = (part.strip() for part in item.split('=', 1))
+        level_value = logging.getLevelName(level.upper())
+        if name and isinstance(level_value, int):
+            levels[name] = level_value
+    return levels
+
+
+def apply_log_levels():
+    """Устанавливает уровень корневого логгера и уровни отдельных модулей из LOG_LEVEL/LOG_LEVELS."""
+    root_level = logging.getLevelName(LOG_LEVEL)
+    logging.getLogger().setLevel(root_level if isinstance(root_level, int) else logging.INFO)
+    for name, level in _parse_module_levels(LOG_LEVELS).items():
+        logging.getLogger(name).setLevel(level)
+
+
+def configure_console_logging():
+    """Консольное логирование для основного процесса и отдельных утилит."""
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(_make_formatter())
+    root = logging.getLogger()
+    root.handlers = [handler]
+    apply_log_levels()
+
+
+def start_logging_listener() -> QueueListener:
+    """
+    Запускает в основном процессе единственный слушатель очереди логов.
+    Воркеры пишут записи в эту очередь (init_worker_logging), а вывод в консоль делает только слушатель.
+    """
+    global _log_queue
+    configure_console_logging()
+    root = logging.getLogger()
+    _log_queue = mp.Queue(-1)
+    listener = QueueListener(_log_queue, *root.handlers, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+def get_log_queue():
+    """Очередь логов для передачи воркерам (None, если слушатель не запущен)."""
+    return _log_queue
+
+
+def init_worker_logging(log_queue):
+    """
+    Перенаправляет логи процесса-воркера в общую очередь.
+    Сэмплирование выполняется до постановки в очередь, чтобы не тратить на отброшенные записи IPC.
+    """
+    if log_queue is None:
+        return
+    handler = QueueHandler(log_queue)
+    handler.addFilter(SamplingFilter(LOG_SAMPLE_EVERY, LOG_SAMPLED_LOGGERS))
+    root = logging.getLogger()
+    root.handlers = [handler]
+    apply_log_levels()
@@ -2,25 +2,86 @@
 import asyncio
 import logging
 import multiprocessing as mp
+import os
 import random
+import time
 from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError, Error as PlaywrightError
 
 from proxy_utils import parse_proxy_string
 from soundcloud_parser import parse_soundcloud_profile_html
+from soundcloud_api import ProfileApiCapture, HYDRATION_USERS_JS
+from parse_offload import HtmlParsePool, get_parse_pool
 from csv_utils import append_to_csv
+from metrics_utils import init_worker_metrics, stage_timer, report_url_timings, report_process_start
+from logging_utils import init_worker_logging
+from browser_session import BrowserSession
+from asset_cache import get_asset_cache
+from hedging import HedgePolicy, run_hedged
+from profiling_utils import profiled
+from shutdown_utils import init_worker_drain, drain_requested
+from profile_record import (ProfileRecord, PROFILE_CSV_FIELDNAMES, ERROR_GOTO_FAILED, ERROR_GOTO_UNEXPECTED,
+                            ERROR_CONTENT_MISSING, ERROR_PARSE_FAILED, ERROR_TASK_FAILED, ERROR_EMPTY_RESULT)
 
-DEFAULT_CSV_FIELDNAMES = ['url', 'followers', 'website', 'youtube', 'facebook', 'twitter', 'instagram',
-                          'songkick', 'telegram', 'tiktok', 'linkedin', 'emails', 'error']
+logger = logging.getLogger(__name__)
 
 MAX_GOTO_RETRIES = 2
 INITIAL_RETRY_DELAY = 1
+# 1 - подписчики и ссылки берутся из JSON-ответов API SoundCloud, DOM разбирается только если ответы не пришли
+RESPONSE_CAPTURE_MODE = os.environ.get('RESPONSE_CAPTURE_MODE', '1') == '1'
+RESPONSE_CAPTURE_TIMEOUT_SECONDS = float(os.environ.get('RESPONSE_CAPTURE_TIMEOUT_SECONDS', 10))
+# После загрузки страницы: если столько секунд не приходят новые данные профиля, ответов API не ждем и разбираем DOM
+RESPONSE_CAPTURE_SETTLE_SECONDS = float(os.environ.get('RESPONSE_CAPTURE_SETTLE_SECONDS', 2))
 
-async def process_single_url_in_worker(page, url: str) -> dict:
-    data = {
-        'url': url, 'followers': '', 'website': '', 'youtube': '', 'facebook': '', 'twitter': '',
-        'instagram': '', 'songkick': '', 'telegram': '', 'tiktok': '', 'linkedin': '',
-        'emails': [], 'error': ''
-    }
+
+def init_worker_process(metrics_queue=None, log_queue=None, launched_at: float | None = None, worker_label: str | None = None, drain_event=None):
+    """
+    Инициализация процесса-воркера (initializer для пула и первая строка основного прямого воркера).
+    launched_at - time.time() в оркестраторе при запуске процесса: по нему считается время старта (импорты и т.п.).
+    drain_event - событие плавной остановки: после него воркер не начинает новые URL.
+    """
+    init_worker_logging(log_queue)
+    init_worker_metrics(metrics_queue)
+    init_worker_drain(drain_event)
+    if launched_at is not None:
+        start_seconds = time.time() - launched_at
+        worker_name = worker_label or mp.current_process().name
+        logger.info("Процесс %s готов через %.2f сек. после запуска (метод: %s).", worker_name, start_seconds, mp.get_start_method())
+        report_process_start(worker_name, start_seconds)
+
+
+async def process_single_url_in_worker(page, url: str, timings: dict | None = None, parse_pool: HtmlParsePool | None = None) -> ProfileRecord:
+    """parse_pool - пул разбора HTML воркера; None - разбор в цикле событий."""
+    if not RESPONSE_CAPTURE_MODE:
+        return await _process_profile_page(page, url, timings, parse_pool=parse_pool)
+    # Перехватчик подключается до навигации: запросы к API идут во время загрузки страницы
+    capture = ProfileApiCapture(url)
+    page.on("response", capture.on_response)
+    try:
+        return await _process_profile_page(page, url, timings, capture, parse_pool)
+    finally:
+        capture.close()
+        try: page.remove_listener("response", capture.on_response)
+        except Exception: pass
+
+
+async def capture_profile_from_api(page, url: str, capture: ProfileApiCapture) -> ProfileRecord | None:
+    """Данные профиля из перехваченных ответов API. None - ответы не пришли вовремя, нужен разбор DOM."""
+    if capture.user is None:
+        try:
+            capture.use_hydration(await page.evaluate(HYDRATION_USERS_JS))
+        except Exception as e:
+            logger.debug("[%s] Не удалось прочитать данные серверного рендеринга: %s", url, e)
+    waited_from = time.perf_counter()
+    if not await capture.wait_complete(RESPONSE_CAPTURE_TIMEOUT_SECONDS, RESPONSE_CAPTURE_SETTLE_SECONDS):
+        logger.info("[%s] Ответы API не получены за %.1f сек. (пользователь: %s, ссылки: %s), переход к разбору DOM.",
+                    url, time.perf_counter() - waited_from, capture.user is not None, bool(capture.web_profiles))
+        return None
+    return capture.to_record(url)
+
+
+async def _process_profile_page(page, url: str, timings: dict | None = None, capture: ProfileApiCapture | None = None,
+                                parse_pool: HtmlParsePool | None = None) -> ProfileRecord:
+    data = ProfileRecord(url)
     page_timeout = 180000
     cookie_click_timeout = 10000
     content_selector_timeout = 15000
@@ -29,10 +90,15 @@ async def process_single_url_in_worker(page, url: str) -> dict:
     last_goto_error = None
 
     for attempt in range(MAX_GOTO_RETRIES):
+        goto_started_at = time.perf_counter()
         try:
-            logging.info(f"[{url}] Попытка {attempt + 1}/{MAX_GOTO_RETRIES}: Начало загрузки страницы...")
-            await page.goto(url, wait_until="domcontentloaded", timeout=page_timeout)
-            logging.info(f"[{url}] Попытка {attempt + 1}: Страница успешно загружена.")
+            logger.info("[%s] Попытка %s/%s: Начало загрузки страницы...", url, attempt + 1, MAX_GOTO_RETRIES)
+            try:
+                await page.goto(url, wait_until="domcontentloaded", timeout=page_timeout)
+            finally:
+                if timings is not None:
+                    timings['goto'] = timings.get('goto', 0.0) + (time.perf_counter() - goto_started_at)
+            logger.info("[%s] Попытка %s: Страница успешно загружена.", url, attempt + 1)
             goto_success = True
             last_goto_error = None
             break
@@ -40,172 +106,236 @@ async def process_single_url_in_worker(page, url: str) -> dict:
             last_goto_error = e
             error_type = type(e).__name__
             error_message = str(e).split('\n')[0]
-            logging.warning(f"[{url}] Попытка {attempt + 1}/{MAX_GOTO_RETRIES} не удалась ({error_type}): {error_message}")
+            logger.warning("[%s] Попытка %s/%s не удалась (%s): %s", url, attempt + 1, MAX_GOTO_RETRIES, error_type, error_message)
             if attempt < MAX_GOTO_RETRIES - 1:
                 retry_delay = (INITIAL_RETRY_DELAY * (2 ** attempt)) + random.uniform(0.1, 0.5) # ИЗМЕНЕНО (диапазон для random.uniform)
-                logging.info(f"[{url}] Пауза {retry_delay:.2f} сек перед повторной попыткой...")
+                logger.info("[%s] Пауза %.2f сек перед повторной попыткой...", url, retry_delay)
                 await asyncio.sleep(retry_delay)
             else:
-                logging.error(f"[{url}] Превышено максимальное количество попыток ({MAX_GOTO_RETRIES}) для page.goto.", exc_info=False)
-                data['error'] = f"Превышено {MAX_GOTO_RETRIES} попыток goto: {type(last_goto_error).__name__} - {str(last_goto_error).splitlines()[0]}"
+                logger.error("[%s] Превышено максимальное количество попыток (%s) для page.goto.", url, MAX_GOTO_RETRIES, exc_info=False)
+                data.add_error(f"Превышено {MAX_GOTO_RETRIES} попыток goto: {type(last_goto_error).__name__} - {str(last_goto_error).splitlines()[0]}", ERROR_GOTO_FAILED)
         except Exception as e:
              last_goto_error = e
-             logging.error(f"[{url}] НЕОЖИДАННАЯ ошибка при page.goto (попытка {attempt + 1}): {e}", exc_info=True)
-             data['error'] = f"Неожиданная ошибка goto: {type(e).__name__} - {str(e)}"
+             logger.error("[%s] НЕОЖИДАННАЯ ошибка при page.goto (попытка %s): %s", url, attempt + 1, e, exc_info=True)
+             data.add_error(f"Неожиданная ошибка goto: {type(e).__name__} - {str(e)}", ERROR_GOTO_UNEXPECTED)
              break
 
+    if goto_success and capture:
+        with stage_timer(timings, 'api_capture'):
+            api_record = await capture_profile_from_api(page, url, capture)
+        if api_record:
+            data.update_from(api_record)
+            logger.info("[%s] Данные получены из ответов API. Подписчики: '%s'.", url, data.followers if data.followers is not None else 'N/A')
+            return data
+
     if goto_success:
         try:
             cookie_button_selector = "#onetrust-accept-btn-handler"
-            try:
-                await page.locator(cookie_button_selector).click(timeout=cookie_click_timeout)
-                logging.info(f"[{url}] Баннер с куки нажат.")
-                await page.wait_for_timeout(random.randint(100, 300))
-            except PlaywrightTimeoutError:
-                logging.info(f"[{url}] Баннер с куки не найден/кликабелен в течение {cookie_click_timeout/1000}с.")
-            except Exception as e_cookie:
-                logging.warning(f"[{url}] Ошибка при обработке баннера куки: {e_cookie}")
+            with stage_timer(timings, 'cookie'):
+                try:
+                    await page.locator(cookie_button_selector).click(timeout=cookie_click_timeout)
+                    logger.info("[%s] Баннер с куки нажат.", url)
+                    await page.wait_for_timeout(random.randint(100, 300))
+                except PlaywrightTimeoutError:
+                    logger.info("[%s] Баннер с куки не найден/кликабелен в течение %sс.", url, cookie_click_timeout/1000)
+                except Exception as e_cookie:
+                    logger.warning("[%s] Ошибка при обработке баннера куки: %s", url, e_cookie)
 
             content_selectors = "div.web-profiles, div.biographyText, div.truncatedUserDescription, a[href$='/followers']"
-            try:
-                await page.wait_for_selector(content_selectors, state='attached', timeout=content_selector_timeout)
-                logging.info(f"[{url}] Ключевые элементы (или их часть) найдены.")
-            except PlaywrightTimeoutError:
-                logging.warning(f"[{url}] Ключевые элементы не загрузились в течение {content_selector_timeout/1000}с.")
-                data['error'] = (data.get('error', '') + ";Ключевые элементы не найдены").strip(';')
-            html_content = await page.content()
-            parsed_specific_data = parse_soundcloud_profile_html(html_content, url)
-            current_error = data.get('error', '')
-            data.update(parsed_specific_data)
-            if current_error:
-                 data['error'] = (current_error + ";" + data.get('error', '')).strip(';')
-
-            logging.info(f"[{url}] Успешно обработан и распарсен. Подписчики: '{data.get('followers', 'N/A')}'.")
+            with stage_timer(timings, 'selector_wait'):
+                try:
+                    await page.wait_for_selector(content_selectors, state='attached', timeout=content_selector_timeout)
+                    logger.info("[%s] Ключевые элементы (или их часть) найдены.", url)
+                except PlaywrightTimeoutError:
+                    logger.warning("[%s] Ключевые элементы не загрузились в течение %sс.", url, content_selector_timeout/1000)
+                    data.add_error("Ключевые элементы не найдены", ERROR_CONTENT_MISSING)
+            if parse_pool:
+                parsed_specific_data = await parse_pool.parse_page(page, url, timings)
+            else:
+                with stage_timer(timings, 'page_content'):
+                    html_content = await page.content()
+                with stage_timer(timings, 'parse'):
+                    parsed_specific_data = parse_soundcloud_profile_html(html_content, url)
+            data.update_from(parsed_specific_data)
+
+            logger.info("[%s] Успешно обработан и распарсен. Подписчики: '%s'.", url, data.followers if data.followers is not None else 'N/A')
         except Exception as e_process:
-            logging.error(f"[{url}] Ошибка при обработке/парсинге страницы ПОСЛЕ goto: {e_process}", exc_info=True)
-            data['error'] = (data.get('error', '') + f";Ошибка обработки/парсинга: {type(e_process).__name__}").strip(';')
+            logger.error("[%s] Ошибка при обработке/парсинге страницы ПОСЛЕ goto: %s", url, e_process, exc_info=True)
+            data.add_error(f"Ошибка обработки/парсинга: {type(e_process).__name__}", ERROR_PARSE_FAILED)
     return data
 
 
 async def playwright_tasks_for_worker(
         urls_chunk: list,
-        proxy_config: dict | None,
+        proxy_configs: list[dict | None],
         csv_filename: str,
         csv_lock: mp.Lock,
-        retry_queue: mp.Queue = None
+        retry_queue: mp.Queue = None,
+        worker_label: str | None = None,
+        pages_per_worker: int = 1,
+        extra_fields: dict | None = None,
+        ws_endpoint: str | None = None,
+        hedge_proxy_config: dict | None = None
     ) -> int:
+    """hedge_proxy_config - другой прокси для дублей воркера с одним маршрутом (см. BrowserSession)."""
     successful_count = 0
     worker_name = mp.current_process().name
-    is_actually_using_proxy = bool(proxy_config)
+    proxy_configs = proxy_configs or [None]
+    is_actually_using_proxy = any(proxy_configs)
+    metrics_worker_label = worker_label or worker_name
+    proxies_log = ', '.join(cfg.get('server', 'N/A') for cfg in proxy_configs if cfg)
+    # Дополнительные колонки (напр. node_id) дописываются в конец схемы CSV
+    csv_fieldnames = PROFILE_CSV_FIELDNAMES + [key for key in (extra_fields or {}) if key not in PROFILE_CSV_FIELDNAMES]
+    hedge_policy = HedgePolicy()
+    if drain_requested():
+        logger.info("Воркер %s: Идет остановка, %s URL не обрабатываются.", worker_name, len(urls_chunk))
+        return 0
 
     async with async_playwright() as p:
-        browser_launch_options = {"headless": True}
         if is_actually_using_proxy:
-            browser_launch_options["proxy"] = proxy_config
-            logging.info(f"Воркер {worker_name} (прокси: {proxy_config.get('server', 'N/A')}) запускается.")
+            logger.info("Воркер %s (прокси: %s) запускается.", worker_name, proxies_log)
         else:
-            logging.info(f"Воркер {worker_name} (БЕЗ прокси) запускается.")
-        browser = None
+            logger.info("Воркер %s (БЕЗ прокси) запускается.", worker_name)
+        asset_cache = get_asset_cache()
+        session = BrowserSession(p, proxy_configs, worker_name, ws_endpoint, asset_cache,
+                                 hedge_spare_context=hedge_policy.enabled, hedge_proxy_config=hedge_proxy_config)
+        if hedge_policy.enabled and len(session.slots) < 2:
+            # Дубль на том же маршруте повторил бы медленный прокси основной попытки
+            hedge_policy.disable("нет другого маршрута для дубля (воркер без прокси, в пуле нет прокси)")
         try:
-            browser = await p.chromium.launch(**browser_launch_options)
-            logging.info(f"Воркер {worker_name}: Браузер Chromium запущен.")
+            await session.start()
         except Exception as e:
-            err_msg = f"Не удалось запустить браузер {'с прокси ' + proxy_config.get('server') if is_actually_using_proxy else 'без прокси'}: {e}"
-            logging.error(err_msg)
+            logger.error("Не удалось запустить браузер %s: %s", 'с прокси ' + proxies_log if is_actually_using_proxy else 'без прокси', e)
+            await session.close()
             if retry_queue:
-                 logging.warning(f"Воркер {worker_name}: Передача {len(urls_chunk)} URL в очередь ретрая (ошибка запуска браузера).")
+                 logger.warning("Воркер %s: Передача %s URL в очередь ретрая (ошибка запуска браузера).", worker_name, len(urls_chunk))
                  for url_to_retry in urls_chunk: retry_queue.put(url_to_retry)
             return 0
 
-        context = None
+        parse_pool = get_parse_pool()
         try:
-            context = await browser.new_context(
-                 user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/100.0.4896.127 Safari/537.36"
-            )
-            logging.info(f"Воркер {worker_name}: Контекст создан.")
+            logger.info("Воркер %s: Начинаю обработку %s URL.", worker_name, len(urls_chunk))
+            pages_semaphore = asyncio.Semaphore(max(1, pages_per_worker))
 
-            logging.info(f"Воркер {worker_name}: Начинаю обработку {len(urls_chunk)} URL.")
-            for i, url_to_process in enumerate(urls_chunk):
-                logging.info(f"Воркер {worker_name}: URL {i+1}/{len(urls_chunk)}: {url_to_process}")
+            async def run_attempt(url_to_process: str, attempt_state: dict, exclude=None) -> ProfileRecord:
+                """Одна попытка обработки URL на одном маршруте. Страница освобождается и при отмене попытки."""
                 page = None
-                result_data = None
-                process_error_occurred = False
                 try:
-                    page = await context.new_page()
-                    result_data = await process_single_url_in_worker(page, url_to_process)
+                    page, attempt_state['slot'] = await session.acquire_page(exclude)
+                    return await process_single_url_in_worker(page, url_to_process, attempt_state['timings'], parse_pool)
+                finally:
+                    if page:
+                        await session.release_page(page, attempt_state['slot'], url_to_process)
+
+            async def handle_url(i: int, url_to_process: str):
+                nonlocal successful_count
+                async with pages_semaphore:
+                    if drain_requested():
+                        # Не начат - оркестратор вернет URL в набор ожидающих
+                        logger.info("[%s] Идет остановка, URL не обрабатывается.", url_to_process)
+                        return
+                    logger.info("Воркер %s: URL %s/%s: %s", worker_name, i+1, len(urls_chunk), url_to_process)
+                    result_data = None
+                    process_error_occurred = False
+                    url_timings = {}
+                    attempt_state = {'slot': None, 'timings': url_timings}
+                    url_started_at = time.perf_counter()
+                    hedge_policy.observe_start()
+                    try:
+                        result_data, winner_state = await run_hedged(hedge_policy, run_attempt, url_to_process, attempt_state)
+                        attempt_state = winner_state
+                        url_timings = winner_state['timings']
+
+                        if result_data and not result_data.ok:
+                            process_error_occurred = True
+                        elif result_data:
+                            successful_count += 1
+                            hedge_policy.observe_latency(time.perf_counter() - url_started_at)
+                        else:
+                            process_error_occurred = True;
+                            result_data = ProfileRecord(url_to_process, error='Worker process_single_url_in_worker вернул None', error_code=ERROR_EMPTY_RESULT)
 
-                    if result_data and result_data.get('error'):
+                    except Exception as page_err:
                         process_error_occurred = True
-                    elif result_data:
-                        successful_count += 1
-                    else:
-                        process_error_occurred = True;
-                        result_data = {'url': url_to_process, 'error': 'Worker process_single_url_in_worker вернул None'}
-
-                except Exception as page_err:
-                    process_error_occurred = True
-                    logging.error(f"[{url_to_process}] Критическая ошибка на уровне страницы/задачи в playwright_tasks_for_worker: {page_err}", exc_info=True)
-                    if result_data is None: result_data = {'url': url_to_process, 'error': ''}
-                    result_data['error'] = (result_data.get('error', '') + f";Крит. ошибка page/task: {str(page_err)}").strip(';')
-                finally:
-                    if page and not page.is_closed():
-                         try: await page.close()
-                         except Exception as e: logging.warning(f"[{url_to_process}] Ошибка при закрытии страницы: {e}")
-
-                if result_data:
-                    if not process_error_occurred:
-                        append_to_csv(result_data, csv_filename, DEFAULT_CSV_FIELDNAMES, csv_lock)
-                    elif retry_queue:
-                        log_msg_proxy_status = "с прокси" if is_actually_using_proxy else "без прокси (в пуле)"
-                        logging.info(f"[{url_to_process}] Ошибка в воркере пула ({log_msg_proxy_status}), добавление в очередь ретрая. Ошибка: {result_data.get('error')}")
-                        retry_queue.put(url_to_process)
-                    else:
-                         logging.warning(f"[{url_to_process}] Ошибка (основной прямой воркер или его ретрай), результат не записывается, в очередь не добавляется: {result_data.get('error')}")
-
-                if i < len(urls_chunk) - 1:
-                    delay = random.uniform(0.1, 0.5)
-                    logging.info(f"[{url_to_process}] Пауза {delay:.2f} сек перед следующим URL в чанке...")
-                    await asyncio.sleep(delay)
-
-            logging.info(f"Воркер {worker_name}: Обработка чанка из {len(urls_chunk)} URL завершена. Успешно: {successful_count}.")
+                        logger.error("[%s] Критическая ошибка на уровне страницы/задачи в playwright_tasks_for_worker: %s", url_to_process, page_err, exc_info=True)
+                        if result_data is None: result_data = ProfileRecord(url_to_process)
+                        result_data.add_error(f"Крит. ошибка page/task: {str(page_err)}", ERROR_TASK_FAILED)
+                    slot = attempt_state['slot']
+
+                    if result_data:
+                        if not process_error_occurred:
+                            if extra_fields:
+                                result_data.extra = extra_fields
+                            with stage_timer(url_timings, 'csv_write'):
+                                append_to_csv(result_data, csv_filename, csv_fieldnames, csv_lock)
+                        elif retry_queue:
+                            log_msg_proxy_status = "с прокси" if is_actually_using_proxy else "без прокси (в пуле)"
+                            logger.info("[%s] Ошибка в воркере пула (%s), добавление в очередь ретрая. Ошибка [%s]: %s", url_to_process, log_msg_proxy_status, result_data.error_code, result_data.error)
+                            retry_queue.put(url_to_process)
+                        else:
+                             logger.warning("[%s] Ошибка (основной прямой воркер или его ретрай), результат не записывается, в очередь не добавляется [%s]: %s", url_to_process, result_data.error_code, result_data.error)
+
+                    url_timings['total'] = time.perf_counter() - url_started_at
+                    report_url_timings(url_to_process, metrics_worker_label, slot.label if slot else 'direct', url_timings, not process_error_occurred)
+
+                    if i < len(urls_chunk) - 1 and not drain_requested():
+                        # Пауза внутри семафора: каждый слот страницы выдерживает паузу между своими URL
+                        delay = random.uniform(0.1, 0.5)
+                        logger.info("[%s] Пауза %.2f сек перед следующим URL в чанке...", url_to_process, delay)
+                        await asyncio.sleep(delay)
+
+            # При pages_per_worker=1 URL обрабатываются строго по очереди, как и раньше
+            await asyncio.gather(*(handle_url(i, url) for i, url in enumerate(urls_chunk)))
+
+            logger.info("Воркер %s: Обработка чанка из %s URL завершена. Успешно: %s.", worker_name, len(urls_chunk), successful_count)
+            hedge_policy.log_summary(worker_name)
 
         except Exception as context_err:
-             logging.error(f"Воркер {worker_name}: Ошибка на уровне контекста браузера: {context_err}", exc_info=True)
+             logger.error("Воркер %s: Ошибка на уровне контекста браузера: %s", worker_name, context_err, exc_info=True)
              if retry_queue:
-                 logging.warning(f"Воркер {worker_name}: Передача {len(urls_chunk)} URL в очередь ретрая (ошибка контекста).")
+                 logger.warning("Воркер %s: Передача %s URL в очередь ретрая (ошибка контекста).", worker_name, len(urls_chunk))
                  for url_to_retry in urls_chunk: retry_queue.put(url_to_retry)
         finally:
-            if context:
-                 try: await context.close()
-                 except Exception as e: logging.warning(f"Воркер {worker_name}: Ошибка при закрытии контекста: {e}")
-            if browser:
-                 try: await browser.close()
-                 except Exception as e: logging.warning(f"Воркер {worker_name}: Ошибка при закрытии браузера: {e}")
-            logging.info(f"Воркер {worker_name}: Все ресурсы Playwright освобождены.")
+            await session.close()
+            if asset_cache:
+                asset_cache.report(metrics_worker_label)
+                asset_cache.log_summary(worker_name)
+            logger.info("Воркер %s: Все ресурсы Playwright освобождены.", worker_name)
 
     return successful_count
 
 
 def run_worker_task(
         urls_chunk: list,
-        proxy_string: str | None,
+        proxy_string: str | list[str] | None,
         csv_filename: str,
         csv_lock: mp.Lock,
-        retry_queue: mp.Queue = None
+        retry_queue: mp.Queue = None,
+        worker_label: str | None = None,
+        pages_per_worker: int = 1,
+        extra_fields: dict | None = None,
+        ws_endpoint: str | None = None,
+        hedge_proxy: str | None = None
     ) -> int:
     process_name = mp.current_process().name
-    proxy_cfg = parse_proxy_string(proxy_string)
+    # Список прокси - один браузер с отдельным контекстом на каждый прокси
+    if isinstance(proxy_string, list):
+        proxy_cfgs = [cfg for cfg in (parse_proxy_string(ps) for ps in proxy_string) if cfg] or [None]
+    else:
+        proxy_cfgs = [parse_proxy_string(proxy_string)]
     successful_count = 0
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
     try:
-        successful_count = loop.run_until_complete(
-            playwright_tasks_for_worker(urls_chunk, proxy_cfg, csv_filename, csv_lock, retry_queue)
-        )
+        with profiled(f"worker-{worker_label or process_name}"):
+            successful_count = loop.run_until_complete(
+                playwright_tasks_for_worker(urls_chunk, proxy_cfgs, csv_filename, csv_lock, retry_queue, worker_label, pages_per_worker, extra_fields, ws_endpoint,
+                                            parse_proxy_string(hedge_proxy))
+            )
     except Exception as e:
-        logging.error(f"Критическая ошибка в цикле событий воркера {process_name} (run_worker_task): {e}", exc_info=True)
+        logger.error("Критическая ошибка в цикле событий воркера %s (run_worker_task): %s", process_name, e, exc_info=True)
         if retry_queue:
-            logging.error(f"Воркер {process_name}: Критическая ошибка в run_worker_task, передача {len(urls_chunk)} URL в очередь ретрая.")
+            logger.error("Воркер %s: Критическая ошибка в run_worker_task, передача %s URL в очередь ретрая.", process_name, len(urls_chunk))
             for url_to_retry in urls_chunk: retry_queue.put(url_to_retry)
     finally:
         try:
@@ -221,5 +351,5 @@ def run_worker_task(
                 loop.run_until_complete(asyncio.sleep(0.1))
                 loop.close()
         except Exception as loop_close_err:
-            logging.error(f"Воркер {process_name}: Ошибка при закрытии цикла событий: {loop_close_err}")
+            logger.error("Воркер %s: Ошибка при закрытии цикла событий: %s", process_name, loop_close_err)
     return successful_count
\ No newline at end of file
@@ -0,0 +1,290 @@
+# metrics_utils.py
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging.handlers import RotatingFileHandler
+
+logger = logging.getLogger(__name__)
+
+# --- Настройки (переопределяются через переменные окружения) ---
+# off - метрики не собираются, jsonl - только файл, http - только эндпоинт /metrics, both - и то, и другое
+METRICS_MODE = os.environ.get('METRICS_MODE', 'jsonl').strip().lower()
+METRICS_HTTP_HOST = os.environ.get('METRICS_HTTP_HOST', '0.0.0.0')
+METRICS_HTTP_PORT = int(os.environ.get('METRICS_HTTP_PORT', 9108))
+METRICS_JSONL_FILENAME = "url_timings.jsonl"
+METRICS_JSONL_MAX_BYTES = int(os.environ.get('METRICS_JSONL_MAX_BYTES', 50 * 1024 * 1024))
+METRICS_JSONL_BACKUP_COUNT = int(os.environ.get('METRICS_JSONL_BACKUP_COUNT', 5))
+
+# Этапы обработки одного URL, для которых снимаются тайминги (api_capture - ожидание JSON-ответов API,
+# hedge_wasted - время проигравшей дублирующей попытки)
+URL_STAGES = ('goto', 'api_capture', 'cookie', 'selector_wait', 'parse_wait', 'page_content', 'parse', 'csv_write', 'total', 'hedge_wasted')
+# Этап запуска процесса-воркера (отдельное событие, не привязанное к URL)
+PROCESS_START_STAGE = 'process_start'
+# Границы бакетов гистограммы в секундах (последний бакет +Inf добавляется автоматически)
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 15.0, 30.0, 60.0, 120.0, 180.0)
+
+# Очередь метрик текущего процесса-воркера (устанавливается через init_worker_metrics)
+_metrics_queue = None
+
+
+def metrics_enabled() -> bool:
+    return METRICS_MODE in ('jsonl', 'http', 'both')
+
+
+def init_worker_metrics(metrics_queue):
+    """Запоминает очередь метрик в процессе-воркере. None - метрики в этом процессе отключены."""
+    global _metrics_queue
+    _metrics_queue = metrics_queue
+
+
+@contextmanager
+def stage_timer(timings: dict | None, stage: str):
+    """
+    Замеряет длительность блока и добавляет ее (в секундах) к timings[stage].
+    Если timings=None, замер не производится.
+    """
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + (time.perf_counter() - start)
+
+
+def report_url_timings(url: str, worker: str, proxy: str, timings: dict, ok: bool):
+    """Отправляет тайминги одного URL коллектору в основном процессе. Ошибки отправки не должны ломать воркер."""
+    if _metrics_queue is None or not timings:
+        return
+    try:
+        _metrics_queue.put({
+            'ts': time.time(), 'url': url, 'worker': worker, 'proxy': proxy or 'direct',
+            'ok': ok, 'timings': timings,
+        })
+    except Exception as e:
+        logger.debug("[%s] Не удалось отправить метрики: %s", url, e)
+
+
+def report_process_start(worker: str, seconds: float):
+    """Отправляет время запуска процесса-воркера (от запуска в оркестраторе до готовности воркера)."""
+    if _metrics_queue is None:
+        return
+    try:
+        _metrics_queue.put({'ts': time.time(), 'worker': worker, 'proxy': '-', 'timings': {PROCESS_START_STAGE: seconds}})
+    except Exception as e:
+        logger.debug("Не удалось отправить метрику запуска процесса %s: %s", worker, e)
+
+
+def report_counters(worker: str, counters: dict):
+    """Отправляет приращения счетчиков, не привязанных к URL (напр. попадания в кэш ресурсов)."""
+    if _metrics_queue is None or not counters:
+        return
+    try:
+        _metrics_queue.put({'ts': time.time(), 'worker': worker, 'proxy': '-', 'counters': counters})
+    except Exception as e:
+        logger.debug("Не удалось отправить счетчики %s: %s", worker, e)
+
+
+class Histogram:
+    """Кумулятивная гистограмма в стиле Prometheus."""
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последний элемент - +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for idx, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[idx] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self) -> list[int]:
+        result, running = [], 0
+        for c in self.counts:
+            running += c
+            result.append(running)
+        return result
+
+
+class MetricsRegistry:
+    """Гистограммы таймингов этапов с метками (stage, worker, proxy)."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._histograms: dict[tuple[str, str, str], Histogram] = {}
+        self._urls_total: dict[tuple[str, str, bool], int] = {}
+        self._counters: dict[tuple[str, str], float] = {}
+        self._lock = threading.Lock()
+
+    def observe_url(self, event: dict):
+        worker = event.get('worker', '')
+        proxy = event.get('proxy', 'direct')
+        with self._lock:
+            if 'url' in event:  # события без URL (напр. запуск процесса) в счетчик URL не входят
+                key_total = (worker, proxy, bool(event.get('ok')))
+                self._urls_total[key_total] = self._urls_total.get(key_total, 0) + 1
+            for stage, seconds in event.get('timings', {}).items():
+                key = (stage, worker, proxy)
+                hist = self._histograms.get(key)
+                if hist is None:
+                    hist = self._histograms[key] = Histogram(self.buckets)
+                hist.observe(seconds)
+            for name, value in event.get('counters', {}).items():
+                key = (name, worker)
+                self._counters[key] = self._counters.get(key, 0) + value
+
+    def render_prometheus(self) -> str:
+        """Текстовый формат экспозиции Prometheus."""
+        lines = [
+            "# HELP scraper_stage_seconds Длительность этапа обработки URL.",
+            "# TYPE scraper_stage_seconds histogram",
+        ]
+        with self._lock:
+            for (stage, worker, proxy), hist in sorted(self._histograms.items()):
+                labels = f'stage="{stage}",worker="{worker}",proxy="{proxy}"'
+                for bound, cum in zip(list(self.buckets) + ['+Inf'], hist.cumulative_counts()):
+                    lines.append(f'scraper_stage_seconds_bucket{{{labels},le="{bound}"}} {cum}')
+                lines.append(f'scraper_stage_seconds_sum{{{labels}}} {hist.sum:.6f}')
+                lines.append(f'scraper_stage_seconds_count{{{labels}}} {hist.count}')
+            lines.append("# HELP scraper_urls_total Обработанные URL.")
+            lines.append("# TYPE scraper_urls_total counter")
+            for (worker, proxy, ok), count in sorted(self._urls_total.items()):
+                lines.append(f'scraper_urls_total{{worker="{worker}",proxy="{proxy}",ok="{str(ok).lower()}"}} {count}')
+            for name in sorted({name for name, _worker in self._counters}):
+                lines.append(f"# TYPE scraper_{name}_total counter")
+                for (counter_name, worker), value in sorted(self._counters.items()):
+                    if counter_name == name:
+                        lines.append(f'scraper_{name}_total{{worker="{worker}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def stage_summary(self) -> dict[str, tuple[int, float]]:
+        """Сводка по этапам без учета меток: stage -> (кол-во замеров, среднее в секундах)."""
+        totals: dict[str, list] = {}
+        with self._lock:
+            for (stage, _worker, _proxy), hist in self._histograms.items():
+                acc = totals.setdefault(stage, [0, 0.0])
+                acc[0] += hist.count
+                acc[1] += hist.sum
+        return {stage: (cnt, (s / cnt) if cnt else 0.0) for stage, (cnt, s) in totals.items()}
+
+    def counter_summary(self) -> dict[str, float]:
+        """Сумма каждого счетчика по всем воркерам."""
+        totals: dict[str, float] = {}
+        with self._lock:
+            for (name, _worker), value in self._counters.items():
+                totals[name] = totals.get(name, 0) + value
+        return totals
+
+
+class MetricsCollector(threading.Thread):
+    """
+    Поток в основном процессе: вычитывает события из очереди метрик воркеров,
+    агрегирует их в гистограммы, пишет JSONL с ротацией и/или отдает /metrics по HTTP.
+    """
+
+    def __init__(self, metrics_queue, output_dir: str, mode: str = METRICS_MODE):
+        super().__init__(name="MetricsCollector", daemon=True)
+        self.metrics_queue = metrics_queue
+        self.registry = MetricsRegistry()
+        self.mode = mode
+        self._stop_event = threading.Event()
+        self._jsonl_logger = None
+        self._http_server = None
+
+        if mode in ('jsonl', 'both'):
+            metrics_dir = os.path.join(output_dir, "metrics")
+            os.makedirs(metrics_dir, exist_ok=True)
+            handler = RotatingFileHandler(
+                os.path.join(metrics_dir, METRICS_JSONL_FILENAME),
+                maxBytes=METRICS_JSONL_MAX_BYTES, backupCount=METRICS_JSONL_BACKUP_COUNT, encoding='utf-8'
+            )
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            self._jsonl_logger = logging.getLogger('metrics.jsonl')
+            self._jsonl_logger.handlers = [handler]
+            self._jsonl_logger.setLevel(logging.INFO)
+            self._jsonl_logger.propagate = False
+
+        if mode in ('http', 'both'):
+            self._start_http_server()
+
+    def _start_http_server(self):
+        registry = self.registry
+
+        class _MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip('/') != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):  # не засоряем основной лог запросами Prometheus
+                pass
+
+        try:
+            self._http_server = ThreadingHTTPServer((METRICS_HTTP_HOST, METRICS_HTTP_PORT), _MetricsHandler)
+            threading.Thread(target=self._http_server.serve_forever, name="MetricsHTTP", daemon=True).start()
+            logger.info("Метрики доступны по адресу http://%s:%s/metrics", METRICS_HTTP_HOST, METRICS_HTTP_PORT)
+        except OSError as e:
+            logger.error("Не удалось запустить HTTP-эндпоинт метрик на порту %s: %s", METRICS_HTTP_PORT, e)
+            self._http_server = None
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                event = self.metrics_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            except (EOFError, BrokenPipeError, OSError):
+                break
+            self._handle_event(event)
+        # Дочитываем то, что осталось в очереди на момент остановки
+        while True:
+            try:
+                self._handle_event(self.metrics_queue.get_nowait())
+            except Exception:
+                break
+
+    def _handle_event(self, event):
+        if not isinstance(event, dict):
+            return
+        self.registry.observe_url(event)
+        if self._jsonl_logger:
+            self._jsonl_logger.info(json.dumps(event, ensure_ascii=False))
+
+    def stop(self, timeout: float = 5.0):
+        self._stop_event.set()
+        self.join(timeout=timeout)
+        if self._http_server:
+            self._http_server.shutdown()
+            self._http_server.server_close()
+        for stage, (count, avg) in sorted(self.registry.stage_summary().items()):
+            logger.info("Метрики: этап '%s': замеров %s, среднее %.3f сек.", stage, count, avg)
+        for name, value in sorted(self.registry.counter_summary().items()):
+            logger.info("Метрики: счетчик '%s': %s", name, value)
+
+
+def start_metrics_collector(metrics_queue, output_dir: str) -> MetricsCollector | None:
+    """Создает и запускает коллектор метрик, если метрики включены."""
+    if metrics_queue is None or not metrics_enabled():
+        return None
+    collector = MetricsCollector(metrics_queue, output_dir)
+    collector.start()
+    return collector
@@ -0,0 +1,111 @@
+# parse_offload.py
+"""
+Разбор HTML профиля вне цикла событий воркера. BeautifulSoup разбирает страницу синхронно, и при нескольких
+страницах в работе каждый разбор останавливает навигации и таймеры остальных. Здесь разбор выполняется в
+ограниченном пуле потоков или процессов, а цикл событий в это время продолжает вести браузер.
+"""
+import asyncio
+import concurrent.futures
+import logging
+import multiprocessing.util
+import os
+import signal
+
+from metrics_utils import stage_timer
+from profile_record import ProfileRecord
+from soundcloud_parser import parse_soundcloud_profile_html
+
+logger = logging.getLogger(__name__)
+
+# --- Настройки (переопределяются через переменные окружения) ---
+# thread - пул потоков (без копирования HTML между процессами, но разбор делит GIL с циклом событий);
+# process - пул процессов (разбор параллельно с браузером, HTML передается в процесс); inline - в цикле событий, как раньше
+PARSE_EXECUTOR = os.environ.get('PARSE_EXECUTOR', 'thread').strip().lower()
+PARSE_WORKERS = max(1, int(os.environ.get('PARSE_WORKERS', 2)))
+# Сколько страниц одного воркера могут одновременно ждать разбора; остальные не сериализуют DOM, пока не освободится место
+PARSE_MAX_PENDING = max(1, int(os.environ.get('PARSE_MAX_PENDING', PARSE_WORKERS * 2)))
+
+
+def _ignore_sigint():
+    # Ctrl+C приходит всей группе процессов; остановкой управляет оркестратор (см. shutdown_utils)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class HtmlParsePool:
+    """
+    Пул разбора HTML процесса-воркера (см. get_parse_pool). Переживает задачи воркера: каждая задача
+    работает в своем цикле событий, поэтому ограничитель очереди разбора создается заново для каждого цикла.
+    """
+
+    def __init__(self, mode: str = PARSE_EXECUTOR, workers: int = PARSE_WORKERS, max_pending: int = PARSE_MAX_PENDING):
+        self.mode = mode if mode in ('thread', 'process', 'inline') else 'thread'
+        self.workers = workers
+        self.max_pending = max_pending
+        self._pending: asyncio.Semaphore | None = None
+        self._pending_loop = None
+        self._executor = self._create_executor()
+
+    def _create_executor(self) -> concurrent.futures.Executor | None:
+        if self.mode == 'process':
+            return concurrent.futures.ProcessPoolExecutor(max_workers=self.workers, initializer=_ignore_sigint)
+        if self.mode == 'thread':
+            return concurrent.futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="HtmlParse")
+        return None
+
+    async def _run(self, html_content: str, url: str) -> ProfileRecord:
+        if self._executor is None:
+            return parse_soundcloud_profile_html(html_content, url)
+        loop = asyncio.get_running_loop()
+        executor = self._executor
+        try:
+            return await loop.run_in_executor(executor, parse_soundcloud_profile_html, html_content, url)
+        except concurrent.futures.BrokenExecutor as e:
+            # Процесс разбора упал (напр. по памяти) - пул пересоздается один раз, страница разбирается повторно
+            if self._executor is executor:
+                logger.warning("[%s] Пул разбора HTML сломан (%s), пересоздание.", url, e)
+                executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = self._create_executor()
+            return await loop.run_in_executor(self._executor, parse_soundcloud_profile_html, html_content, url)
+
+    def _pending_semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._pending_loop is not loop:
+            # Предыдущая задача воркера завершилась вместе со своим циклом, ожидающих разбора в нем нет
+            self._pending = asyncio.Semaphore(self.max_pending)
+            self._pending_loop = loop
+        return self._pending
+
+    async def parse_page(self, page, url: str, timings: dict | None = None) -> ProfileRecord:
+        """Сериализует DOM страницы и разбирает его в пуле. Место в очереди разбора занимается до page.content()."""
+        pending = self._pending_semaphore()
+        with stage_timer(timings, 'parse_wait'):
+            await pending.acquire()
+        try:
+            with stage_timer(timings, 'page_content'):
+                html_content = await page.content()
+            with stage_timer(timings, 'parse'):
+                return await self._run(html_content, url)
+        finally:
+            pending.release()
+
+    def close(self, wait: bool = False):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=True)
+            self._executor = None
+
+
+_process_pool: HtmlParsePool | None = None
+
+
+def get_parse_pool() -> HtmlParsePool:
+    """
+    Пул разбора HTML процесса-воркера: создается при первом вызове и переиспользуется всеми задачами процесса
+    (у основного прямого воркера задача - каждый ретрай). Закрывается при завершении процесса.
+    """
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = HtmlParsePool()
+        # atexit в процессах multiprocessing не вызывается, Finalize - вызывается. Приоритет выше, чем у очередей
+        # самого пула (10): их потоки закрываются после того, как процессам разбора передана остановка
+        multiprocessing.util.Finalize(_process_pool, _process_pool.close, kwargs={'wait': True}, exitpriority=100)
+    return _process_pool
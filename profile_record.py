@@ -0,0 +1,95 @@
+# profile_record.py
+"""
+Запись о профиле SoundCloud - общая для парсера, воркера и записи в CSV.
+Схема CSV (PROFILE_CSV_FIELDNAMES) задается здесь и только здесь.
+"""
+
+# Ссылки на внешние ресурсы профиля (строки, '' - не найдено)
+LINK_FIELDS = ('website', 'youtube', 'facebook', 'twitter', 'instagram', 'songkick', 'telegram', 'tiktok', 'linkedin')
+# Колонки выходного CSV в прежнем порядке; error_code в CSV не пишется (служебное поле для логов и метрик)
+PROFILE_CSV_FIELDNAMES = ['url', 'followers', *LINK_FIELDS, 'emails', 'error']
+
+# Коды ошибок обработки URL (первая ошибка записи определяет ее код)
+ERROR_GOTO_FAILED = 'goto_failed'
+ERROR_GOTO_UNEXPECTED = 'goto_unexpected'
+ERROR_CONTENT_MISSING = 'content_missing'
+ERROR_PARSE_FAILED = 'parse_failed'
+ERROR_TASK_FAILED = 'task_failed'
+ERROR_EMPTY_RESULT = 'empty_result'
+
+EMAILS_SEPARATOR = ', '
+
+
+class ProfileRecord:
+    """
+    Результат обработки одного профиля. followers - int или None (не найдено), emails - кортеж без дубликатов.
+    extra - дополнительные колонки CSV (напр. node_id). Сериализуется в pickle как кортеж значений.
+    """
+    __slots__ = ('url', 'followers', *LINK_FIELDS, 'emails', 'error', 'error_code', 'extra')
+
+    def __init__(self, url: str, followers: int | None = None, website: str = '', youtube: str = '', facebook: str = '',
+                 twitter: str = '', instagram: str = '', songkick: str = '', telegram: str = '', tiktok: str = '',
+                 linkedin: str = '', emails: tuple = (), error: str = '', error_code: str = '', extra: dict | None = None):
+        self.url = url
+        self.followers = followers
+        self.website = website
+        self.youtube = youtube
+        self.facebook = facebook
+        self.twitter = twitter
+        self.instagram = instagram
+        self.songkick = songkick
+        self.telegram = telegram
+        self.tiktok = tiktok
+        self.linkedin = linkedin
+        self.emails = tuple(emails)
+        self.error = error
+        self.error_code = error_code
+        self.extra = extra
+
+    def __reduce__(self):
+        # Позиционные аргументы в порядке __slots__ - дешевле словаря атрибутов при передаче между процессами
+        return (ProfileRecord, tuple(getattr(self, name) for name in ProfileRecord.__slots__))
+
+    def __repr__(self):
+        return f"ProfileRecord(url={self.url!r}, followers={self.followers!r}, error_code={self.error_code!r})"
+
+    @property
+    def ok(self) -> bool:
+        return not self.error
+
+    def add_error(self, message: str, code: str):
+        """Добавляет сообщение об ошибке (через ';'); код записи - код первой ошибки."""
+        self.error = f"{self.error};{message}" if self.error else message
+        if not self.error_code:
+            self.error_code = code
+
+    def update_from(self, other: 'ProfileRecord'):
+        """Переносит найденные парсером данные из other, сохраняя ошибки обеих записей."""
+        self.followers = other.followers
+        for name in LINK_FIELDS:
+            setattr(self, name, getattr(other, name))
+        self.emails = other.emails
+        if other.error:
+            self.add_error(other.error, other.error_code)
+
+    def csv_row(self, fieldnames: list[str]) -> list[str]:
+        """Значения для csv.writer в порядке fieldnames; неизвестные колонки берутся из extra."""
+        row = []
+        for name in fieldnames:
+            if name == 'followers':
+                row.append('' if self.followers is None else str(self.followers))
+            elif name == 'emails':
+                row.append(EMAILS_SEPARATOR.join(self.emails))
+            elif name in _CSV_ATTRIBUTES:
+                row.append(getattr(self, name))
+            else:
+                row.append(str((self.extra or {}).get(name, '')))
+        return row
+
+    def to_dict(self) -> dict:
+        """Строка CSV в виде словаря (формат прежних результатов воркера)."""
+        fieldnames = PROFILE_CSV_FIELDNAMES + [key for key in (self.extra or {}) if key not in _CSV_ATTRIBUTES]
+        return dict(zip(fieldnames, self.csv_row(fieldnames)))
+
+
+_CSV_ATTRIBUTES = frozenset(PROFILE_CSV_FIELDNAMES)
@@ -0,0 +1,144 @@
+# profiling_utils.py
+"""
+Профилирование по переменной окружения PROFILE_MODE:
+  off      - выключено (по умолчанию);
+  cprofile - детерминированный cProfile: <name>.prof (pstats/snakeviz) и <name>.txt (топ по суммарному времени);
+  sample   - сэмплирующий профайлер на sys._current_frames(): <name>.folded - стеки в свернутом формате
+             (flamegraph.pl, speedscope, inferno), перезаписывается каждые PROFILE_DUMP_INTERVAL_SECONDS и в конце.
+Файлы пишутся в output_files/profiles/, по одному набору на процесс и профилируемый блок.
+"""
+import cProfile
+import io
+import itertools
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# --- Настройки (переопределяются через переменные окружения) ---
+PROFILE_MODE = os.environ.get('PROFILE_MODE', 'off').strip().lower()
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join("output_files", "profiles"))
+PROFILE_SAMPLE_INTERVAL_MS = float(os.environ.get('PROFILE_SAMPLE_INTERVAL_MS', 10))
+# Промежуточная запись стеков в режиме sample (0 - только в конце)
+PROFILE_DUMP_INTERVAL_SECONDS = float(os.environ.get('PROFILE_DUMP_INTERVAL_SECONDS', 60))
+# 1 - сэмплировать все потоки процесса (логирование, метрики, пул прокси), 0 - только поток, открывший блок
+PROFILE_ALL_THREADS = os.environ.get('PROFILE_ALL_THREADS', '0') == '1'
+PROFILE_TOP_FUNCTIONS = 50
+
+# Профилирование не вкладывается: вложенные блоки (напр. run_worker_task внутри основного прямого воркера) пропускаются
+_active = False
+# Процесс пула выполняет много батчей - номер блока делает имена файлов уникальными
+_block_counter = itertools.count(1)
+
+
+def profiling_enabled() -> bool:
+    return PROFILE_MODE in ('cprofile', 'sample')
+
+
+def _profile_path(name: str, suffix: str) -> str:
+    safe_name = ''.join(ch if ch.isalnum() or ch in '-_.' else '_' for ch in name)
+    return os.path.join(PROFILE_DIR, f"{safe_name}-pid{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}-{next(_block_counter)}{suffix}")
+
+
+def _write_atomic(path: str, text: str):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+class StackSampler(threading.Thread):
+    """Сэмплирующий профайлер: раз в интервал снимает стеки потоков и считает одинаковые стеки."""
+
+    def __init__(self, output_path: str, target_thread_id: int | None):
+        super().__init__(name="StackSampler", daemon=True)
+        self.output_path = output_path
+        self.target_thread_id = target_thread_id
+        self.interval = max(0.001, PROFILE_SAMPLE_INTERVAL_MS / 1000)
+        self.stacks: Counter[str] = Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    @staticmethod
+    def _fold(frame, thread_name: str) -> str:
+        labels = []
+        while frame is not None:
+            code = frame.f_code
+            labels.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        labels.append(thread_name)
+        return ';'.join(reversed(labels))
+
+    def run(self):
+        own_id = threading.get_ident()
+        next_dump = time.monotonic() + PROFILE_DUMP_INTERVAL_SECONDS if PROFILE_DUMP_INTERVAL_SECONDS else None
+        while not self._stop_event.wait(self.interval):
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or (self.target_thread_id is not None and thread_id != self.target_thread_id):
+                    continue
+                self.stacks[self._fold(frame, thread_names.get(thread_id, str(thread_id)))] += 1
+            self.samples += 1
+            if next_dump is not None and time.monotonic() >= next_dump:
+                self.dump()
+                next_dump = time.monotonic() + PROFILE_DUMP_INTERVAL_SECONDS
+
+    def dump(self):
+        # Снимок счетчика: поток сэмплирования может дописывать его во время записи
+        lines = [f"{stack} {count}" for stack, count in list(self.stacks.items())]
+        _write_atomic(self.output_path, "\n".join(lines) + "\n")
+
+    def stop(self):
+        self._stop_event.set()
+        self.join(timeout=5)
+        self.dump()
+
+
+def _dump_cprofile(profiler: cProfile.Profile, name: str, seconds: float):
+    prof_path = _profile_path(name, '.prof')
+    profiler.dump_stats(prof_path)
+    report = io.StringIO()
+    pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(PROFILE_TOP_FUNCTIONS)
+    _write_atomic(prof_path[:-len('.prof')] + '.txt', report.getvalue())
+    logger.info("Профиль %s (cProfile, %.1f сек.) записан: %s", name, seconds, prof_path)
+
+
+@contextmanager
+def profiled(name: str):
+    """Профилирует блок в текущем процессе, если включен PROFILE_MODE. name - префикс имен файлов."""
+    global _active
+    if not profiling_enabled() or _active:
+        yield
+        return
+    _active = True
+    started_at = time.perf_counter()
+    profiler = None
+    sampler = None
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        if PROFILE_MODE == 'cprofile':
+            profiler = cProfile.Profile()
+            profiler.enable()
+        else:
+            sampler = StackSampler(_profile_path(name, '.folded'), None if PROFILE_ALL_THREADS else threading.get_ident())
+            sampler.start()
+        yield
+    finally:
+        _active = False
+        # Ошибка записи профиля не должна ломать работу и подменять исключение профилируемого блока
+        try:
+            if profiler:
+                profiler.disable()
+                _dump_cprofile(profiler, name, time.perf_counter() - started_at)
+            if sampler:
+                sampler.stop()
+                logger.info("Профиль %s (сэмплов: %s, %.1f сек.) записан: %s",
+                            name, sampler.samples, time.perf_counter() - started_at, sampler.output_path)
+        except OSError as e:
+            logger.error("Не удалось записать профиль %s: %s", name, e)
@@ -0,0 +1,114 @@
+# proxy_pool.py
+import concurrent.futures
+import logging
+import os
+import threading
+
+from proxy_utils import load_proxies_from_file
+
+logger = logging.getLogger(__name__)
+
+# --- Настройки (переопределяются через переменные окружения) ---
+# Как часто проверять, изменился ли файл прокси
+PROXY_FILE_WATCH_INTERVAL_SECONDS = float(os.environ.get('PROXY_FILE_WATCH_INTERVAL_SECONDS', 30))
+# Как часто перепроверять прокси текущего пула через check_proxies.check_proxy (0 - не перепроверять)
+PROXY_REVALIDATE_INTERVAL_SECONDS = float(os.environ.get('PROXY_REVALIDATE_INTERVAL_SECONDS', 900))
+PROXY_REVALIDATE_WORKERS = int(os.environ.get('PROXY_REVALIDATE_WORKERS', 20))
+
+
+def _read_proxy_file(proxy_file: str) -> list[str]:
+    return [p for p in load_proxies_from_file(proxy_file) if p]
+
+
+def _file_mtime(path: str) -> float | None:
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+class ProxyPool(threading.Thread):
+    """
+    Живой пул прокси для диспетчера батчей. Фоновый поток перечитывает файл прокси при его изменении,
+    отдельный поток периодически перепроверяет прокси пула, убирая нерабочие: долгая перепроверка
+    не задерживает подхват нового файла. Пул заменяется целиком (новый кортеж),
+    поэтому snapshot() всегда возвращает согласованный список без блокировок на чтение.
+    """
+
+    def __init__(self, proxy_file: str):
+        super().__init__(name="ProxyPool", daemon=True)
+        self.proxy_file = proxy_file
+        self._file_mtime = _file_mtime(proxy_file)
+        self._proxies: tuple[str, ...] = tuple(_read_proxy_file(proxy_file))
+        self._swap_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._revalidator = threading.Thread(target=self._revalidate_loop, name="ProxyRevalidate", daemon=True)
+        self.version = 0
+
+    def start(self):
+        super().start()
+        if PROXY_REVALIDATE_INTERVAL_SECONDS:
+            self._revalidator.start()
+
+    def snapshot(self) -> list[str]:
+        return list(self._proxies)
+
+    def _swap(self, build_pool, reason: str):
+        """Заменяет пул на build_pool(текущий пул) под блокировкой, чтобы параллельные замены не терялись."""
+        with self._swap_lock:
+            previous = self._proxies
+            self._proxies = tuple(build_pool(previous))
+            self.version += 1
+            current = self._proxies
+        logger.info("Пул прокси обновлен (%s): было %s, стало %s (версия %s).", reason, len(previous), len(current), self.version)
+
+    def reload_if_changed(self) -> bool:
+        mtime = _file_mtime(self.proxy_file)
+        if mtime is None or mtime == self._file_mtime:
+            return False
+        self._file_mtime = mtime
+        proxies = _read_proxy_file(self.proxy_file)
+        if not proxies:
+            # Файл мог быть перезаписан частично или проверка не нашла рабочих - пустой пул хуже старого
+            logger.warning("Файл прокси %s изменен, но не содержит прокси. Оставлен текущий пул (%s).", self.proxy_file, len(self._proxies))
+            return False
+        self._swap(lambda _previous: proxies, f"файл {self.proxy_file} изменен")
+        return True
+
+    def revalidate(self):
+        """Перепроверяет прокси пула; нерабочие удаляются (с учетом замен пула, случившихся во время проверки)."""
+        from check_proxies import check_proxy  # requests нужен только при перепроверке
+        checked = self._proxies
+        if not checked:
+            return
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, PROXY_REVALIDATE_WORKERS), thread_name_prefix="ProxyCheck") as executor:
+            results = list(executor.map(check_proxy, checked))
+        dead = {proxy for proxy, result in zip(checked, results) if not result}
+        if not dead:
+            logger.info("Перепроверка прокси: все %s рабочие.", len(checked))
+            return
+        if len(dead) == len(checked):
+            # Вероятнее проблема с сетью, чем смерть всех прокси разом
+            logger.warning("Перепроверка прокси: ни один из %s не ответил. Пул оставлен без изменений.", len(checked))
+            return
+        self._swap(lambda current: [proxy for proxy in current if proxy not in dead], f"перепроверка: нерабочих {len(dead)}")
+
+    def run(self):
+        while not self._stop_event.wait(PROXY_FILE_WATCH_INTERVAL_SECONDS):
+            try:
+                self.reload_if_changed()
+            except Exception as e:
+                logger.error("Ошибка обновления пула прокси: %s", e, exc_info=True)
+
+    def _revalidate_loop(self):
+        while not self._stop_event.wait(PROXY_REVALIDATE_INTERVAL_SECONDS):
+            try:
+                self.revalidate()
+            except Exception as e:
+                logger.error("Ошибка перепроверки пула прокси: %s", e, exc_info=True)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join(timeout=5)
+        if self._revalidator.is_alive():
+            self._revalidator.join(timeout=5)
@@ -2,6 +2,8 @@
 import logging
 from urllib.parse import urlparse, unquote
 
+logger = logging.getLogger(__name__)
+
 def parse_proxy_string(proxy_string: str | None) -> dict | None:
     """
     Парсит строку прокси в словарь для Playwright.
@@ -12,7 +14,7 @@ def parse_proxy_string(proxy_string: str | None) -> dict | None:
     try:
         parsed = urlparse(proxy_string)
         if not parsed.scheme or not parsed.hostname:
-            logging.warning(f"Некорректный формат строки прокси: '{proxy_string}'. Отсутствует схема или хост.")
+            logger.warning("Некорректный формат строки прокси: '%s'. Отсутствует схема или хост.", proxy_string)
             return None
         server_url = f"{parsed.scheme}://{parsed.hostname}"
         if parsed.port:
@@ -23,10 +25,10 @@ def parse_proxy_string(proxy_string: str | None) -> dict | None:
             proxy_config["username"] = unquote(parsed.username)
         if parsed.password:
             proxy_config["password"] = unquote(parsed.password)
-        logging.debug(f"Прокси '{proxy_string}' успешно разобран: {proxy_config}")
+        logger.debug("Прокси '%s' успешно разобран: %s", proxy_string, proxy_config)
         return proxy_config
     except Exception as e:
-        logging.error(f"Критическая ошибка при парсинге строки прокси '{proxy_string}': {e}")
+        logger.error("Критическая ошибка при парсинге строки прокси '%s': %s", proxy_string, e)
         return None
 
 def load_proxies_from_file(filepath="proxies.txt") -> list[str | None]:
@@ -46,16 +48,16 @@ def load_proxies_from_file(filepath="proxies.txt") -> list[str | None]:
                     else:
                         proxies.append(line)
         if proxies:
-            logging.info(f"Загружено {len(proxies)} прокси из файла {filepath}")
+            logger.info("Загружено %s прокси из файла %s", len(proxies), filepath)
             return proxies
         else:
-            logging.warning(f"Файл прокси {filepath} пуст или содержит только комментарии.")
+            logger.warning("Файл прокси %s пуст или содержит только комментарии.", filepath)
             return [None] 
     except FileNotFoundError:
-        logging.warning(f"Файл прокси {filepath} не найден.")
+        logger.warning("Файл прокси %s не найден.", filepath)
         return [None] 
     except Exception as e:
-        logging.error(f"Ошибка при чтении файла прокси {filepath}: {e}.")
+        logger.error("Ошибка при чтении файла прокси %s: %s.", filepath, e)
         return [None]
 
 if __name__ == '__main__':
@@ -0,0 +1,225 @@
+# recrawl_state.py
+"""
+Состояние инкрементального обновления: когда каждый профиль последний раз загружался и сколько у него подписчиков.
+
+Срок актуальности (TTL) профиля зависит от его уровня по подписчикам: крупные аккаунты обновляются чаще.
+Кандидаты на обновление - только профили с истекшим TTL; они выдаются из очереди с приоритетом
+"возраст / TTL", т.е. сначала самые устаревшие относительно своего уровня. Новые (ни разу не загруженные) URL - первыми.
+
+Файл состояния: RECRAWL_DB (SQLite). Начальное заполнение из уже собранного CSV:
+    python recrawl_state.py output_files/recrawl_state.sqlite import-csv output_files/soundcloud_profiles_batched.csv
+"""
+import argparse
+import csv
+import heapq
+import logging
+import os
+import sqlite3
+import time
+
+from compact_output import best_rows_by_url
+
+logger = logging.getLogger(__name__)
+
+# --- Настройки (переопределяются через переменные окружения) ---
+# Уровни "порог подписчиков:TTL в днях"; берется первый уровень, порог которого не больше числа подписчиков
+DEFAULT_RECRAWL_TIERS = "1000000:1,100000:3,10000:7,0:30"
+RECRAWL_TIERS = os.environ.get('RECRAWL_TIERS', DEFAULT_RECRAWL_TIERS)
+# Через сколько часов повторять профиль, последняя загрузка которого завершилась ошибкой
+RECRAWL_ERROR_RETRY_HOURS = float(os.environ.get('RECRAWL_ERROR_RETRY_HOURS', 6))
+SQLITE_BUSY_TIMEOUT_SECONDS = 60
+SECONDS_PER_DAY = 86400
+
+
+def parse_tiers(spec: str) -> list[tuple[int, float]]:
+    """'1000000:1,0:30' -> [(1000000, 86400.0), (0, 2592000.0)], по убыванию порога."""
+    tiers = []
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        threshold, _, ttl_days = part.partition(':')
+        try:
+            tiers.append((int(threshold), float(ttl_days) * SECONDS_PER_DAY))
+        except ValueError:
+            logger.warning("Некорректный уровень RECRAWL_TIERS '%s' пропущен.", part)
+    if not tiers:
+        tiers = [(0, 30.0 * SECONDS_PER_DAY)]
+    tiers.sort(key=lambda tier: tier[0], reverse=True)
+    if tiers[-1][0] > 0:
+        # Профили ниже минимального порога получают TTL самого младшего уровня
+        tiers.append((0, tiers[-1][1]))
+    return tiers
+
+
+def parse_followers(value) -> int | None:
+    try:
+        return int(str(value).strip())
+    except (TypeError, ValueError):
+        return None
+
+
+class RecrawlStore:
+    """Время загрузки и число подписчиков по URL. Используется только из основного процесса."""
+
+    def __init__(self, db_path: str, tiers_spec: str = RECRAWL_TIERS):
+        self.db_path = db_path
+        self.tiers = parse_tiers(tiers_spec)
+        self.error_retry_seconds = RECRAWL_ERROR_RETRY_HOURS * 3600
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self.conn = sqlite3.connect(db_path, timeout=SQLITE_BUSY_TIMEOUT_SECONDS)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS fetch_state ("
+            " url TEXT PRIMARY KEY,"
+            " last_success REAL,"
+            " last_attempt REAL,"
+            " last_ok INTEGER NOT NULL DEFAULT 0,"
+            " followers INTEGER,"
+            " last_error TEXT,"
+            " fetch_count INTEGER NOT NULL DEFAULT 0)"
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def ttl_for(self, followers: int | None) -> float:
+        if followers is None:
+            return self.tiers[-1][1]
+        for threshold, ttl in self.tiers:
+            if followers >= threshold:
+                return ttl
+        return self.tiers[-1][1]
+
+    def add_urls(self, urls) -> int:
+        """Регистрирует URL (еще не загруженные будут выданы первыми). Возвращает количество новых."""
+        before = self.conn.total_changes
+        self.conn.executemany("INSERT OR IGNORE INTO fetch_state (url) VALUES (?)", ((url,) for url in urls))
+        self.conn.commit()
+        return self.conn.total_changes - before
+
+    def _priority(self, now: float, last_success, last_attempt, last_ok, followers) -> float | None:
+        """Приоритет "возраст / TTL" (>= 1 - пора обновлять) или None, если профиль еще актуален."""
+        if last_attempt is None:
+            return float('inf')
+        if last_ok:
+            ttl = self.ttl_for(followers)
+            age = now - last_success
+        else:
+            # После ошибки - отдельный короткий интервал, чтобы не долбить недоступный профиль в каждом проходе
+            ttl = self.error_retry_seconds
+            age = now - last_attempt
+        if ttl <= 0:
+            return float('inf')
+        priority = age / ttl
+        return priority if priority >= 1 else None
+
+    def due_urls(self, limit: int | None = None, now: float | None = None) -> list[str]:
+        """URL с истекшим TTL, от самых устаревших (относительно TTL своего уровня) к менее устаревшим."""
+        now = now or time.time()
+        rows = self.conn.execute("SELECT url, last_success, last_attempt, last_ok, followers FROM fetch_state")
+        due = ((priority, url) for url, *state in rows
+               if (priority := self._priority(now, *state)) is not None)
+        if limit:
+            return [url for _, url in heapq.nlargest(limit, due)]
+        return [url for _, url in sorted(due, reverse=True)]
+
+    def next_due_in(self, now: float | None = None) -> float | None:
+        """Через сколько секунд истечет TTL ближайшего профиля (None - профилей нет)."""
+        now = now or time.time()
+        nearest = None
+        for last_success, last_attempt, last_ok, followers in self.conn.execute(
+                "SELECT last_success, last_attempt, last_ok, followers FROM fetch_state"):
+            if last_attempt is None:
+                return 0.0
+            if last_ok:
+                due_at = last_success + self.ttl_for(followers)
+            else:
+                due_at = last_attempt + self.error_retry_seconds
+            nearest = due_at if nearest is None else min(nearest, due_at)
+        return None if nearest is None else max(0.0, nearest - now)
+
+    def record_results(self, results: dict[str, dict], attempted_urls, fetched_at: float | None = None) -> dict:
+        """
+        Записывает итоги загрузки. results - лучшая строка CSV по URL; URL из attempted_urls без строки
+        считаются неудачной попыткой. Подписчики сохраняются только из успешных загрузок.
+        """
+        fetched_at = fetched_at or time.time()
+        ok_rows, failed_rows = [], []
+        for url in attempted_urls:
+            row = results.get(url)
+            if row is not None and not row.get('error'):
+                ok_rows.append((fetched_at, fetched_at, parse_followers(row.get('followers')), url))
+            else:
+                error = (row or {}).get('error') or "нет результата"
+                failed_rows.append((fetched_at, error, url))
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO fetch_state (url) VALUES (?)",
+            ((url,) for url in attempted_urls)
+        )
+        self.conn.executemany(
+            "UPDATE fetch_state SET last_success = ?, last_attempt = ?, last_ok = 1, followers = COALESCE(?, followers),"
+            " last_error = NULL, fetch_count = fetch_count + 1 WHERE url = ?",
+            ok_rows
+        )
+        self.conn.executemany(
+            "UPDATE fetch_state SET last_attempt = ?, last_ok = 0, last_error = ?, fetch_count = fetch_count + 1 WHERE url = ?",
+            failed_rows
+        )
+        self.conn.commit()
+        return {'ok': len(ok_rows), 'failed': len(failed_rows)}
+
+    def import_csv(self, csv_path: str, fetched_at: float | None = None) -> dict:
+        """
+        Начальное заполнение из ранее собранного CSV. Время загрузки строк неизвестно, поэтому берется
+        время изменения файла: уже собранные профили не будут загружаться повторно до истечения TTL.
+        """
+        fetched_at = fetched_at or os.path.getmtime(csv_path)
+        with open(csv_path, 'r', encoding='utf-8', newline='') as f:
+            results = best_rows_by_url(csv.DictReader(f))
+        return self.record_results(results, list(results), fetched_at)
+
+    def counts(self) -> dict:
+        now = time.time()
+        total = 0
+        due = 0
+        for state in self.conn.execute("SELECT last_success, last_attempt, last_ok, followers FROM fetch_state"):
+            total += 1
+            if self._priority(now, *state) is not None:
+                due += 1
+        return {'total': total, 'due': due}
+
+
+def read_csv_rows_since(csv_path: str, offset: int, fieldnames: list[str]) -> list[dict]:
+    """Строки, дописанные в CSV после позиции offset (размер файла до батча)."""
+    if not os.path.exists(csv_path):
+        return []
+    with open(csv_path, 'r', encoding='utf-8', newline='') as f:
+        f.seek(offset)
+        reader = csv.DictReader(f, fieldnames=fieldnames)
+        # Если файл был пуст до батча, первой строкой идет заголовок
+        return [row for row in reader if row.get('url') != 'url']
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    arg_parser = argparse.ArgumentParser(description="Состояние инкрементального обновления профилей.")
+    arg_parser.add_argument('db', help="Путь к файлу состояния (напр. output_files/recrawl_state.sqlite)")
+    sub = arg_parser.add_subparsers(dest='command', required=True)
+    import_cmd = sub.add_parser('import-csv', help="Заполнить из собранного CSV (время загрузки = время изменения файла)")
+    import_cmd.add_argument('csv_file')
+    sub.add_parser('status', help="Сколько профилей всего и сколько требуют обновления")
+    due_cmd = sub.add_parser('due', help="Показать первые URL очереди обновления")
+    due_cmd.add_argument('--limit', type=int, default=20)
+    args = arg_parser.parse_args()
+
+    store = RecrawlStore(args.db)
+    if args.command == 'import-csv':
+        print(f"Импортировано: {store.import_csv(args.csv_file)}")
+    elif args.command == 'due':
+        for due_url in store.due_urls(args.limit):
+            print(due_url)
+    print(f"Состояние: {store.counts()}")
+    store.close()
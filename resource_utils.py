@@ -0,0 +1,309 @@
+# resource_utils.py
+import logging
+import os
+import threading
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+# --- Настройки (переопределяются через переменные окружения) ---
+# Оценка RSS одного воркера (Python + драйвер Playwright + Chromium) до первого замера, МБ
+DEFAULT_WORKER_RSS_MB = int(os.environ.get('DEFAULT_WORKER_RSS_MB', 450))
+# Оценка прироста RSS на каждую дополнительную одновременно открытую страницу, МБ
+PAGE_RSS_MB = int(os.environ.get('PAGE_RSS_MB', 80))
+# Память, которую не отдаем воркерам (оркестратор, Manager, кэш ФС), МБ
+MEMORY_RESERVE_MB = int(os.environ.get('MEMORY_RESERVE_MB', 512))
+RSS_SAMPLE_INTERVAL_SECONDS = float(os.environ.get('RSS_SAMPLE_INTERVAL_SECONDS', 1.0))
+# Вес нового замера в скользящем среднем RSS воркера
+RSS_EMA_ALPHA = 0.5
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+_CGROUP_ROOT = "/sys/fs/cgroup"
+# Лимиты cgroup v1 без ограничения выглядят как очень большое число
+_CGROUP_V1_UNLIMITED = 1 << 60
+
+
+def _read_first_line(path: str) -> str | None:
+    try:
+        with open(path, 'r') as f:
+            return f.readline().strip()
+    except OSError:
+        return None
+
+
+def read_cgroup_memory_limit() -> int | None:
+    """Лимит памяти контейнера в байтах (cgroup v2, затем v1). None - лимита нет."""
+    value = _read_first_line(os.path.join(_CGROUP_ROOT, "memory.max"))
+    if value is None:
+        value = _read_first_line(os.path.join(_CGROUP_ROOT, "memory", "memory.limit_in_bytes"))
+    if not value or value == 'max':
+        return None
+    try:
+        limit = int(value)
+    except ValueError:
+        return None
+    return None if limit >= _CGROUP_V1_UNLIMITED else limit
+
+
+def read_cgroup_memory_usage() -> int | None:
+    """Текущее потребление памяти cgroup в байтах."""
+    value = _read_first_line(os.path.join(_CGROUP_ROOT, "memory.current"))
+    if value is None:
+        value = _read_first_line(os.path.join(_CGROUP_ROOT, "memory", "memory.usage_in_bytes"))
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+
+def read_cgroup_cpu_limit() -> float | None:
+    """Лимит CPU контейнера в ядрах (quota / period). None - лимита нет."""
+    value = _read_first_line(os.path.join(_CGROUP_ROOT, "cpu.max"))
+    try:
+        if value is not None:
+            quota, period = value.split()[:2]
+            if quota == 'max':
+                return None
+            return int(quota) / int(period)
+        quota = _read_first_line(os.path.join(_CGROUP_ROOT, "cpu", "cpu.cfs_quota_us"))
+        period = _read_first_line(os.path.join(_CGROUP_ROOT, "cpu", "cpu.cfs_period_us"))
+        if quota and period and int(quota) > 0:
+            return int(quota) / int(period)
+    except (ValueError, ZeroDivisionError):
+        pass
+    return None
+
+
+def read_mem_available() -> int | None:
+    """MemAvailable из /proc/meminfo в байтах."""
+    try:
+        with open("/proc/meminfo", 'r') as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def available_memory_bytes() -> int | None:
+    """Доступная память с учетом лимита cgroup: минимум из MemAvailable хоста и остатка до лимита контейнера."""
+    candidates = []
+    host_available = read_mem_available()
+    if host_available is not None:
+        candidates.append(host_available)
+    limit = read_cgroup_memory_limit()
+    usage = read_cgroup_memory_usage()
+    if limit is not None and usage is not None:
+        candidates.append(max(0, limit - usage))
+    return min(candidates) if candidates else None
+
+
+def available_cpus() -> float:
+    """Количество доступных ядер с учетом affinity и квоты cgroup."""
+    try:
+        cpus = float(len(os.sched_getaffinity(0)))
+    except (AttributeError, OSError):
+        cpus = float(os.cpu_count() or 1)
+    cgroup_cpus = read_cgroup_cpu_limit()
+    if cgroup_cpus is not None:
+        cpus = min(cpus, cgroup_cpus)
+    return max(1.0, cpus)
+
+
+def _process_rss(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/statm", 'r') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _children_map() -> dict[int, list[int]]:
+    children: dict[int, list[int]] = {}
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return children
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", 'r') as f:
+                # Имя процесса в скобках может содержать пробелы, поэтому режем по последней ')'
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    return children
+
+
+def _tree_rss(children: dict[int, list[int]], root_pid: int, include_root: bool) -> tuple[int, int]:
+    total = _process_rss(root_pid) if include_root else 0
+    stack = list(children.get(root_pid, []))
+    direct_children = len(stack)
+    while stack:
+        pid = stack.pop()
+        total += _process_rss(pid)
+        stack.extend(children.get(pid, []))
+    return total, direct_children
+
+
+def process_tree_rss(root_pid: int, include_root: bool = True) -> tuple[int, int]:
+    """
+    Суммарный RSS процесса и всех его потомков (в т.ч. драйвера Playwright и процессов Chromium).
+    Возвращает (байты, количество прямых потомков). Общие страницы учитываются в каждом процессе,
+    поэтому оценка завышена - это безопасная сторона для выбора числа воркеров.
+    """
+    return _tree_rss(_children_map(), root_pid, include_root)
+
+
+def _process_cmdline(pid: int) -> str:
+    try:
+        with open(f"/proc/{pid}/cmdline", 'rb') as f:
+            return f.read().replace(b'\0', b' ').decode('utf-8', 'replace')
+    except OSError:
+        return ''
+
+
+def child_trees_rss(root_pid: int, cmdline_marker: str) -> tuple[int, int]:
+    """
+    Суммарный RSS прямых потомков процесса, в командной строке которых есть cmdline_marker, вместе с их потомками.
+    Остальные потомки (напр. процессы пула разбора HTML) не учитываются. Возвращает (байты, количество найденных потомков).
+    """
+    children = _children_map()
+    matched = [pid for pid in children.get(root_pid, []) if cmdline_marker in _process_cmdline(pid)]
+    return sum(_tree_rss(children, pid, True)[0] for pid in matched), len(matched)
+
+
+def process_trees_rss(root_pids) -> dict[int, int]:
+    """RSS каждого из процессов вместе с его потомками: {pid: байты} (один обход /proc на все деревья)."""
+    children = _children_map()
+    return {pid: _tree_rss(children, pid, True)[0] for pid in set(root_pids)}
+
+
+class RssSampler(threading.Thread):
+    """
+    Фоновый поток: во время батча снимает пиковый RSS дерева каждого процесса-воркера (peak_worker_rss, {pid: байты})
+    и минимум доступной памяти.
+    Замеряются только воркеры: процессы, переданные в track(), и PID из worker_pids (их сообщают процессы пула
+    при старте, напр. список Manager). Manager, сервер процессов и браузеры супервизора в замер не попадают.
+    """
+
+    def __init__(self, worker_pids=None, interval: float = RSS_SAMPLE_INTERVAL_SECONDS):
+        super().__init__(name="RssSampler", daemon=True)
+        self.worker_pids = worker_pids
+        self.interval = interval
+        self.peak_worker_rss: dict[int, int] = {}
+        self.min_available = None
+        self._tracked_pids: set[int] = set()
+        self._stop_event = threading.Event()
+
+    def track(self, pid: int):
+        self._tracked_pids.add(pid)
+
+    def _root_pids(self) -> set[int]:
+        pids = set(self._tracked_pids)
+        if self.worker_pids is not None:
+            try:
+                pids.update(self.worker_pids[:])
+            except (OSError, EOFError):
+                pass  # Manager уже остановлен
+        return pids
+
+    def run(self):
+        while not self._stop_event.is_set():
+            for pid, rss in process_trees_rss(self._root_pids()).items():
+                if rss > self.peak_worker_rss.get(pid, 0):
+                    self.peak_worker_rss[pid] = rss
+            available = available_memory_bytes()
+            if available is not None:
+                self.min_available = available if self.min_available is None else min(self.min_available, available)
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join(timeout=self.interval * 2 + 1)
+
+
+@dataclass
+class SizingDecision:
+    pool_workers: int
+    pages_per_worker: int
+    reason: str
+
+
+class WorkerSizingPolicy:
+    """
+    Выбирает число воркеров пула и одновременно открытых страниц на воркер по лимитам CPU/памяти
+    контейнера и фактическому RSS воркера, измеренному в предыдущих батчах (первый батч - прогрев по оценке).
+    """
+
+    def __init__(self, desired_pool_workers: int, desired_pages_per_worker: int = 1):
+        self.desired_pool_workers = max(0, desired_pool_workers)
+        self.desired_pages_per_worker = max(1, desired_pages_per_worker)
+        self.worker_rss_bytes = DEFAULT_WORKER_RSS_MB * 1024 * 1024
+        self.measured = False
+        self.memory_pressure = False
+        self._last_pages = self.desired_pages_per_worker
+
+    def _worker_rss_at_pages(self, pages: int) -> int:
+        page_bytes = PAGE_RSS_MB * 1024 * 1024
+        base = max(page_bytes, self.worker_rss_bytes - self._last_pages * page_bytes)
+        return base + pages * page_bytes
+
+    def decide(self) -> SizingDecision:
+        cpus = available_cpus()
+        # Как и раньше: одно ядро остается основному процессу
+        cpu_cap = max(0, int(cpus) - 1)
+        target_workers = min(self.desired_pool_workers, cpu_cap)
+
+        available = available_memory_bytes()
+        if available is None:
+            decision = SizingDecision(target_workers, self.desired_pages_per_worker,
+                                      f"память не определена, лимит по CPU ({cpus:.1f} ядер)")
+        else:
+            budget = available - MEMORY_RESERVE_MB * 1024 * 1024
+            decision = None
+            # Сначала уменьшаем число страниц на воркер, и только потом - число воркеров
+            for pages in range(self.desired_pages_per_worker, 0, -1):
+                per_worker = self._worker_rss_at_pages(pages)
+                # Минус один: основной прямой воркер тоже запускает браузер
+                workers_by_memory = max(0, budget // per_worker - 1)
+                if workers_by_memory >= target_workers or pages == 1:
+                    workers = min(target_workers, workers_by_memory)
+                    decision = SizingDecision(
+                        int(workers), pages,
+                        f"доступно {available / 2**20:.0f} МБ, RSS воркера ~{per_worker / 2**20:.0f} МБ"
+                        f"{'' if self.measured else ' (оценка)'}, CPU {cpus:.1f}"
+                    )
+                    break
+
+        if self.memory_pressure and decision.pool_workers > 0:
+            decision = SizingDecision(max(1, decision.pool_workers // 2), 1,
+                                      decision.reason + "; нехватка памяти в прошлом батче - снижение вдвое")
+        self._last_pages = decision.pages_per_worker
+        return decision
+
+    def record_batch(self, sampler: RssSampler):
+        """
+        Обновляет оценку RSS воркера по замерам завершившегося батча: берется наибольший пик среди воркеров,
+        а не общий пик, деленный на число воркеров - воркеры завершаются в разное время, и среднее занижало бы оценку.
+        Нехватка памяти учитывается только при выборе размера следующего батча: текущий батч не уменьшается.
+        """
+        peaks = [rss for rss in sampler.peak_worker_rss.values() if rss > 0]
+        if peaks:
+            measured = max(peaks)
+            if self.measured:
+                self.worker_rss_bytes = int(RSS_EMA_ALPHA * measured + (1 - RSS_EMA_ALPHA) * self.worker_rss_bytes)
+            else:
+                self.worker_rss_bytes = int(measured)
+                self.measured = True
+            logger.info("Замер RSS: наибольший пик воркера %.0f МБ (процессов: %s), оценка RSS воркера %.0f МБ.",
+                        measured / 2**20, len(peaks), self.worker_rss_bytes / 2**20)
+        self.memory_pressure = (
+            sampler.min_available is not None and sampler.min_available < MEMORY_RESERVE_MB * 1024 * 1024
+        )
+        if self.memory_pressure:
+            logger.warning("Доступная память опускалась до %.0f МБ (резерв %s МБ). Следующий батч будет уменьшен.",
+                           sampler.min_available / 2**20, MEMORY_RESERVE_MB)
@@ -2,38 +2,75 @@
 import logging
 import os
 import multiprocessing as mp
-from concurrent.futures import ProcessPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
+from concurrent.futures import ProcessPoolExecutor, wait as futures_wait, FIRST_COMPLETED
 import time
 import math
+import random
 import queue # Для queue.Empty
 
 # Убедитесь, что эти файлы существуют и доступны
-from proxy_utils import load_proxies_from_file
+from proxy_pool import ProxyPool
 from csv_utils import initialize_csv_file # Мы модифицируем эту функцию для append_mode
-from main_worker import run_worker_task, DEFAULT_CSV_FIELDNAMES
-
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(processName)s - %(levelname)s - %(message)s')
+from profile_record import PROFILE_CSV_FIELDNAMES
+from metrics_utils import start_metrics_collector, metrics_enabled
+from logging_utils import start_logging_listener, get_log_queue
+from resource_utils import WorkerSizingPolicy, RssSampler
+from work_queue import LeaseQueue, LeaseHeartbeat, default_node_id, LEASE_SECONDS
+from browser_server import start_browser_supervisor
+from shard_utils import filter_urls_for_shard, shard_suffix
+from recrawl_state import RecrawlStore, best_rows_by_url, read_csv_rows_since
+from profiling_utils import profiled
+from shutdown_utils import DrainSignal, DRAIN_POLL_SECONDS, join_process, terminate_pool_processes
+
+# Явное имя: в дочерних процессах (spawn/forkserver) этот модуль импортируется как __mp_main__
+logger = logging.getLogger('run_parser')
 
 # --- Константы ---
+# Метод запуска процессов: forkserver - тяжелые модули (Playwright, bs4) импортируются один раз в сервере процессов,
+# и воркеры получают их готовыми; spawn - каждый воркер импортирует все заново (как раньше)
+MP_START_METHOD = os.environ.get('MP_START_METHOD', 'forkserver').strip().lower()
+# '__main__' - этот модуль: без него каждый воркер заново выполнял бы импорт run_parser
+FORKSERVER_PRELOAD = ['__main__', 'main_worker']
 DEFAULT_BATCH_SIZE = 20
 DEFAULT_DESIRED_POOL_WORKERS = 9 # Это значение по умолчанию
 DEFAULT_NUM_POOL_WORKERS_SPECIFICALLY_WITHOUT_PROXY = 4 # Это значение по умолчанию
+DEFAULT_PAGES_PER_WORKER = 1 # Одновременно открытых страниц в одном воркере
 
 BATCH_SIZE = int(os.environ.get('BATCH_SIZE', DEFAULT_BATCH_SIZE))
 DESIRED_POOL_WORKERS = int(os.environ.get('DESIRED_POOL_WORKERS', DEFAULT_DESIRED_POOL_WORKERS))
 NUM_POOL_WORKERS_SPECIFICALLY_WITHOUT_PROXY = int(os.environ.get('NUM_POOL_WORKERS_SPECIFICALLY_WITHOUT_PROXY', DEFAULT_NUM_POOL_WORKERS_SPECIFICALLY_WITHOUT_PROXY))
-
-logging.info(f"Using BATCH_SIZE: {BATCH_SIZE}")
-logging.info(f"Using DESIRED_POOL_WORKERS: {DESIRED_POOL_WORKERS}")
-logging.info(f"Using NUM_POOL_WORKERS_SPECIFICALLY_WITHOUT_PROXY: {NUM_POOL_WORKERS_SPECIFICALLY_WITHOUT_PROXY}")
+PAGES_PER_WORKER = int(os.environ.get('PAGES_PER_WORKER', DEFAULT_PAGES_PER_WORKER))
+# 1 - число воркеров и страниц выбирается по лимитам cgroup и замеренному RSS, 0 - только по числу CPU (как раньше)
+MEMORY_AWARE_SIZING = os.environ.get('MEMORY_AWARE_SIZING', '1') == '1'
+# 1 - воркер с прокси запускает один браузер и по контексту на каждый из PROXIES_PER_WORKER прокси
+PROXY_CONTEXT_MODE = os.environ.get('PROXY_CONTEXT_MODE', '0') == '1'
+PROXIES_PER_WORKER = max(1, int(os.environ.get('PROXIES_PER_WORKER', 10)))
 
 DIRECT_WORKER_FRACTION = 1/3
 STOP_SIGNAL = None
 URL_FILE = "users_test.txt"
 PROXY_FILE = "working_proxies.txt" # Файл с рабочими прокси, генерируемый вашим скриптом проверки
 OUTPUT_DATA_DIR = "output_files"
-OUTPUT_CSV_FILENAME = os.path.join(OUTPUT_DATA_DIR, "soundcloud_profiles_batched.csv")
-PROGRESS_FILE = os.path.join(OUTPUT_DATA_DIR, "processing_progress.txt")
+# Статическое шардирование: контейнер обрабатывает только URL своего шарда и ведет свои файлы прогресса/результатов
+SHARD_COUNT = max(1, int(os.environ.get('SHARD_COUNT', 1)))
+SHARD_INDEX = int(os.environ.get('SHARD_INDEX', 0))
+OUTPUT_CSV_FILENAME = os.path.join(OUTPUT_DATA_DIR, f"soundcloud_profiles_batched{shard_suffix(SHARD_INDEX, SHARD_COUNT)}.csv")
+PROGRESS_FILE = os.path.join(OUTPUT_DATA_DIR, f"processing_progress{shard_suffix(SHARD_INDEX, SHARD_COUNT)}.txt")
+MAIN_DIRECT_WORKER_LABEL = "main-direct" # Метка воркера в метриках
+# Путь к общей очереди URL (SQLite в общем томе). Если задан - режим нескольких узлов вместо файла прогресса
+WORK_QUEUE_DB = os.environ.get('WORK_QUEUE_DB', '')
+# 1 - при старте узла добавить в очередь URL из URL_FILE (существующие не затрагиваются)
+WORK_QUEUE_SEED = os.environ.get('WORK_QUEUE_SEED', '1') == '1'
+# Пауза перед повторным запросом, когда свободных URL нет, но у других узлов есть активные аренды
+WORK_QUEUE_IDLE_POLL_SECONDS = 30
+# Путь к состоянию инкрементального обновления (SQLite). Если задан - загружаются только профили с истекшим TTL
+RECRAWL_DB = os.environ.get('RECRAWL_DB', '')
+# Максимум профилей за один проход обновления (0 - все, у которых истек TTL)
+RECRAWL_MAX_URLS = int(os.environ.get('RECRAWL_MAX_URLS', 0))
+RECRAWL_CSV_FILENAME = os.path.join(OUTPUT_DATA_DIR, f"soundcloud_profiles_recrawl{shard_suffix(SHARD_INDEX, SHARD_COUNT)}.csv")
+# URL батча, не обработанные из-за остановки по сигналу: при следующем запуске обрабатываются первыми
+PENDING_URLS_FILE = os.path.join(OUTPUT_DATA_DIR, f"pending_urls{shard_suffix(SHARD_INDEX, SHARD_COUNT)}.txt")
+MAIN_DIRECT_WORKER_JOIN_TIMEOUT_SECONDS = 180
 
 # --- Функции для работы с прогрессом ---
 def get_start_index_from_progress(prog_file: str) -> int:
@@ -49,12 +86,12 @@ def get_start_index_from_progress(prog_file: str) -> int:
                     start_index = int(content)
                     # Убедимся, что это начало батча, хотя мы должны сохранять именно так
                     # start_index = (start_index // BATCH_SIZE) * BATCH_SIZE # Это не нужно, если сохраняем правильно
-                    logging.info(f"Файл прогресса найден. Возобновление с URL индекса: {start_index}")
+                    logger.info("Файл прогресса найден. Возобновление с URL индекса: %s", start_index)
                     return start_index
         except ValueError:
-            logging.warning(f"Файл прогресса '{prog_file}' содержит некорректное значение. Начинаем с начала (индекс 0).")
+            logger.warning("Файл прогресса '%s' содержит некорректное значение. Начинаем с начала (индекс 0).", prog_file)
         except Exception as e:
-            logging.error(f"Ошибка чтения файла прогресса '{prog_file}': {e}. Начинаем с начала (индекс 0).")
+            logger.error("Ошибка чтения файла прогресса '%s': %s. Начинаем с начала (индекс 0).", prog_file, e)
     return 0
 
 def save_progress_index(prog_file: str, next_batch_start_index: int):
@@ -63,17 +100,47 @@ def save_progress_index(prog_file: str, next_batch_start_index: int):
     """
     try:
         os.makedirs(os.path.dirname(prog_file), exist_ok=True)
-        with open(prog_file, 'w') as f:
+        # Через временный файл: остановка во время записи не должна оставить пустой файл прогресса
+        tmp_file = prog_file + '.tmp'
+        with open(tmp_file, 'w') as f:
             f.write(str(next_batch_start_index))
-        logging.debug(f"Прогресс сохранен: следующая обработка начнется с URL индекса {next_batch_start_index}.")
+        os.replace(tmp_file, prog_file)
+        logger.debug("Прогресс сохранен: следующая обработка начнется с URL индекса %s.", next_batch_start_index)
+    except Exception as e:
+        logger.error("Ошибка сохранения прогресса в '%s': %s", prog_file, e)
+
+def load_pending_urls(pending_file: str) -> list[str]:
+    """URL, возвращенные в набор ожидающих при прошлой остановке (пустой список, если файла нет)."""
+    if not os.path.exists(pending_file):
+        return []
+    try:
+        with open(pending_file, 'r', encoding='utf-8') as f:
+            return [line.strip() for line in f if line.strip()]
     except Exception as e:
-        logging.error(f"Ошибка сохранения прогресса в '{prog_file}': {e}")
+        logger.error("Ошибка чтения файла ожидающих URL '%s': %s", pending_file, e)
+        return []
+
+def save_pending_urls(pending_file: str, urls: list[str]):
+    """Сохраняет набор ожидающих URL; пустой набор удаляет файл."""
+    try:
+        if not urls:
+            if os.path.exists(pending_file):
+                os.remove(pending_file)
+            return
+        os.makedirs(os.path.dirname(pending_file), exist_ok=True)
+        tmp_file = pending_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            f.write("\n".join(urls) + "\n")
+        os.replace(tmp_file, pending_file)
+        logger.info("Возвращено в набор ожидающих URL: %s (%s).", len(urls), pending_file)
+    except Exception as e:
+        logger.error("Ошибка сохранения ожидающих URL в '%s': %s", pending_file, e)
 
 # --- Функция чтения URL из файла (без изменений) ---
 def load_urls_from_file(filepath: str) -> list[str]:
     urls = []
     if not os.path.exists(filepath):
-        logging.error(f"Файл с URL не найден: {filepath}")
+        logger.error("Файл с URL не найден: %s", filepath)
         return []
     try:
         with open(filepath, 'r', encoding='utf-8') as f:
@@ -81,10 +148,10 @@ def load_urls_from_file(filepath: str) -> list[str]:
                 url = line.strip()
                 if url and not url.startswith('#'):
                     urls.append(url)
-        logging.info(f"Загружено {len(urls)} URL из файла {filepath}")
+        logger.info("Загружено %s URL из файла %s", len(urls), filepath)
         return urls
     except Exception as e:
-        logging.error(f"Ошибка при чтении файла URL {filepath}: {e}")
+        logger.error("Ошибка при чтении файла URL %s: %s", filepath, e)
         return []
 
 # --- Функция-цель для основного прямого воркера (без изменений) ---
@@ -92,53 +159,346 @@ def main_direct_worker_target(
     initial_urls: list,
     retry_queue: mp.Queue,
     csv_filename: str,
-    csv_lock: mp.Lock
+    csv_lock: mp.Lock,
+    metrics_queue=None,
+    log_queue=None,
+    pages_per_worker: int = 1,
+    extra_fields: dict | None = None,
+    launched_at: float | None = None,
+    ws_endpoint: str | None = None,
+    drain_event=None,
+    hedge_proxy: str | None = None
 ):
-    worker_name = mp.current_process().name
-    logging.info(f"ОСНОВНОЙ ПРЯМОЙ ВОРКЕР {worker_name} запущен.")
+    from main_worker import run_worker_task, init_worker_process
+    from shutdown_utils import drain_requested
+    init_worker_process(metrics_queue, log_queue, launched_at, MAIN_DIRECT_WORKER_LABEL, drain_event)
+    # Профиль всего процесса: и начальные URL, и ретраи (вложенные run_worker_task не профилируются отдельно)
+    with profiled(MAIN_DIRECT_WORKER_LABEL):
+        worker_name = mp.current_process().name
+        logger.info("ОСНОВНОЙ ПРЯМОЙ ВОРКЕР %s запущен.", worker_name)
+
+        if initial_urls:
+            logger.info("ОСНОВНОЙ ПРЯМОЙ ВОРКЕР %s: Обработка %s начальных URL...", worker_name, len(initial_urls))
+            processed_count = run_worker_task(initial_urls, None, csv_filename, csv_lock, None, MAIN_DIRECT_WORKER_LABEL, pages_per_worker, extra_fields, ws_endpoint, hedge_proxy) # retry_queue=None
+            logger.info("ОСНОВНОЙ ПРЯМОЙ ВОРКЕР %s: Начальные задачи обработаны (успешно записано: %s).", worker_name, processed_count)
+
+        logger.info("ОСНОВНОЙ ПРЯМОЙ ВОРКЕР %s: Начало ожидания задач из очереди ретрая...", worker_name)
+        while True:
+            try:
+                url_to_retry = retry_queue.get(timeout=1.0)
+                if url_to_retry is STOP_SIGNAL:
+                    logger.info("ОСНОВНОЙ ПРЯМОЙ ВОРКЕР %s: Получен сигнал СТОП. Завершение.", worker_name)
+                    break
+                if url_to_retry and drain_requested():
+                    logger.info("ОСНОВНОЙ ПРЯМОЙ ВОРКЕР %s: Идет остановка, ретрай %s не выполняется.", worker_name, url_to_retry)
+                elif url_to_retry:
+                     logger.info("ОСНОВНОЙ ПРЯМОЙ ВОРКЕР %s: Получен URL для ретрая: %s", worker_name, url_to_retry)
+                     processed_count = run_worker_task([url_to_retry], None, csv_filename, csv_lock, None, MAIN_DIRECT_WORKER_LABEL, extra_fields=extra_fields, ws_endpoint=ws_endpoint, hedge_proxy=hedge_proxy)
+                     logger.info("ОСНОВНОЙ ПРЯМОЙ ВОРКЕР %s: Ретрай для %s завершен (успешно записано: %s).", worker_name, url_to_retry, processed_count > 0)
+            except queue.Empty:
+                continue
+            except (EOFError, BrokenPipeError):
+                 logger.warning("ОСНОВНОЙ ПРЯМОЙ ВОРКЕР %s: Очередь ретрая закрыта или повреждена. Завершение.", worker_name)
+                 break
+            except Exception as e:
+                logger.error("ОСНОВНОЙ ПРЯМОЙ ВОРКЕР %s: Ошибка в цикле обработки очереди: %s", worker_name, e, exc_info=True)
+                time.sleep(1)
+        logger.info("ОСНОВНОЙ ПРЯМОЙ ВОРКЕР %s: Завершил работу.", worker_name)
+
+
+def pool_worker_initializer(metrics_queue, log_queue, launched_at: float, drain_event=None, worker_pids=None):
+    """
+    Инициализатор процессов пула. main_worker (а с ним Playwright) импортируется только в воркерах:
+    оркестратору он не нужен, а при forkserver он уже загружен в сервере процессов.
+    worker_pids - общий список (Manager), в который процесс записывает свой PID для оркестратора.
+    """
+    from main_worker import init_worker_process
+    if worker_pids is not None:
+        worker_pids.append(os.getpid())
+    init_worker_process(metrics_queue, log_queue, launched_at, drain_event=drain_event)
+
+
+def pool_worker_task(*args) -> int:
+    """Задача воркера пула - см. main_worker.run_worker_task."""
+    from main_worker import run_worker_task
+    return run_worker_task(*args)
+
+
+def hedge_proxy_for(route, proxies_list: list[str]) -> str | None:
+    """
+    Прокси для дублей (хеджирования) воркера с одним маршрутом: любой прокси пула, кроме маршрута воркера.
+    None - у воркера несколько маршрутов или другого прокси нет (воркер с прокси тогда дублирует напрямую).
+    """
+    if isinstance(route, list):
+        return None
+    candidates = [proxy for proxy in proxies_list if proxy != route]
+    return random.choice(candidates) if candidates else None
+
+
+def browser_endpoint(run_state: dict) -> str | None:
+    """Адрес общего сервера браузеров для очередного воркера (None - воркер запускает свой браузер)."""
+    supervisor = run_state['browser_supervisor']
+    return supervisor.endpoint_for_worker() if supervisor else None
 
-    if initial_urls:
-        logging.info(f"ОСНОВНОЙ ПРЯМОЙ ВОРКЕР {worker_name}: Обработка {len(initial_urls)} начальных URL...")
-        processed_count = run_worker_task(initial_urls, None, csv_filename, csv_lock, None) # retry_queue=None
-        logging.info(f"ОСНОВНОЙ ПРЯМОЙ ВОРКЕР {worker_name}: Начальные задачи обработаны (успешно записано: {processed_count}).")
 
-    logging.info(f"ОСНОВНОЙ ПРЯМОЙ ВОРКЕР {worker_name}: Начало ожидания задач из очереди ретрая...")
-    while True:
+def process_batch(batch_urls: list[str], batch_label, run_state: dict) -> int:
+    """
+    Обрабатывает один батч URL: основной прямой воркер + пул воркеров (с прокси и без).
+    Возвращает количество URL, успешно обработанных пулом с первой попытки.
+    """
+    # Снимок живого пула на момент начала батча: фоновые замены пула подхватываются следующим батчем
+    proxies_list = run_state['proxy_pool'].snapshot()
+    retry_queue = run_state['manager'].Queue()
+    urls_for_main_direct_worker = []
+    pool_worker_tasks = []
+
+    direct_worker_url_count = math.ceil(len(batch_urls) * DIRECT_WORKER_FRACTION)
+    urls_for_main_direct_worker = batch_urls[:direct_worker_url_count]
+    remaining_urls_for_pool = batch_urls[direct_worker_url_count:]
+
+    # ... (остальная логика распределения задач по воркерам, как в вашем оригинальном скрипте) ...
+    num_pool_workers_to_launch = 0
+    pages_per_worker = PAGES_PER_WORKER
+    if run_state['sizing_policy']:
+        sizing = run_state['sizing_policy'].decide()
+        effective_desired_pool_workers = sizing.pool_workers
+        pages_per_worker = sizing.pages_per_worker
+        logger.info("Батч %s: Размер пула: %s воркеров, %s стр. на воркер (%s).", batch_label, sizing.pool_workers, pages_per_worker, sizing.reason)
+    else:
+        num_cpu = os.cpu_count() or 1
+        max_pool_workers_cpu_limit = (num_cpu - 1) if num_cpu > 1 else 0
+        effective_desired_pool_workers = min(DESIRED_POOL_WORKERS, max_pool_workers_cpu_limit) if max_pool_workers_cpu_limit > 0 else 0
+    if remaining_urls_for_pool:
+        num_pool_workers_to_launch = min(effective_desired_pool_workers, len(remaining_urls_for_pool))
+        if num_pool_workers_to_launch < 0: num_pool_workers_to_launch = 0
+
+    if num_pool_workers_to_launch == 0 and remaining_urls_for_pool:
+        urls_for_main_direct_worker.extend(remaining_urls_for_pool)
+        logger.info("Батч %s: Пул воркеров не запускается. Все %s оставшихся URL переданы основному прямому воркеру.", batch_label, len(remaining_urls_for_pool))
+        remaining_urls_for_pool = []
+    elif num_pool_workers_to_launch > 0 :
+        pool_chunk_size = (len(remaining_urls_for_pool) + num_pool_workers_to_launch - 1) // num_pool_workers_to_launch
+        url_chunks_for_pool = [
+            remaining_urls_for_pool[k:k + pool_chunk_size]
+            for k in range(0, len(remaining_urls_for_pool), pool_chunk_size)
+        ][:num_pool_workers_to_launch]
+        num_pool_workers_to_launch = len(url_chunks_for_pool)
+
+        assigned_direct_in_pool = 0
+        assigned_proxied_in_pool = 0
+        current_proxy_idx = 0
+        for k_chunk_idx in range(num_pool_workers_to_launch):
+            chunk = url_chunks_for_pool[k_chunk_idx]
+            if not chunk: continue
+            proxy_to_assign = None
+            if assigned_direct_in_pool < NUM_POOL_WORKERS_SPECIFICALLY_WITHOUT_PROXY:
+                proxy_to_assign = None
+                assigned_direct_in_pool += 1
+            elif proxies_list and PROXY_CONTEXT_MODE:
+                # Группа прокси для одного браузера: по контексту на каждый прокси
+                group_size = min(PROXIES_PER_WORKER, len(proxies_list))
+                proxy_to_assign = [proxies_list[(current_proxy_idx + k) % len(proxies_list)] for k in range(group_size)]
+                current_proxy_idx += group_size
+                assigned_proxied_in_pool += 1
+            elif proxies_list:
+                proxy_to_assign = proxies_list[current_proxy_idx % len(proxies_list)]
+                current_proxy_idx += 1
+                assigned_proxied_in_pool += 1
+            else:
+                proxy_to_assign = None
+                assigned_direct_in_pool += 1
+            pool_worker_tasks.append({'chunk': chunk, 'proxy': proxy_to_assign})
+    
+    logger.info("Батч %s: Основной прямой воркер: %s URL.", batch_label, len(urls_for_main_direct_worker))
+    if pool_worker_tasks:
+         assigned_direct_in_pool_actual = sum(1 for task in pool_worker_tasks if task['proxy'] is None)
+         assigned_proxied_in_pool_actual = sum(1 for task in pool_worker_tasks if task['proxy'] is not None)
+         logger.info("Батч %s: Пул: %s воркеров. Из них БЕЗ ПРОКСИ (в пуле): %s, С ПРОКСИ: %s.", batch_label, len(pool_worker_tasks), assigned_direct_in_pool_actual, assigned_proxied_in_pool_actual)
+    else:
+        logger.info("Батч %s: Пул воркеров не будет запущен для этого батча.", batch_label)
+
+    has_direct_worker_activity = bool(urls_for_main_direct_worker or pool_worker_tasks)
+    total_workers_in_batch = (1 if has_direct_worker_activity else 0) + len(pool_worker_tasks)
+    logger.info("Батч %s: Всего будет запущено процессов (основной + пул): %s", batch_label, total_workers_in_batch)
+
+    batch_processed_successfully_by_pool = 0
+    main_direct_worker_process = None
+    pool_worker_futures = []
+    # PID процессов пула этого батча (сообщает инициализатор)
+    pool_worker_pids = run_state['manager'].list()
+    rss_sampler = None
+    if run_state['sizing_policy']:
+        rss_sampler = RssSampler(pool_worker_pids)
+        rss_sampler.start()
+
+    if has_direct_worker_activity:
+        logger.info("Батч %s: Запуск ОСНОВНОГО ПРЯМОГО воркера...", batch_label)
+        main_direct_worker_process = mp.Process(
+            target=main_direct_worker_target,
+            args=(urls_for_main_direct_worker, retry_queue, run_state['csv_filename'], run_state['csv_lock'], run_state['metrics_queue'], get_log_queue(), pages_per_worker, run_state['extra_fields'], time.time(), browser_endpoint(run_state), run_state['drain'].event, hedge_proxy_for(None, proxies_list)),
+            name=f"MainDirectWorker-B{batch_label}"
+        )
+        main_direct_worker_process.start()
+        if rss_sampler:
+            rss_sampler.track(main_direct_worker_process.pid)
+    # ... (pool executor logic) ...
+    if pool_worker_tasks:
+        actual_pool_size = len(pool_worker_tasks)
+        logger.info("Батч %s: Запуск пула для %s воркеров...", batch_label, actual_pool_size)
+        executor = ProcessPoolExecutor(max_workers=max(1, actual_pool_size), initializer=pool_worker_initializer,
+                                       initargs=(run_state['metrics_queue'], get_log_queue(), time.time(), run_state['drain'].event, pool_worker_pids))
         try:
-            url_to_retry = retry_queue.get(timeout=1.0)
-            if url_to_retry is STOP_SIGNAL:
-                logging.info(f"ОСНОВНОЙ ПРЯМОЙ ВОРКЕР {worker_name}: Получен сигнал СТОП. Завершение.")
-                break
-            if url_to_retry:
-                 logging.info(f"ОСНОВНОЙ ПРЯМОЙ ВОРКЕР {worker_name}: Получен URL для ретрая: {url_to_retry}")
-                 processed_count = run_worker_task([url_to_retry], None, csv_filename, csv_lock, None)
-                 logging.info(f"ОСНОВНОЙ ПРЯМОЙ ВОРКЕР {worker_name}: Ретрай для {url_to_retry} завершен (успешно записано: {processed_count > 0}).")
-        except queue.Empty:
-            continue
-        except (EOFError, BrokenPipeError):
-             logging.warning(f"ОСНОВНОЙ ПРЯМОЙ ВОРКЕР {worker_name}: Очередь ретрая закрыта или повреждена. Завершение.")
-             break
-        except Exception as e:
-            logging.error(f"ОСНОВНОЙ ПРЯМОЙ ВОРКЕР {worker_name}: Ошибка в цикле обработки очереди: {e}", exc_info=True)
-            time.sleep(1)
-    logging.info(f"ОСНОВНОЙ ПРЯМОЙ ВОРКЕР {worker_name}: Завершил работу.")
+            for task_idx, task_info in enumerate(pool_worker_tasks):
+                chunk = task_info['chunk']
+                proxy_str = task_info['proxy']
+                if proxy_str is None:
+                    worker_type_log = "БЕЗ ПРОКСИ (в пуле)"
+                elif isinstance(proxy_str, list):
+                    worker_type_log = f"С ПРОКСИ: {len(proxy_str)} шт. в контекстах одного браузера"
+                else:
+                    worker_type_log = f"С ПРОКСИ: {proxy_str}"
+                logger.info("Батч %s: Отправка задачи ВОРКЕРУ ПУЛА %s/%s (%s) для %s URL.", batch_label, task_idx+1, actual_pool_size, worker_type_log, len(chunk))
+                future = executor.submit(
+                    pool_worker_task,
+                    chunk,
+                    proxy_str,
+                    run_state['csv_filename'],
+                    run_state['csv_lock'],
+                    retry_queue,
+                    f"pool-{task_idx + 1}",
+                    pages_per_worker,
+                    run_state['extra_fields'],
+                    browser_endpoint(run_state),
+                    hedge_proxy_for(proxy_str, proxies_list)
+                )
+                pool_worker_futures.append(future)
+            logger.info("Батч %s: Ожидание завершения %s воркеров пула...", batch_label, len(pool_worker_futures))
+            # Опрос вместо as_completed: после сигнала остановки воркеры ждут не дольше дедлайна
+            pending_futures = set(pool_worker_futures)
+            while pending_futures and not run_state['drain'].deadline_passed():
+                done_futures, pending_futures = futures_wait(pending_futures, timeout=DRAIN_POLL_SECONDS, return_when=FIRST_COMPLETED)
+                for future in done_futures:
+                    try:
+                        processed_count_by_future = future.result(timeout=None)
+                        batch_processed_successfully_by_pool += processed_count_by_future
+                    except Exception as e:
+                        logger.error("Батч %s: Ошибка при получении результата от воркера пула: %s", batch_label, e, exc_info=False)
+            if pending_futures:
+                logger.warning("Батч %s: Дедлайн остановки истек, не завершилось воркеров пула: %s. Принудительная остановка.", batch_label, len(pending_futures))
+            else:
+                logger.info("Батч %s: Все воркеры пула завершили работу. Успешно обработано пулом (первичные попытки): %s.", batch_label, batch_processed_successfully_by_pool)
+        finally:
+            # Дедлайн истек или повторный сигнал прервал ожидание - shutdown не должен ждать оставшихся воркеров
+            if not all(future.done() for future in pool_worker_futures):
+                terminate_pool_processes(executor, pool_worker_pids)
+            executor.shutdown(wait=True, cancel_futures=True)
+    else:
+         logger.info("Батч %s: Воркеры пула не запускались в этом батче.", batch_label)
+
+    if main_direct_worker_process:
+         logger.info("Батч %s: Отправка сигнала СТОП основному прямому воркеру...", batch_label)
+         retry_queue.put(STOP_SIGNAL)
+         logger.info("Батч %s: Ожидание завершения основного прямого воркера...", batch_label)
+         join_process(main_direct_worker_process, MAIN_DIRECT_WORKER_JOIN_TIMEOUT_SECONDS, run_state['drain'])
+         if main_direct_worker_process.is_alive():
+             logger.warning("Батч %s: Основной прямой воркер не завершился вовремя, принудительное завершение...", batch_label)
+             main_direct_worker_process.terminate()
+             main_direct_worker_process.join(timeout=10)
+         else:
+              logger.info("Батч %s: Основной прямой воркер успешно завершен.", batch_label)
+    
+    retry_queue._close()
+
+    if rss_sampler:
+        rss_sampler.stop()
+        run_state['sizing_policy'].record_batch(rss_sampler)
+
+    return batch_processed_successfully_by_pool
+
+
+def create_run_state(csv_filename: str, extra_fields: dict | None = None) -> dict:
+    """
+    Общие для всех батчей ресурсы запуска: Manager с блокировкой CSV, очередь и коллектор метрик,
+    живой пул прокси, политика размера пула, (при BROWSER_SERVER_MODE) супервизор общих серверов браузеров
+    и обработчик сигналов плавной остановки. extra_fields - дополнительные колонки каждой записи (напр. node_id).
+    """
+    manager = mp.Manager()
+    # Очередь таймингов по URL от воркеров к коллектору метрик в основном процессе
+    metrics_queue = manager.Queue() if metrics_enabled() else None
+    proxy_pool = ProxyPool(PROXY_FILE)
+    proxy_pool.start()
+    logger.info("Загружено прокси: %s шт.", len(proxy_pool.snapshot()))
+    drain = DrainSignal()
+    drain.install()
+    return {
+        'manager': manager,
+        'csv_filename': csv_filename,
+        'csv_lock': manager.Lock(),
+        'extra_fields': extra_fields,
+        'metrics_queue': metrics_queue,
+        'metrics_collector': start_metrics_collector(metrics_queue, OUTPUT_DATA_DIR),
+        'proxy_pool': proxy_pool,
+        'sizing_policy': WorkerSizingPolicy(DESIRED_POOL_WORKERS, PAGES_PER_WORKER) if MEMORY_AWARE_SIZING else None,
+        'browser_supervisor': start_browser_supervisor(os.path.join(OUTPUT_DATA_DIR, "browser_servers")),
+        'drain': drain,
+    }
+
+
+def close_run_state(run_state: dict):
+    run_state['proxy_pool'].stop()
+    if run_state['browser_supervisor']:
+        run_state['browser_supervisor'].stop()
+    if run_state['metrics_collector']:
+        run_state['metrics_collector'].stop()
+    run_state['manager'].shutdown()
+    run_state['drain'].uninstall()
+
+
+def csv_end_offset(csv_filename: str) -> int:
+    """Размер CSV до батча: строки батча - все, что дописано после этой позиции."""
+    return os.path.getsize(csv_filename) if os.path.exists(csv_filename) else 0
+
+
+def unfinished_batch_urls(batch_urls: list[str], csv_offset: int, run_state: dict) -> list[str]:
+    """
+    URL батча без строки в CSV после csv_offset: не начаты из-за остановки, прерваны дедлайном
+    или завершились ошибкой (такие тоже лучше повторить, чем потерять).
+    """
+    extra_fields = run_state['extra_fields'] or {}
+    fieldnames = PROFILE_CSV_FIELDNAMES + [key for key in extra_fields if key not in PROFILE_CSV_FIELDNAMES]
+    written_urls = {row.get('url') for row in read_csv_rows_since(run_state['csv_filename'], csv_offset, fieldnames)}
+    return [url for url in batch_urls if url not in written_urls]
 
 
 # --- Основная функция запуска ---
 def main_multiprocess_run():
     overall_start_time = time.time()
+    # Логируется здесь, а не при импорте модуля: иначе каждый дочерний процесс (spawn) повторял бы эти строки
+    logger.info("Using BATCH_SIZE: %s", BATCH_SIZE)
+    logger.info("Using DESIRED_POOL_WORKERS: %s", DESIRED_POOL_WORKERS)
+    logger.info("Using NUM_POOL_WORKERS_SPECIFICALLY_WITHOUT_PROXY: %s", NUM_POOL_WORKERS_SPECIFICALLY_WITHOUT_PROXY)
+    logger.info("Using PAGES_PER_WORKER: %s, MEMORY_AWARE_SIZING: %s", PAGES_PER_WORKER, MEMORY_AWARE_SIZING)
+    logger.info("Using PROXY_CONTEXT_MODE: %s, PROXIES_PER_WORKER: %s", PROXY_CONTEXT_MODE, PROXIES_PER_WORKER)
 
     if not os.path.exists(OUTPUT_DATA_DIR):
         try:
             os.makedirs(OUTPUT_DATA_DIR)
-            logging.info(f"Создана директория для выходных файлов: {OUTPUT_DATA_DIR}")
+            logger.info("Создана директория для выходных файлов: %s", OUTPUT_DATA_DIR)
         except OSError as e:
-            logging.error(f"Не удалось создать директорию {OUTPUT_DATA_DIR}: {e}")
+            logger.error("Не удалось создать директорию %s: %s", OUTPUT_DATA_DIR, e)
             return
 
+    if not 0 <= SHARD_INDEX < SHARD_COUNT:
+        logger.error("Некорректный шард: SHARD_INDEX=%s при SHARD_COUNT=%s. Завершение.", SHARD_INDEX, SHARD_COUNT)
+        return
+
     all_urls_full = load_urls_from_file(URL_FILE)
+    if SHARD_COUNT > 1:
+        # Индексы прогресса считаются внутри списка шарда: он детерминирован для неизменного URL_FILE
+        all_urls_full = filter_urls_for_shard(all_urls_full, SHARD_INDEX, SHARD_COUNT)
+        logger.info("Шард %s/%s: %s URL. Прогресс: %s, результаты: %s", SHARD_INDEX, SHARD_COUNT, len(all_urls_full), PROGRESS_FILE, OUTPUT_CSV_FILENAME)
     if not all_urls_full:
-        logging.error("Нет URL для обработки. Завершение.")
+        logger.error("Нет URL для обработки. Завершение.")
         return
     
     total_urls_in_file = len(all_urls_full)
@@ -146,9 +506,13 @@ def main_multiprocess_run():
     # --- Возобновление ---
     # start_index_for_this_run - это абсолютный индекс в all_urls_full, с которого начинаем
     start_index_for_this_run = get_start_index_from_progress(PROGRESS_FILE)
+    # URL, не обработанные при прошлой остановке по сигналу: индекс прогресса их уже пропускает
+    pending_urls = load_pending_urls(PENDING_URLS_FILE)
+    if pending_urls:
+        logger.info("Найдено ожидающих URL с прошлой остановки: %s (%s).", len(pending_urls), PENDING_URLS_FILE)
 
-    if start_index_for_this_run >= total_urls_in_file and total_urls_in_file > 0:
-        logging.info(f"Все {total_urls_in_file} URL уже были обработаны согласно файлу прогресса. Завершение.")
+    if start_index_for_this_run >= total_urls_in_file and total_urls_in_file > 0 and not pending_urls:
+        logger.info("Все %s URL уже были обработаны согласно файлу прогресса. Завершение.", total_urls_in_file)
         print_final_csv_summary()
         return
     
@@ -160,32 +524,56 @@ def main_multiprocess_run():
     # если `save_progress_index` сохраняет именно начало следующего батча.
 
     if start_index_for_this_run > 0:
-         logging.info(f"Возобновление обработки. Пропускаются первые {start_index_for_this_run} URL.")
+         logger.info("Возобновление обработки. Пропускаются первые %s URL.", start_index_for_this_run)
     
     urls_to_process = all_urls_full[start_index_for_this_run:]
 
-    if not urls_to_process:
-        logging.info(f"Нет оставшихся URL для обработки после учета прогресса (все {total_urls_in_file} URL обработаны).")
+    if not urls_to_process and not pending_urls:
+        logger.info("Нет оставшихся URL для обработки после учета прогресса (все %s URL обработаны).", total_urls_in_file)
         save_progress_index(PROGRESS_FILE, total_urls_in_file) 
         print_final_csv_summary()
         return
     
-    logging.info(f"Всего URL для обработки в этом сеансе: {len(urls_to_process)} (из {total_urls_in_file} всего, начиная с абсолютного индекса {start_index_for_this_run}).")
+    logger.info("Всего URL для обработки в этом сеансе: %s (из %s всего, начиная с абсолютного индекса %s).", len(urls_to_process), total_urls_in_file, start_index_for_this_run)
 
     # Инициализация CSV: append_mode=True если start_index_for_this_run > 0
-    initialize_csv_file(OUTPUT_CSV_FILENAME, DEFAULT_CSV_FIELDNAMES, append_mode=(start_index_for_this_run > 0))
+    initialize_csv_file(OUTPUT_CSV_FILENAME, PROFILE_CSV_FIELDNAMES, append_mode=(start_index_for_this_run > 0 or bool(pending_urls)))
 
-    manager = mp.Manager()
-    csv_file_lock = manager.Lock()
+    run_state = create_run_state(OUTPUT_CSV_FILENAME)
+    drain = run_state['drain']
+    try:
+        if pending_urls:
+            logger.info("\n%s БАТЧ ОЖИДАЮЩИХ URL (%s URL) %s", '='*20, len(pending_urls), '='*20)
+            csv_offset = csv_end_offset(OUTPUT_CSV_FILENAME)
+            process_batch(pending_urls, "pending", run_state)
+            save_pending_urls(PENDING_URLS_FILE, unfinished_batch_urls(pending_urls, csv_offset, run_state) if drain.requested else [])
+        run_batches_with_progress(urls_to_process, start_index_for_this_run, total_urls_in_file, run_state)
+    finally:
+        close_run_state(run_state)
+    if drain.requested:
+        logger.info("Остановка по сигналу завершена. Общее время выполнения этого сеанса: %.2f секунд.", time.time() - overall_start_time)
+        return
+
+    logger.info("Все запланированные батчи для этого запуска обработаны.")
+    final_processed_index = start_index_for_this_run + len(urls_to_process)
+    save_progress_index(PROGRESS_FILE, final_processed_index) # Сохраняем финальный прогресс
+    logger.info("Финальный прогресс сохранен: обработка завершена до абсолютного URL индекса %s.", final_processed_index)
+    
+    logger.info("Результаты сохранены в %s", OUTPUT_CSV_FILENAME)
+    overall_end_time = time.time()
+    logger.info("Общее время выполнения этого сеанса: %.2f секунд.", overall_end_time - overall_start_time)
+
+    print_final_csv_summary()
 
-    proxies_list_raw = load_proxies_from_file(PROXY_FILE)
-    logging.info(f"Загружено прокси: {len(proxies_list_raw) if proxies_list_raw and proxies_list_raw != [None] else 0} шт.")
-    proxies_list = [p for p in proxies_list_raw if p] if proxies_list_raw and proxies_list_raw != [None] else []
-    has_real_proxies = bool(proxies_list)
-    num_cpu = os.cpu_count() or 1
 
+def run_batches_with_progress(urls_to_process: list[str], start_index_for_this_run: int, total_urls_in_file: int, run_state: dict):
+    """Батчи режима с файлом прогресса. При остановке по сигналу новые батчи не запускаются."""
+    drain = run_state['drain']
     # `i` теперь является относительным индексом внутри `urls_to_process`
     for i in range(0, len(urls_to_process), BATCH_SIZE):
+        if drain.requested:
+            logger.info("Остановка: оставшиеся батчи не запускаются (продолжение с индекса %s).", start_index_for_this_run + i)
+            return
         batch_urls = urls_to_process[i : i + BATCH_SIZE]
         
         # Абсолютный индекс начала текущего батча в исходном файле users_test.txt
@@ -195,8 +583,8 @@ def main_multiprocess_run():
         batch_num_overall = (current_absolute_start_index_of_batch // BATCH_SIZE) + 1
         total_batches_overall = (total_urls_in_file + BATCH_SIZE - 1) // BATCH_SIZE
 
-        logging.info(f"\n{'='*20} НАЧАЛО БАТЧА {batch_num_overall}/{total_batches_overall} ({len(batch_urls)} URL) {'='*20}")
-        logging.info(f"(Обработка URL с абсолютного индекса {current_absolute_start_index_of_batch} по {current_absolute_start_index_of_batch + len(batch_urls) - 1})")
+        logger.info("\n%s НАЧАЛО БАТЧА %s/%s (%s URL) %s", '='*20, batch_num_overall, total_batches_overall, len(batch_urls), '='*20)
+        logger.info("(Обработка URL с абсолютного индекса %s по %s)", current_absolute_start_index_of_batch, current_absolute_start_index_of_batch + len(batch_urls) - 1)
         
         # ВАЖНО: Перед началом обработки батча, мы НЕ обновляем файл прогресса здесь.
         # Обновление произойдет только ПОСЛЕ УСПЕШНОГО ЗАВЕРШЕНИЯ БАТЧА.
@@ -205,145 +593,143 @@ def main_multiprocess_run():
         # и этот батч будет перезапущен.
 
         batch_start_time = time.time()
+        csv_offset = csv_end_offset(OUTPUT_CSV_FILENAME)
+        batch_processed_successfully_by_pool = process_batch(batch_urls, batch_num_overall, run_state)
+        if drain.requested:
+            # Батч прерван остановкой: необработанные URL сохраняются до сдвига прогресса, чтобы не потеряться
+            save_pending_urls(PENDING_URLS_FILE, unfinished_batch_urls(batch_urls, csv_offset, run_state))
 
-        retry_queue = manager.Queue()
-        urls_for_main_direct_worker = []
-        pool_worker_tasks = []
-
-        direct_worker_url_count = math.ceil(len(batch_urls) * DIRECT_WORKER_FRACTION)
-        urls_for_main_direct_worker = batch_urls[:direct_worker_url_count]
-        remaining_urls_for_pool = batch_urls[direct_worker_url_count:]
-
-        # ... (остальная логика распределения задач по воркерам, как в вашем оригинальном скрипте) ...
-        num_pool_workers_to_launch = 0
-        if remaining_urls_for_pool:
-            max_pool_workers_cpu_limit = (num_cpu - 1) if num_cpu > 1 else 0 
-            effective_desired_pool_workers = min(DESIRED_POOL_WORKERS, max_pool_workers_cpu_limit) if max_pool_workers_cpu_limit > 0 else 0
-            num_pool_workers_to_launch = min(effective_desired_pool_workers, len(remaining_urls_for_pool))
-            if num_pool_workers_to_launch < 0: num_pool_workers_to_launch = 0
-
-        if num_pool_workers_to_launch == 0 and remaining_urls_for_pool:
-            urls_for_main_direct_worker.extend(remaining_urls_for_pool)
-            logging.info(f"Батч {batch_num_overall}: Пул воркеров не запускается. Все {len(remaining_urls_for_pool)} оставшихся URL переданы основному прямому воркеру.")
-            remaining_urls_for_pool = []
-        elif num_pool_workers_to_launch > 0 :
-            pool_chunk_size = (len(remaining_urls_for_pool) + num_pool_workers_to_launch - 1) // num_pool_workers_to_launch
-            url_chunks_for_pool = [
-                remaining_urls_for_pool[k:k + pool_chunk_size]
-                for k in range(0, len(remaining_urls_for_pool), pool_chunk_size)
-            ][:num_pool_workers_to_launch]
-            num_pool_workers_to_launch = len(url_chunks_for_pool)
-
-            assigned_direct_in_pool = 0
-            assigned_proxied_in_pool = 0
-            current_proxy_idx = 0
-            for k_chunk_idx in range(num_pool_workers_to_launch):
-                chunk = url_chunks_for_pool[k_chunk_idx]
-                if not chunk: continue
-                proxy_to_assign = None
-                if assigned_direct_in_pool < NUM_POOL_WORKERS_SPECIFICALLY_WITHOUT_PROXY:
-                    proxy_to_assign = None
-                    assigned_direct_in_pool += 1
-                elif has_real_proxies:
-                    proxy_to_assign = proxies_list[current_proxy_idx % len(proxies_list)]
-                    current_proxy_idx += 1
-                    assigned_proxied_in_pool += 1
-                else:
-                    proxy_to_assign = None
-                    assigned_direct_in_pool += 1
-                pool_worker_tasks.append({'chunk': chunk, 'proxy': proxy_to_assign})
-        
-        logging.info(f"Батч {batch_num_overall}: Основной прямой воркер: {len(urls_for_main_direct_worker)} URL.")
-        if pool_worker_tasks:
-             assigned_direct_in_pool_actual = sum(1 for task in pool_worker_tasks if task['proxy'] is None)
-             assigned_proxied_in_pool_actual = sum(1 for task in pool_worker_tasks if task['proxy'] is not None)
-             logging.info(f"Батч {batch_num_overall}: Пул: {len(pool_worker_tasks)} воркеров. "
-                          f"Из них БЕЗ ПРОКСИ (в пуле): {assigned_direct_in_pool_actual}, "
-                          f"С ПРОКСИ: {assigned_proxied_in_pool_actual}.")
-        else:
-            logging.info(f"Батч {batch_num_overall}: Пул воркеров не будет запущен для этого батча.")
-
-        has_direct_worker_activity = bool(urls_for_main_direct_worker or pool_worker_tasks)
-        total_workers_in_batch = (1 if has_direct_worker_activity else 0) + len(pool_worker_tasks)
-        logging.info(f"Батч {batch_num_overall}: Всего будет запущено процессов (основной + пул): {total_workers_in_batch}")
-
-        batch_processed_successfully_by_pool = 0
-        main_direct_worker_process = None
-        pool_worker_futures = []
-
-        if has_direct_worker_activity:
-            logging.info(f"Батч {batch_num_overall}: Запуск ОСНОВНОГО ПРЯМОГО воркера...")
-            main_direct_worker_process = mp.Process(
-                target=main_direct_worker_target,
-                args=(urls_for_main_direct_worker, retry_queue, OUTPUT_CSV_FILENAME, csv_file_lock),
-                name=f"MainDirectWorker-B{batch_num_overall}"
-            )
-            main_direct_worker_process.start()
-        # ... (pool executor logic) ...
-        if pool_worker_tasks:
-            actual_pool_size = len(pool_worker_tasks)
-            logging.info(f"Батч {batch_num_overall}: Запуск пула для {actual_pool_size} воркеров...")
-            with ProcessPoolExecutor(max_workers=max(1, actual_pool_size)) as executor:
-                for task_idx, task_info in enumerate(pool_worker_tasks):
-                    chunk = task_info['chunk']
-                    proxy_str = task_info['proxy']
-                    worker_type_log = "БЕЗ ПРОКСИ (в пуле)" if proxy_str is None else f"С ПРОКСИ: {proxy_str}"
-                    logging.info(f"Батч {batch_num_overall}: Отправка задачи ВОРКЕРУ ПУЛА {task_idx+1}/{actual_pool_size} ({worker_type_log}) для {len(chunk)} URL.")
-                    future = executor.submit(
-                        run_worker_task,
-                        chunk,
-                        proxy_str,
-                        OUTPUT_CSV_FILENAME,
-                        csv_file_lock,
-                        retry_queue
-                    )
-                    pool_worker_futures.append(future)
-                logging.info(f"Батч {batch_num_overall}: Ожидание завершения {len(pool_worker_futures)} воркеров пула...")
-                for future in as_completed(pool_worker_futures):
-                    try:
-                        processed_count_by_future = future.result(timeout=None)
-                        batch_processed_successfully_by_pool += processed_count_by_future
-                    except Exception as e:
-                        logging.error(f"Батч {batch_num_overall}: Ошибка при получении результата от воркера пула: {e}", exc_info=False)
-                logging.info(f"Батч {batch_num_overall}: Все воркеры пула завершили работу. Успешно обработано пулом (первичные попытки): {batch_processed_successfully_by_pool}.")
-        else:
-             logging.info(f"Батч {batch_num_overall}: Воркеры пула не запускались в этом батче.")
-
-        if main_direct_worker_process:
-             logging.info(f"Батч {batch_num_overall}: Отправка сигнала СТОП основному прямому воркеру...")
-             retry_queue.put(STOP_SIGNAL)
-             logging.info(f"Батч {batch_num_overall}: Ожидание завершения основного прямого воркера...")
-             main_direct_worker_process.join(timeout=180)
-             if main_direct_worker_process.is_alive():
-                 logging.warning(f"Батч {batch_num_overall}: Основной прямой воркер не завершился вовремя, принудительное завершение...")
-                 main_direct_worker_process.terminate()
-                 main_direct_worker_process.join(timeout=10)
-             else:
-                  logging.info(f"Батч {batch_num_overall}: Основной прямой воркер успешно завершен.")
-        
-        retry_queue._close()
-        
         # ----- Обновление прогресса ПОСЛЕ успешной обработки батча -----
         next_batch_start_index_for_progress = current_absolute_start_index_of_batch + len(batch_urls)
         save_progress_index(PROGRESS_FILE, next_batch_start_index_for_progress)
         # ---------------------------------------------------------------
 
         batch_end_time = time.time()
-        logging.info(f"======= ЗАВЕРШЕНИЕ БАТЧА {batch_num_overall}/{total_batches_overall} =======")
-        logging.info(f"Время выполнения батча: {batch_end_time - batch_start_time:.2f} сек.")
-        logging.info(f"Успешно обработано воркерами пула (первичные попытки): {batch_processed_successfully_by_pool}")
-        logging.info(f"Прогресс обновлен. Следующий запуск начнется с URL с абсолютным индексом: {next_batch_start_index_for_progress}")
+        logger.info("======= ЗАВЕРШЕНИЕ БАТЧА %s/%s =======", batch_num_overall, total_batches_overall)
+        logger.info("Время выполнения батча: %.2f сек.", batch_end_time - batch_start_time)
+        logger.info("Успешно обработано воркерами пула (первичные попытки): %s", batch_processed_successfully_by_pool)
+        logger.info("Прогресс обновлен. Следующий запуск начнется с URL с абсолютным индексом: %s", next_batch_start_index_for_progress)
 
-    logging.info(f"Все запланированные батчи для этого запуска обработаны.")
-    final_processed_index = start_index_for_this_run + len(urls_to_process)
-    save_progress_index(PROGRESS_FILE, final_processed_index) # Сохраняем финальный прогресс
-    logging.info(f"Финальный прогресс сохранен: обработка завершена до абсолютного URL индекса {final_processed_index}.")
-    
-    logging.info(f"Результаты сохранены в {OUTPUT_CSV_FILENAME}")
-    overall_end_time = time.time()
-    logging.info(f"Общее время выполнения этого сеанса: {overall_end_time - overall_start_time:.2f} секунд.")
 
-    print_final_csv_summary()
+def main_queue_run():
+    """
+    Режим нескольких узлов: URL берутся батчами из общей очереди под аренду, аренда продлевается,
+    пока батч обрабатывается, и подтверждается после батча. Каждый узел пишет свой CSV с колонкой node_id.
+    """
+    overall_start_time = time.time()
+    node_id = default_node_id()
+    logger.info("Режим общей очереди: %s, узел: %s, BATCH_SIZE: %s, аренда: %s сек.", WORK_QUEUE_DB, node_id, BATCH_SIZE, LEASE_SECONDS)
+
+    lease_queue = LeaseQueue(WORK_QUEUE_DB)
+    if WORK_QUEUE_SEED and os.path.exists(URL_FILE):
+        added = lease_queue.add_urls(load_urls_from_file(URL_FILE))
+        logger.info("Добавлено в очередь новых URL: %s", added)
+
+    node_csv_filename = os.path.join(OUTPUT_DATA_DIR, f"soundcloud_profiles_{node_id}.csv")
+    extra_fields = {'node_id': node_id}
+    initialize_csv_file(node_csv_filename, PROFILE_CSV_FIELDNAMES + list(extra_fields), append_mode=True)
+    run_state = create_run_state(node_csv_filename, extra_fields)
+
+    batches_done = 0
+    try:
+        while not run_state['drain'].requested:
+            batch_urls = lease_queue.claim(node_id, BATCH_SIZE)
+            if not batch_urls:
+                counts = lease_queue.counts()
+                if counts.get('leased', 0) > 0:
+                    # Другие узлы еще работают; если какой-то упал, его аренды истекут и вернутся в очередь
+                    logger.info("Свободных URL нет, активных аренд у других узлов: %s. Ожидание %s сек...", counts['leased'], WORK_QUEUE_IDLE_POLL_SECONDS)
+                    run_state['drain'].sleep(WORK_QUEUE_IDLE_POLL_SECONDS)
+                    continue
+                logger.info("Очередь исчерпана: %s", counts)
+                break
+
+            batches_done += 1
+            batch_label = f"{node_id}-{batches_done}"
+            logger.info("\n%s НАЧАЛО БАТЧА %s (%s URL из очереди) %s", '='*20, batch_label, len(batch_urls), '='*20)
+            batch_start_time = time.time()
+            heartbeat = LeaseHeartbeat(WORK_QUEUE_DB, node_id, batch_urls)
+            heartbeat.start()
+            csv_offset = csv_end_offset(node_csv_filename)
+            try:
+                batch_processed_successfully_by_pool = process_batch(batch_urls, batch_label, run_state)
+            finally:
+                heartbeat.stop()
+            done_urls = batch_urls
+            if run_state['drain'].requested:
+                # Необработанные URL сразу возвращаются в очередь, а не ждут истечения аренды
+                unfinished_urls = set(unfinished_batch_urls(batch_urls, csv_offset, run_state))
+                released = lease_queue.release(node_id, list(unfinished_urls))
+                logger.info("Батч %s прерван остановкой: возвращено в очередь URL: %s.", batch_label, released)
+                done_urls = [url for url in batch_urls if url not in unfinished_urls]
+            acked = lease_queue.ack(node_id, done_urls)
+            logger.info("======= ЗАВЕРШЕНИЕ БАТЧА %s =======", batch_label)
+            logger.info("Время выполнения батча: %.2f сек. Успешно обработано пулом (первичные попытки): %s. Подтверждено в очереди: %s/%s.",
+                        time.time() - batch_start_time, batch_processed_successfully_by_pool, acked, len(batch_urls))
+    finally:
+        close_run_state(run_state)
+        lease_queue.close()
+
+    logger.info("Узел %s: обработано батчей: %s. Результаты в %s", node_id, batches_done, node_csv_filename)
+    logger.info("Общее время выполнения этого сеанса: %.2f секунд.", time.time() - overall_start_time)
+
+
+def main_recrawl_run():
+    """
+    Инкрементальное обновление: загружаются только профили с истекшим TTL (зависит от уровня по подписчикам),
+    от самых устаревших к менее устаревшим. Результаты дописываются в отдельный CSV; время загрузки и
+    подписчики сохраняются в RECRAWL_DB. Актуальная версия каждого профиля - через compact_output.py.
+    """
+    overall_start_time = time.time()
+    logger.info("Режим обновления: %s, BATCH_SIZE: %s, RECRAWL_MAX_URLS: %s", RECRAWL_DB, BATCH_SIZE, RECRAWL_MAX_URLS or 'все')
+
+    store = RecrawlStore(RECRAWL_DB)
+    if os.path.exists(URL_FILE):
+        seed_urls = filter_urls_for_shard(load_urls_from_file(URL_FILE), SHARD_INDEX, SHARD_COUNT)
+        logger.info("Новых URL в состоянии обновления: %s", store.add_urls(seed_urls))
+
+    due_urls = store.due_urls(RECRAWL_MAX_URLS or None)
+    logger.info("Требуют обновления: %s из %s профилей.", len(due_urls), store.counts()['total'])
+    if not due_urls:
+        next_due = store.next_due_in()
+        if next_due is not None:
+            logger.info("Ближайший профиль устареет через %.1f ч.", next_due / 3600)
+        store.close()
+        return
+
+    initialize_csv_file(RECRAWL_CSV_FILENAME, PROFILE_CSV_FIELDNAMES, append_mode=True)
+    run_state = create_run_state(RECRAWL_CSV_FILENAME)
+    num_batches = math.ceil(len(due_urls) / BATCH_SIZE)
+    try:
+        for batch_num, batch_start in enumerate(range(0, len(due_urls), BATCH_SIZE), start=1):
+            if run_state['drain'].requested:
+                logger.info("Остановка: оставшиеся батчи обновления не запускаются, их URL останутся в очереди обновления.")
+                break
+            batch_urls = due_urls[batch_start:batch_start + BATCH_SIZE]
+            batch_label = f"recrawl-{batch_num}/{num_batches}"
+            logger.info("\n%s НАЧАЛО БАТЧА %s (%s URL) %s", '='*20, batch_label, len(batch_urls), '='*20)
+            batch_start_time = time.time()
+            # Результаты батча - строки, дописанные в CSV после этой позиции
+            csv_offset = csv_end_offset(RECRAWL_CSV_FILENAME)
+            batch_processed_successfully_by_pool = process_batch(batch_urls, batch_label, run_state)
+            batch_rows = read_csv_rows_since(RECRAWL_CSV_FILENAME, csv_offset, PROFILE_CSV_FIELDNAMES)
+            attempted_urls = batch_urls
+            if run_state['drain'].requested:
+                # Не начатые из-за остановки URL не считаются неудачной попыткой: их TTL по-прежнему истек
+                batch_result_urls = {row.get('url') for row in batch_rows}
+                attempted_urls = [url for url in batch_urls if url in batch_result_urls]
+            recorded = store.record_results(best_rows_by_url(batch_rows, set(batch_urls)), attempted_urls)
+            logger.info("======= ЗАВЕРШЕНИЕ БАТЧА %s =======", batch_label)
+            logger.info("Время выполнения батча: %.2f сек. Успешно обработано пулом (первичные попытки): %s. Состояние обновлено: %s.",
+                        time.time() - batch_start_time, batch_processed_successfully_by_pool, recorded)
+    finally:
+        close_run_state(run_state)
+        logger.info("Состояние обновления после прохода: %s", store.counts())
+        store.close()
+
+    logger.info("Проход обновления завершен. Результаты в %s", RECRAWL_CSV_FILENAME)
+    logger.info("Общее время выполнения этого сеанса: %.2f секунд.", time.time() - overall_start_time)
+
 
 def print_final_csv_summary():
     """Печатает информацию о количестве строк в выходном CSV."""
@@ -369,9 +755,27 @@ def print_final_csv_summary():
         print(f"Не удалось посчитать строки в CSV: {e}")
 
 if __name__ == "__main__":
+    start_method = MP_START_METHOD if MP_START_METHOD in mp.get_all_start_methods() else 'spawn'
     try:
-        mp.set_start_method('spawn', force=True) 
-        logging.info("Multiprocessing start method set to 'spawn'.")
+        if start_method == 'forkserver':
+            mp.set_forkserver_preload(FORKSERVER_PRELOAD)
+        mp.set_start_method(start_method, force=True)
+        start_method_set = True
     except RuntimeError:
-        logging.info("Multiprocessing start method already set or cannot be changed. Proceeding.")
-    main_multiprocess_run()
\ No newline at end of file
+        start_method_set = False
+    # Единственный слушатель логов: воркеры отправляют записи в его очередь, а не пишут в stdout сами
+    log_listener = start_logging_listener()
+    if start_method_set:
+        logger.info("Multiprocessing start method set to '%s'.", start_method)
+    else:
+        logger.info("Multiprocessing start method already set or cannot be changed. Proceeding.")
+    try:
+        with profiled("orchestrator"):
+            if WORK_QUEUE_DB:
+                main_queue_run()
+            elif RECRAWL_DB:
+                main_recrawl_run()
+            else:
+                main_multiprocess_run()
+    finally:
+        log_listener.stop()
\ No newline at end of file
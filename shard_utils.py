@@ -0,0 +1,67 @@
+# shard_utils.py
+"""
+Статическое шардирование входного списка URL между независимыми контейнерами
+и объединение результатов шардов в один файл без дубликатов.
+
+Запуск шарда:   SHARD_INDEX=0 SHARD_COUNT=3 python run_parser.py
+Объединение:    python shard_utils.py merge output_files/merged.csv output_files/soundcloud_profiles_batched.shard*of3.csv
+"""
+import argparse
+import glob
+import hashlib
+import logging
+import os
+
+from compact_output import compact_csv_files
+
+logger = logging.getLogger(__name__)
+
+
+def shard_for_url(url: str, shard_count: int) -> int:
+    """
+    Номер шарда для URL. Хэш стабилен между запусками и машинами (в отличие от встроенного hash()),
+    а URL нормализуется, чтобы 'https://soundcloud.com/x/' и 'https://soundcloud.com/x' попадали в один шард.
+    """
+    if shard_count <= 1:
+        return 0
+    normalized = url.strip().rstrip('/').lower()
+    digest = hashlib.blake2b(normalized.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % shard_count
+
+
+def shard_suffix(shard_index: int, shard_count: int) -> str:
+    """Суффикс имен файлов прогресса и результатов шарда (пусто без шардирования)."""
+    return f".shard{shard_index}of{shard_count}" if shard_count > 1 else ""
+
+
+def filter_urls_for_shard(urls: list[str], shard_index: int, shard_count: int) -> list[str]:
+    if shard_count <= 1:
+        return urls
+    return [url for url in urls if shard_for_url(url, shard_count) == shard_index]
+
+
+def merge_shard_outputs(input_files: list[str], output_file: str) -> dict:
+    """
+    Объединяет CSV шардов в один файл: по каждому URL остается одна (лучшая) запись.
+    Объединение идет внешней сортировкой (compact_output), память ограничена независимо от объема шардов.
+    Возвращает статистику объединения.
+    """
+    os.makedirs(os.path.dirname(output_file) or '.', exist_ok=True)
+    return compact_csv_files(input_files, output_file)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    arg_parser = argparse.ArgumentParser(description="Шардирование входных URL и объединение результатов шардов.")
+    sub = arg_parser.add_subparsers(dest='command', required=True)
+    merge_cmd = sub.add_parser('merge', help="Объединить CSV шардов в один файл без дубликатов")
+    merge_cmd.add_argument('output', help="Итоговый CSV")
+    merge_cmd.add_argument('inputs', nargs='*',
+                           help="CSV шардов (по умолчанию output_files/soundcloud_profiles_batched.shard*.csv)")
+    args = arg_parser.parse_args()
+
+    inputs = args.inputs or sorted(glob.glob(os.path.join("output_files", "soundcloud_profiles_batched.shard*.csv")))
+    if not inputs:
+        print("Не найдено ни одного файла шардов для объединения.")
+    else:
+        print(f"Статистика: {merge_shard_outputs(inputs, args.output)}")
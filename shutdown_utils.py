@@ -0,0 +1,117 @@
+# shutdown_utils.py
+"""
+Плавная остановка по SIGTERM/SIGINT (docker stop при деплое, Ctrl+C). Оркестратор перестает выдавать батчи,
+воркеры не начинают новые URL, а уже открытые страницы дорабатывают до дедлайна DRAIN_TIMEOUT_SECONDS.
+После дедлайна оставшиеся воркеры останавливаются принудительно. Повторный сигнал - немедленное завершение.
+"""
+import logging
+import multiprocessing as mp
+import os
+import signal
+import time
+
+logger = logging.getLogger(__name__)
+
+# --- Настройки (переопределяются через переменные окружения) ---
+# Сколько ждать начатые страницы после сигнала; должно быть меньше stop_grace_period в docker-compose.yml
+DRAIN_TIMEOUT_SECONDS = float(os.environ.get('DRAIN_TIMEOUT_SECONDS', 45))
+DRAIN_POLL_SECONDS = 1.0
+DRAIN_SIGNALS = (signal.SIGTERM, signal.SIGINT)
+
+
+class DrainSignal:
+    """
+    Запрос остановки в оркестраторе. event (mp.Event) передается воркерам при запуске процесса;
+    сам оркестратор читает только requested_at, чтобы обработчик сигнала не конкурировал с ним за блокировку события.
+    """
+
+    def __init__(self):
+        self.event = mp.Event()
+        self.requested_at: float | None = None
+        self._previous_handlers = {}
+
+    def install(self):
+        for signum in DRAIN_SIGNALS:
+            self._previous_handlers[signum] = signal.signal(signum, self._handle)
+
+    def uninstall(self):
+        for signum, handler in self._previous_handlers.items():
+            signal.signal(signum, handler)
+        self._previous_handlers = {}
+
+    def _handle(self, signum, frame):
+        if self.requested_at is not None:
+            logger.warning("Повторный сигнал %s: немедленное завершение без ожидания воркеров.", signal.Signals(signum).name)
+            raise KeyboardInterrupt
+        self.requested_at = time.monotonic()
+        self.event.set()
+        logger.warning("Получен сигнал %s: новые URL не выдаются, начатые страницы дорабатываются (до %.0f сек.).",
+                       signal.Signals(signum).name, DRAIN_TIMEOUT_SECONDS)
+
+    @property
+    def requested(self) -> bool:
+        return self.requested_at is not None
+
+    def deadline_passed(self) -> bool:
+        return self.requested_at is not None and time.monotonic() - self.requested_at >= DRAIN_TIMEOUT_SECONDS
+
+    def sleep(self, seconds: float):
+        """time.sleep, прерываемый запросом остановки."""
+        deadline = time.monotonic() + seconds
+        while not self.requested and time.monotonic() < deadline:
+            time.sleep(min(DRAIN_POLL_SECONDS, deadline - time.monotonic()))
+
+
+def join_process(process: mp.Process, timeout: float, drain: DrainSignal):
+    """join с таймаутом, который завершается раньше, если истек дедлайн остановки."""
+    deadline = time.monotonic() + timeout
+    while process.is_alive() and time.monotonic() < deadline and not drain.deadline_passed():
+        process.join(timeout=DRAIN_POLL_SECONDS)
+
+
+def terminate_pool_processes(executor, worker_pids=None) -> int:
+    """
+    Принудительно останавливает процессы ProcessPoolExecutor (в 3.11 нет публичного API для этого).
+    worker_pids - PID, которые процессы пула сообщили из инициализатора (список Manager); если их нет,
+    используется внутренний список процессов executor. Возвращает число остановленных процессов.
+    """
+    pids = set()
+    if worker_pids is not None:
+        try:
+            pids.update(worker_pids[:])
+        except (OSError, EOFError) as e:
+            logger.warning("Список PID процессов пула недоступен (%s).", e)
+    if not pids:
+        processes = getattr(executor, '_processes', None)
+        if processes is None:
+            logger.warning("Процессы пула неизвестны (нет PID от инициализатора и %s._processes), принудительная остановка невозможна.",
+                           type(executor).__name__)
+            return 0
+        pids.update(process.pid for process in list(processes.values()) if process.is_alive())
+    terminated = 0
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGTERM)
+            terminated += 1
+        except ProcessLookupError:
+            pass  # уже завершился
+    return terminated
+
+
+# --- В процессах-воркерах ---
+_drain_event = None
+
+
+def init_worker_drain(drain_event):
+    """
+    Запоминает событие остановки в процессе-воркере. Ctrl+C приходит всей группе процессов - воркеры его
+    игнорируют, остановкой управляет оркестратор. SIGTERM - действие по умолчанию (им воркер останавливают принудительно).
+    """
+    global _drain_event
+    _drain_event = drain_event
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+
+def drain_requested() -> bool:
+    return _drain_event is not None and _drain_event.is_set()
@@ -0,0 +1,120 @@
+# soundcloud_api.py
+"""
+Данные профиля из JSON, который фронтенд SoundCloud получает при загрузке страницы:
+пользователь (followers_count, description) - из ответа api-v2 или из window.__sc_hydration,
+ссылки - из ответа /users/<id>/web-profiles. Страница не сериализуется и не разбирается BeautifulSoup.
+"""
+import asyncio
+import logging
+import re
+from urllib.parse import urlparse
+
+from profile_record import ProfileRecord, LINK_FIELDS
+from soundcloud_parser import assign_profile_link, assign_description_emails, extract_url_from_gate_sc
+
+logger = logging.getLogger(__name__)
+
+API_HOST = 'api-v2.soundcloud.com'
+WEB_PROFILES_PATH_PATTERN = re.compile(r'/users/(?:soundcloud:users:)?(\d+)/web-profiles')
+# Пользователи из данных серверного рендеринга (для профиля, отрисованного на сервере, запроса к API за ним может не быть)
+HYDRATION_USERS_JS = "() => (window.__sc_hydration || []).filter(h => h.hydratable === 'user').map(h => h.data)"
+
+
+def profile_permalink(profile_url: str) -> str:
+    """'https://soundcloud.com/Artist/' -> 'artist'."""
+    path = urlparse(profile_url).path.strip('/')
+    return path.split('/', 1)[0].lower()
+
+
+class ProfileApiCapture:
+    """
+    Перехватчик ответов API для одной страницы профиля: подключается через page.on("response", capture.on_response)
+    до навигации. Ответы с данными профиля разбираются в фоне, wait_complete ждет, пока придут пользователь и его ссылки.
+    """
+
+    def __init__(self, profile_url: str):
+        self.permalink = profile_permalink(profile_url)
+        self.user: dict | None = None
+        self.web_profiles: dict[int, list] = {}
+        self._changed = asyncio.Event()
+        self._tasks: set[asyncio.Task] = set()
+
+    def on_response(self, response):
+        if API_HOST not in response.url or response.status != 200:
+            return
+        task = asyncio.ensure_future(self._read(response))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _read(self, response):
+        try:
+            payload = await response.json()
+        except Exception:
+            return  # не JSON или страница уже закрыта
+        match = WEB_PROFILES_PATH_PATTERN.search(urlparse(response.url).path)
+        if match and isinstance(payload, list):
+            self.web_profiles[int(match.group(1))] = payload
+        elif isinstance(payload, dict) and self._is_profile_user(payload):
+            self.user = payload
+        else:
+            return
+        self._changed.set()
+
+    def _is_profile_user(self, payload: dict) -> bool:
+        # На странице профиля запрашиваются и другие пользователи (рекомендации, подписки) - сверяем permalink
+        return payload.get('kind') == 'user' and str(payload.get('permalink', '')).lower() == self.permalink
+
+    def use_hydration(self, users) -> bool:
+        """Берет пользователя из данных серверного рендеринга, если ответа API с ним не было."""
+        for user in users or []:
+            if isinstance(user, dict) and self._is_profile_user(user):
+                self.user = user
+                self._changed.set()
+                return True
+        return False
+
+    def is_complete(self) -> bool:
+        return self.user is not None and self.user.get('id') in self.web_profiles
+
+    async def wait_complete(self, timeout: float, settle: float | None = None) -> bool:
+        """
+        Ждет пользователя и его ссылки не дольше timeout. settle - сколько ждать пользователя без новых данных:
+        если за это время ничего не пришло и ни один ответ API не читается, ответов уже не будет.
+        Когда пользователь получен, его ссылки ждутся весь timeout (запрос за ними идет всегда).
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while not self.is_complete():
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return False
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), min(remaining, settle or remaining) if self.user is None else remaining)
+            except asyncio.TimeoutError:
+                if self.user is None and not self._tasks:
+                    return self.is_complete()
+        return True
+
+    def to_record(self, profile_url: str) -> ProfileRecord:
+        return record_from_api(profile_url, self.user, self.web_profiles.get(self.user.get('id'), []))
+
+    def close(self):
+        for task in list(self._tasks):
+            task.cancel()
+
+
+def record_from_api(profile_url: str, user: dict, web_profiles: list) -> ProfileRecord:
+    """Запись профиля из JSON пользователя и списка его web-profiles (те же правила, что и при разборе HTML)."""
+    data = dict.fromkeys(LINK_FIELDS, '')
+    data['emails'] = []
+    for web_profile in web_profiles:
+        if not isinstance(web_profile, dict):
+            continue
+        original_url = extract_url_from_gate_sc(web_profile.get('url') or '')
+        if original_url:
+            assign_profile_link(data, original_url, (web_profile.get('title') or '').strip().lower())
+    assign_description_emails(data, user.get('description') or '')
+    emails = tuple(data.pop('emails'))
+    followers = user.get('followers_count')
+    return ProfileRecord(profile_url, followers=followers if isinstance(followers, int) else None, emails=emails, **data)
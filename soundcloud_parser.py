@@ -4,6 +4,11 @@ import logging # Added for debug logging
 from urllib.parse import urlparse, parse_qs, unquote
 from bs4 import BeautifulSoup
 
+from profile_record import ProfileRecord, LINK_FIELDS
+
+EMAIL_PATTERN = re.compile(r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}')
+MAILTO_PATTERN = re.compile(r'mailto:[^\s"\'<>?]+')
+
 def extract_url_from_gate_sc(gate_url: str) -> str:
     """Извлекает оригинальный URL из gate.sc ссылки."""
     if not gate_url:
@@ -17,9 +22,9 @@ def extract_url_from_gate_sc(gate_url: str) -> str:
         return gate_url # Если 'url' нет, но есть gate.sc
     return gate_url
 
-def parse_follower_count_to_int_str(text: str) -> str:
-    """Пытается преобразовать текстовое представление количества подписчиков (напр. "90.2K", "1,234") в строку с целым числом."""
-    if not text: return ''
+def parse_follower_count(text: str) -> int | None:
+    """Пытается преобразовать текстовое представление количества подписчиков (напр. "90.2K", "1,234") в целое число."""
+    if not text: return None
     original_text = text
     text = text.lower().strip().replace(',', '') # "1,234" -> "1234", "90.2k" -> "90.2k"
     
@@ -31,21 +36,71 @@ def parse_follower_count_to_int_str(text: str) -> str:
             value = float(text[:-1]) * 1_000_000
         else:
             value = float(text)
-        return str(int(value))
+        return int(value)
     except ValueError:
         # logging.debug(f"Could not parse follower count from text: '{original_text}'")
-        return '' # Возвращаем пустую строку, если не удалось распарсить
+        return None # Не удалось распарсить
+
+def parse_follower_count_to_int_str(text: str) -> str:
+    """То же, что parse_follower_count, но строкой ('' - не удалось распарсить)."""
+    value = parse_follower_count(text)
+    return '' if value is None else str(value)
+
+def assign_profile_link(data: dict, original_url: str, text_content: str = ''):
+    """
+    Относит ссылку из блока web-profiles к соцсети/сайту (или email) и записывает ее в data,
+    если поле еще не заполнено. data - словарь полей LINK_FIELDS и список 'emails'.
+    """
+    if 'mailto:' in original_url:
+        email = original_url.replace('mailto:', '')
+        if email not in data['emails']:
+            data['emails'].append(email)
+    elif any(domain in original_url for domain in ['instagram.com']):
+        if not data['instagram']: data['instagram'] = original_url
+    elif any(domain in original_url for domain in ['youtube.com', 'youtu.be']):
+        if not data['youtube']: data['youtube'] = original_url
+    elif any(domain in original_url for domain in ['facebook.com', 'fb.me']):
+        if not data['facebook']: data['facebook'] = original_url
+    elif any(domain in original_url for domain in ['twitter.com', 'x.com']):
+        if not data['twitter']: data['twitter'] = original_url
+    elif any(domain in original_url for domain in ['songkick.com']):
+        if not data['songkick']: data['songkick'] = original_url
+    elif any(domain in original_url for domain in ['t.me', 'telegram.me']):
+        if not data['telegram']: data['telegram'] = original_url
+    elif any(domain in original_url for domain in ['tiktok.com']):
+        if not data['tiktok']: data['tiktok'] = original_url
+    elif any(domain in original_url for domain in ['linkedin.com']):
+        if not data['linkedin']: data['linkedin'] = original_url
+    elif (original_url.startswith('http') and
+          not any(social_domain in original_url for social_domain in [
+              'instagram', 'youtube', 'facebook', 'twitter', 'songkick', 't.me', 'tiktok', 'linkedin',
+              'soundcloud.com', 'spotify.com', 'apple.com', 'bandcamp.com' # Добавил еще несколько, чтобы не считались за основной сайт
+          ])):
+        if not data['website']:
+            data['website'] = original_url
+        elif text_content == 'website' and not data['website']: # Если есть явная подпись "website"
+             data['website'] = original_url
+
+def assign_description_emails(data: dict, description: str, link_urls=()):
+    """
+    Email из описания профиля - общая логика для разбора HTML и ответов API: сначала ссылки mailto:
+    (из разметки и записанные прямо в тексте) через assign_profile_link, затем адреса, найденные в тексте.
+    """
+    for link_url in [*link_urls, *MAILTO_PATTERN.findall(description)]:
+        if link_url.startswith('mailto:'):
+            assign_profile_link(data, link_url)
+    for email in EMAIL_PATTERN.findall(description):
+        if email not in data['emails']:
+            data['emails'].append(email)
 
-def parse_soundcloud_profile_html(html_content: str, profile_url: str) -> dict:
+def parse_soundcloud_profile_html(html_content: str, profile_url: str) -> ProfileRecord:
     """
     Парсит HTML-контент страницы профиля SoundCloud для извлечения ссылок и количества подписчиков.
     """
     soup = BeautifulSoup(html_content, 'html.parser')
-    data = {
-        'url': profile_url, 'website': '', 'youtube': '', 'facebook': '', 'twitter': '',
-        'instagram': '', 'songkick': '', 'telegram': '', 'tiktok': '', 'linkedin': '',
-        'emails': [], 'followers': '', 'error': '' # Поле error будет заполняться в воркере
-    }
+    # Ссылки и email собираются в словарь; запись создается один раз в конце
+    data = dict.fromkeys(LINK_FIELDS, '')
+    data['emails'] = []
 
     # 1. Извлечение ссылок из блока .web-profiles
     web_profiles_div = soup.select_one('div.web-profiles')
@@ -59,50 +114,16 @@ def parse_soundcloud_profile_html(html_content: str, profile_url: str) -> dict:
             if not original_url:
                 continue
 
-            if 'mailto:' in original_url:
-                email = original_url.replace('mailto:', '')
-                if email not in data['emails']:
-                    data['emails'].append(email)
-            elif any(domain in original_url for domain in ['instagram.com']):
-                if not data['instagram']: data['instagram'] = original_url
-            elif any(domain in original_url for domain in ['youtube.com', 'youtu.be']):
-                if not data['youtube']: data['youtube'] = original_url
-            elif any(domain in original_url for domain in ['facebook.com', 'fb.me']):
-                if not data['facebook']: data['facebook'] = original_url
-            elif any(domain in original_url for domain in ['twitter.com', 'x.com']):
-                if not data['twitter']: data['twitter'] = original_url
-            elif any(domain in original_url for domain in ['songkick.com']):
-                if not data['songkick']: data['songkick'] = original_url
-            elif any(domain in original_url for domain in ['t.me', 'telegram.me']):
-                if not data['telegram']: data['telegram'] = original_url
-            elif any(domain in original_url for domain in ['tiktok.com']):
-                if not data['tiktok']: data['tiktok'] = original_url
-            elif any(domain in original_url for domain in ['linkedin.com']):
-                if not data['linkedin']: data['linkedin'] = original_url
-            elif (original_url.startswith('http') and
-                  not any(social_domain in original_url for social_domain in [
-                      'instagram', 'youtube', 'facebook', 'twitter', 'songkick', 't.me', 'tiktok', 'linkedin',
-                      'soundcloud.com', 'spotify.com', 'apple.com', 'bandcamp.com' # Добавил еще несколько, чтобы не считались за основной сайт
-                  ])):
-                if not data['website']:
-                    data['website'] = original_url
-                elif text_content == 'website' and not data['website']: # Если есть явная подпись "website"
-                     data['website'] = original_url
+            assign_profile_link(data, original_url, text_content)
 
     # 2. Извлечение email из описания (биографии)
     biography_text_element = soup.select_one('div.biographyText p, div.truncatedUserDescription q')
     if biography_text_element:
         biography_text = biography_text_element.get_text(separator=' ')
-        for mailto_link in biography_text_element.find_all('a', href=re.compile(r'^mailto:')):
-            email = mailto_link['href'].replace('mailto:', '')
-            if email not in data['emails']:
-                data['emails'].append(email)
-        found_emails = re.findall(r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}', biography_text)
-        for email in found_emails:
-            if email not in data['emails']:
-                data['emails'].append(email)
+        mailto_links = [link['href'] for link in biography_text_element.find_all('a', href=re.compile(r'^mailto:'))]
+        assign_description_emails(data, biography_text, mailto_links)
     
-    data['emails'] = list(set(data['emails'])) # Убираем дубликаты
+    emails = tuple(dict.fromkeys(data.pop('emails'))) # Убираем дубликаты, сохраняя порядок
 
     # 3. Извлечение количества подписчиков
     followers_count_text = ''
@@ -137,9 +158,7 @@ def parse_soundcloud_profile_html(html_content: str, profile_url: str) -> dict:
         if meta_follower_tag:
             followers_count_text = meta_follower_tag['content']
             
-    data['followers'] = parse_follower_count_to_int_str(followers_count_text)
-    
-    return data
+    return ProfileRecord(profile_url, followers=parse_follower_count(followers_count_text), emails=emails, **data)
 
 if __name__ == '__main__':
     # Пример для тестирования парсера
@@ -149,7 +168,7 @@ if __name__ == '__main__':
     #         test_html = f.read()
     #     parsed_info = parse_soundcloud_profile_html(test_html, "http://example.com/testprofile")
     #     print("Результат парсинга:")
-    #     for key, value in parsed_info.items():
+    #     for key, value in parsed_info.to_dict().items():
     #         print(f"  {key}: {value}")
     # except FileNotFoundError:
     #     print("Файл dummy_profile.html не найден для теста.")
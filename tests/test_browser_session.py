@@ -0,0 +1,136 @@
+import asyncio
+
+from browser_session import BrowserSession
+
+
+class FakePage:
+    def __init__(self):
+        self.closed = False
+
+    def is_closed(self):
+        return self.closed
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeContext:
+    def __init__(self, block_new_page: asyncio.Event | None = None):
+        self.block_new_page = block_new_page
+
+    async def new_page(self):
+        if self.block_new_page is not None:
+            await self.block_new_page.wait()
+        return FakePage()
+
+    async def close(self):
+        pass
+
+
+class FakeBrowser:
+    def __init__(self, owner):
+        self.owner = owner
+
+    def is_connected(self):
+        return True
+
+    async def new_context(self, **options):
+        return FakeContext(self.owner.block_new_page)
+
+    async def close(self):
+        pass
+
+
+class FakeChromium:
+    def __init__(self):
+        self.block_new_page = None
+        self.launches = 0
+
+    async def launch(self, **options):
+        self.launches += 1
+        return FakeBrowser(self)
+
+
+class FakePlaywright:
+    def __init__(self):
+        self.chromium = FakeChromium()
+
+
+def test_cancel_during_new_page_rolls_back_counters():
+    async def scenario():
+        playwright = FakePlaywright()
+        session = BrowserSession(playwright, [None], "test-worker")
+        playwright.chromium.block_new_page = asyncio.Event()
+        await session.start()
+        slot = session.slots[0]
+
+        # Отмена попытки (как у проигравшего дубля), пока new_page еще не вернул страницу
+        attempt = asyncio.create_task(session.acquire_page())
+        await asyncio.sleep(0.01)
+        assert slot.active_pages == 1
+        attempt.cancel()
+        await asyncio.gather(attempt, return_exceptions=True)
+        assert attempt.cancelled()
+        assert slot.active_pages == 0
+        assert session._active_pages == 0
+
+        # Перезапуск браузера ждет закрытия открытых страниц - после отмены ждать нечего
+        playwright.chromium.block_new_page = None
+        session._restart_reason = "тест"
+        page, slot = await asyncio.wait_for(session.acquire_page(), timeout=1)
+        assert playwright.chromium.launches == 2
+        await session.release_page(page, slot)
+        assert session._active_pages == 0
+        await session.close()
+
+    asyncio.run(scenario())
+
+
+def test_failed_new_page_rolls_back_counters():
+    async def scenario():
+        session = BrowserSession(FakePlaywright(), [None], "test-worker")
+        await session.start()
+
+        async def failing_new_page():
+            raise RuntimeError("new_page failed")
+        session.slots[0].context.new_page = failing_new_page
+        try:
+            await session.acquire_page()
+        except RuntimeError:
+            pass
+        assert session.slots[0].active_pages == 0
+        assert session._active_pages == 0
+
+    asyncio.run(scenario())
+
+
+def test_spare_context_used_only_for_hedge():
+    async def scenario():
+        playwright = FakePlaywright()
+        session = BrowserSession(playwright, [{'server': 'http://proxy:1'}], "test-worker",
+                                 hedge_spare_context=True, hedge_proxy_config={'server': 'http://proxy:2'})
+        await session.start()
+        primary_slot, spare_slot = session.slots
+        assert spare_slot.spare and spare_slot.proxy_config == {'server': 'http://proxy:2'}
+        # Маршруты разные - прокси задаются на уровне контекстов
+        assert session.per_context_proxy
+
+        _, slot_a = await session.acquire_page()
+        _, slot_b = await session.acquire_page()
+        assert slot_a is primary_slot and slot_b is primary_slot
+        _, hedge_slot = await session.acquire_page(exclude=primary_slot)
+        assert hedge_slot is spare_slot
+
+    asyncio.run(scenario())
+
+
+def test_spare_context_never_reuses_primary_route():
+    proxy = {'server': 'http://proxy:1'}
+    # Другого прокси нет: воркер с прокси дублирует напрямую
+    session = BrowserSession(FakePlaywright(), [proxy], "test-worker", hedge_spare_context=True, hedge_proxy_config=proxy)
+    assert [slot.proxy_config for slot in session.slots] == [proxy, None]
+    assert session.per_context_proxy
+    # Воркер без прокси и без прокси для дублей: запасного контекста нет
+    session = BrowserSession(FakePlaywright(), [None], "test-worker", hedge_spare_context=True)
+    assert len(session.slots) == 1
+    assert not session.per_context_proxy
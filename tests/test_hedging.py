@@ -0,0 +1,152 @@
+import asyncio
+
+import pytest
+
+import hedging
+from hedging import HedgePolicy, run_hedged
+from profile_record import ProfileRecord
+
+
+class FakeSlot:
+    def __init__(self, label):
+        self.label = label
+
+
+def policy_with_delay(monkeypatch, delay: float) -> HedgePolicy:
+    monkeypatch.setattr(hedging, 'HEDGE_MIN_SAMPLES', 1)
+    monkeypatch.setattr(hedging, 'HEDGE_MIN_DELAY_SECONDS', delay)
+    policy = HedgePolicy()
+    policy.observe_latency(delay)
+    return policy
+
+
+def fake_attempts(behaviour: dict, cancelled: list):
+    """run_attempt для run_hedged: behaviour[маршрут] = (задержка, результат или исключение)."""
+    async def run_attempt(url, state, exclude=None):
+        route = 'spare' if exclude else 'primary'
+        state['slot'] = FakeSlot(route)
+        delay, outcome = behaviour[route]
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            cancelled.append(route)
+            raise
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+    return run_attempt
+
+
+def test_hedge_delay_uses_initial_delay_until_enough_samples(monkeypatch):
+    monkeypatch.setattr(hedging, 'HEDGE_MIN_SAMPLES', 5)
+    monkeypatch.setattr(hedging, 'HEDGE_INITIAL_DELAY_SECONDS', 60)
+    monkeypatch.setattr(hedging, 'HEDGE_MIN_DELAY_SECONDS', 10)
+    policy = HedgePolicy(percentile=80)
+    for seconds in (1, 2, 3, 4):
+        policy.observe_latency(seconds)
+    assert policy.hedge_delay() == 60
+
+
+def test_hedge_delay_percentile_with_min_delay(monkeypatch):
+    monkeypatch.setattr(hedging, 'HEDGE_MIN_SAMPLES', 5)
+    monkeypatch.setattr(hedging, 'HEDGE_MIN_DELAY_SECONDS', 10)
+    policy = HedgePolicy(percentile=80)
+    for seconds in (30, 10, 20, 50, 40):
+        policy.observe_latency(seconds)
+    assert policy.hedge_delay() == 40
+    fast = HedgePolicy(percentile=80)
+    for seconds in (1, 2, 3, 4, 5):
+        fast.observe_latency(seconds)
+    assert fast.hedge_delay() == 10
+
+
+def test_hedge_delay_none_when_disabled(monkeypatch):
+    assert HedgePolicy(percentile=0).hedge_delay() is None
+    policy = HedgePolicy(percentile=95)
+    policy.disable("нет другого маршрута")
+    assert not policy.enabled and policy.hedge_delay() is None
+    monkeypatch.setattr(hedging, 'HEDGE_MAX_EXTRA_PAGES', 0)
+    assert not HedgePolicy(percentile=95).enabled
+
+
+def test_budget_fraction_and_extra_page_cap(monkeypatch):
+    monkeypatch.setattr(hedging, 'HEDGE_BUDGET_FRACTION', 0.1)
+    monkeypatch.setattr(hedging, 'HEDGE_MAX_EXTRA_PAGES', 2)
+    policy = HedgePolicy()
+    for _ in range(10):
+        policy.observe_start()
+    # 1 + 10% от 10 URL = 2 дубля
+    assert policy.try_acquire_budget()
+    assert policy.try_acquire_budget()
+    policy.release_extra_page()
+    policy.release_extra_page()
+    assert not policy.try_acquire_budget()
+    assert policy.extra_pages_in_use == 0
+
+    monkeypatch.setattr(hedging, 'HEDGE_MAX_EXTRA_PAGES', 1)
+    policy = HedgePolicy()
+    for _ in range(100):
+        policy.observe_start()
+    assert policy.try_acquire_budget()
+    # Бюджет есть, но страница под дубль занята
+    assert not policy.try_acquire_budget()
+    policy.release_extra_page()
+    assert policy.try_acquire_budget()
+
+
+def test_fast_primary_is_not_hedged(monkeypatch):
+    policy = policy_with_delay(monkeypatch, 0.2)
+    ok = ProfileRecord('u', followers=1)
+    cancelled = []
+    run_attempt = fake_attempts({'primary': (0, ok)}, cancelled)
+    result, state = asyncio.run(run_hedged(policy, run_attempt, 'u', {'slot': None, 'timings': {}}))
+    assert result is ok and state['slot'].label == 'primary'
+    assert policy.hedges_launched == 0
+
+
+def test_hedge_wins_and_primary_is_cancelled(monkeypatch):
+    policy = policy_with_delay(monkeypatch, 0.05)
+    policy.observe_start()
+    ok = ProfileRecord('u', followers=1)
+    cancelled = []
+    run_attempt = fake_attempts({'primary': (5, ok), 'spare': (0.01, ok)}, cancelled)
+    result, state = asyncio.run(run_hedged(policy, run_attempt, 'u', {'slot': None, 'timings': {}}))
+    assert result is ok and state['slot'].label == 'spare'
+    assert cancelled == ['primary']
+    assert policy.hedges_won == 1 and policy.extra_pages_in_use == 0
+    assert state['timings']['hedge_wasted'] >= 0.05
+    assert policy.wasted_seconds == state['timings']['hedge_wasted']
+
+
+def test_failed_hedge_does_not_beat_primary(monkeypatch):
+    policy = policy_with_delay(monkeypatch, 0.05)
+    policy.observe_start()
+    ok = ProfileRecord('u', followers=1)
+    failed = ProfileRecord('u', error='goto', error_code='goto_failed')
+    cancelled = []
+    run_attempt = fake_attempts({'primary': (0.2, ok), 'spare': (0.01, failed)}, cancelled)
+    result, state = asyncio.run(run_hedged(policy, run_attempt, 'u', {'slot': None, 'timings': {}}))
+    assert result is ok and state['slot'].label == 'primary'
+    assert cancelled == [] and policy.hedges_won == 0
+
+
+def test_both_attempts_fail_returns_primary_error(monkeypatch):
+    policy = policy_with_delay(monkeypatch, 0.05)
+    policy.observe_start()
+    primary_failed = ProfileRecord('u', error='primary', error_code='goto_failed')
+    cancelled = []
+    run_attempt = fake_attempts({'primary': (0.2, primary_failed), 'spare': (0.01, RuntimeError('spare'))}, cancelled)
+    result, state = asyncio.run(run_hedged(policy, run_attempt, 'u', {'slot': None, 'timings': {}}))
+    assert result is primary_failed and state['slot'].label == 'primary'
+    assert policy.hedges_won == 0 and policy.extra_pages_in_use == 0
+    assert policy.wasted_seconds > 0
+
+
+def test_primary_exception_raised_when_both_fail(monkeypatch):
+    policy = policy_with_delay(monkeypatch, 0.05)
+    policy.observe_start()
+    failed = ProfileRecord('u', error='spare', error_code='goto_failed')
+    run_attempt = fake_attempts({'primary': (0.2, RuntimeError('primary')), 'spare': (0.01, failed)}, [])
+    with pytest.raises(RuntimeError, match='primary'):
+        asyncio.run(run_hedged(policy, run_attempt, 'u', {'slot': None, 'timings': {}}))
+    assert policy.extra_pages_in_use == 0
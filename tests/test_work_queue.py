@@ -0,0 +1,40 @@
+import sqlite3
+
+import work_queue
+from work_queue import LeaseQueue, STATUS_FAILED, STATUS_PENDING
+
+
+def attempts_and_status(db_path: str, url: str):
+    with sqlite3.connect(db_path) as conn:
+        return conn.execute("SELECT attempts, status FROM work_items WHERE url = ?", (url,)).fetchone()
+
+
+def test_release_does_not_count_as_attempt(tmp_path, monkeypatch):
+    monkeypatch.setattr(work_queue, 'MAX_LEASE_ATTEMPTS', 2)
+    db_path = str(tmp_path / "queue.sqlite")
+    queue = LeaseQueue(db_path)
+    queue.add_urls(['https://soundcloud.com/a'])
+    # Много циклов остановки узла: URL выдается и возвращается без обработки
+    for _ in range(5):
+        assert queue.claim('node-1', 10) == ['https://soundcloud.com/a']
+        assert queue.release('node-1', ['https://soundcloud.com/a']) == 1
+    assert attempts_and_status(db_path, 'https://soundcloud.com/a') == (0, STATUS_PENDING)
+    # Аренда истекает (узел упал) - это уже попытка
+    assert queue.claim('node-1', 10, lease_seconds=-1) == ['https://soundcloud.com/a']
+    assert queue.claim('node-2', 10) == ['https://soundcloud.com/a']
+    assert attempts_and_status(db_path, 'https://soundcloud.com/a')[0] == 2
+    queue.close()
+
+
+def test_attempt_limit_applies_to_pending_and_expired(tmp_path, monkeypatch):
+    monkeypatch.setattr(work_queue, 'MAX_LEASE_ATTEMPTS', 1)
+    db_path = str(tmp_path / "queue.sqlite")
+    queue = LeaseQueue(db_path)
+    queue.add_urls(['https://soundcloud.com/expired', 'https://soundcloud.com/pending'])
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("UPDATE work_items SET attempts = 1 WHERE url = 'https://soundcloud.com/pending'")
+    assert queue.claim('node-1', 1, lease_seconds=-1) == ['https://soundcloud.com/expired']
+    assert queue.claim('node-2', 10) == []
+    assert attempts_and_status(db_path, 'https://soundcloud.com/expired') == (1, STATUS_FAILED)
+    assert attempts_and_status(db_path, 'https://soundcloud.com/pending') == (1, STATUS_FAILED)
+    queue.close()
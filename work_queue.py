@@ -0,0 +1,204 @@
+# work_queue.py
+"""
+Общая очередь URL для нескольких узлов (контейнеров) на SQLite-файле в общем томе.
+
+Каждый URL выдается узлу под аренду (lease) с ограниченным сроком. Узел продлевает аренду,
+пока обрабатывает батч, и подтверждает (ack) завершение. Если узел упал, его аренды истекают,
+и URL снова выдаются другим узлам.
+
+SQLite-блокировки надежны на локальном томе Docker, общем для контейнеров одного хоста.
+Для сетевых ФС (NFS/SMB) блокировки файлов могут работать некорректно.
+"""
+import argparse
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# --- Настройки (переопределяются через переменные окружения) ---
+LEASE_SECONDS = int(os.environ.get('WORK_QUEUE_LEASE_SECONDS', 600))
+# После стольких выдач URL считается "ядовитым" и больше не выдается
+MAX_LEASE_ATTEMPTS = int(os.environ.get('WORK_QUEUE_MAX_ATTEMPTS', 5))
+SQLITE_BUSY_TIMEOUT_SECONDS = 60
+
+STATUS_PENDING = 'pending'
+STATUS_LEASED = 'leased'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+
+def default_node_id() -> str:
+    """Идентификатор узла: NODE_ID из окружения или имя хоста (в Docker - id контейнера)."""
+    return os.environ.get('NODE_ID') or socket.gethostname()
+
+
+class LeaseQueue:
+    """Очередь URL с арендой. Объект не разделяется между потоками - каждому потоку свой экземпляр."""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        # isolation_level=None: транзакциями управляем явно (BEGIN IMMEDIATE)
+        self.conn = sqlite3.connect(db_path, timeout=SQLITE_BUSY_TIMEOUT_SECONDS, isolation_level=None)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS work_items ("
+            " url TEXT PRIMARY KEY,"
+            " status TEXT NOT NULL DEFAULT 'pending',"
+            " lease_owner TEXT,"
+            " lease_expires REAL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " done_by TEXT,"
+            " updated_at REAL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_work_items_status ON work_items(status, lease_expires)")
+
+    def close(self):
+        self.conn.close()
+
+    def add_urls(self, urls) -> int:
+        """Добавляет URL в очередь (уже существующие не трогаются). Возвращает количество добавленных."""
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            before = self.conn.total_changes
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO work_items (url, status, updated_at) VALUES (?, 'pending', ?)",
+                ((url, now) for url in urls)
+            )
+            added = self.conn.total_changes - before
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return added
+
+    def claim(self, node_id: str, limit: int, lease_seconds: int = LEASE_SECONDS) -> list[str]:
+        """
+        Забирает до limit URL под аренду: сначала свободные, затем с истекшей арендой (узел упал).
+        URL, выданные MAX_LEASE_ATTEMPTS раз, помечаются как failed - и свободные, и с истекшей арендой.
+        """
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.conn.execute(
+                "UPDATE work_items SET status = ?, lease_owner = NULL, updated_at = ?"
+                " WHERE (status = ? OR (status = ? AND lease_expires < ?)) AND attempts >= ?",
+                (STATUS_FAILED, now, STATUS_PENDING, STATUS_LEASED, now, MAX_LEASE_ATTEMPTS)
+            )
+            rows = self.conn.execute(
+                "SELECT url, status, lease_owner FROM work_items"
+                " WHERE status = ? OR (status = ? AND lease_expires < ?)"
+                " ORDER BY rowid LIMIT ?",
+                (STATUS_PENDING, STATUS_LEASED, now, limit)
+            ).fetchall()
+            for url, status, previous_owner in rows:
+                if status == STATUS_LEASED:
+                    logger.warning("Аренда URL %s узлом %s истекла, URL переназначен узлу %s.", url, previous_owner, node_id)
+            self.conn.executemany(
+                "UPDATE work_items SET status = ?, lease_owner = ?, lease_expires = ?, attempts = attempts + 1, updated_at = ?"
+                " WHERE url = ?",
+                ((STATUS_LEASED, node_id, now + lease_seconds, now, url) for url, _, _ in rows)
+            )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return [url for url, _, _ in rows]
+
+    def _execute_many(self, sql: str, params) -> int:
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            before = self.conn.total_changes
+            self.conn.executemany(sql, params)
+            changed = self.conn.total_changes - before
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return changed
+
+    def renew(self, node_id: str, urls: list[str], lease_seconds: int = LEASE_SECONDS) -> int:
+        """Продлевает аренду URL, которые все еще принадлежат узлу."""
+        expires = time.time() + lease_seconds
+        return self._execute_many(
+            "UPDATE work_items SET lease_expires = ? WHERE url = ? AND status = ? AND lease_owner = ?",
+            ((expires, url, STATUS_LEASED, node_id) for url in urls)
+        )
+
+    def ack(self, node_id: str, urls: list[str]) -> int:
+        """Подтверждает завершение. Если аренда уже перешла к другому узлу, подтверждение игнорируется."""
+        now = time.time()
+        return self._execute_many(
+            "UPDATE work_items SET status = ?, done_by = ?, lease_owner = NULL, lease_expires = NULL, updated_at = ?"
+            " WHERE url = ? AND status = ? AND lease_owner = ?",
+            ((STATUS_DONE, node_id, now, url, STATUS_LEASED, node_id) for url in urls)
+        )
+
+    def release(self, node_id: str, urls: list[str]) -> int:
+        """
+        Возвращает URL в очередь без ожидания истечения аренды. URL не обрабатывался (напр. остановка узла),
+        поэтому выдача не считается попыткой: счетчик attempts откатывается.
+        """
+        now = time.time()
+        return self._execute_many(
+            "UPDATE work_items SET status = ?, lease_owner = NULL, lease_expires = NULL, attempts = MAX(attempts - 1, 0), updated_at = ?"
+            " WHERE url = ? AND status = ? AND lease_owner = ?",
+            ((STATUS_PENDING, now, url, STATUS_LEASED, node_id) for url in urls)
+        )
+
+    def counts(self) -> dict[str, int]:
+        return dict(self.conn.execute("SELECT status, COUNT(*) FROM work_items GROUP BY status").fetchall())
+
+
+class LeaseHeartbeat(threading.Thread):
+    """Фоновый поток, продлевающий аренду URL текущего батча, пока батч обрабатывается."""
+
+    def __init__(self, db_path: str, node_id: str, urls: list[str], lease_seconds: int = LEASE_SECONDS):
+        super().__init__(name="LeaseHeartbeat", daemon=True)
+        self.db_path = db_path
+        self.node_id = node_id
+        self.urls = list(urls)
+        self.lease_seconds = lease_seconds
+        self._stop_event = threading.Event()
+
+    def run(self):
+        lease_queue = LeaseQueue(self.db_path)
+        try:
+            while not self._stop_event.wait(max(1.0, self.lease_seconds / 3)):
+                try:
+                    renewed = lease_queue.renew(self.node_id, self.urls, self.lease_seconds)
+                    if renewed < len(self.urls):
+                        logger.warning("Узел %s: продлено %s из %s аренд (часть URL переназначена).", self.node_id, renewed, len(self.urls))
+                except sqlite3.Error as e:
+                    logger.error("Узел %s: ошибка продления аренды: %s", self.node_id, e)
+        finally:
+            lease_queue.close()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join(timeout=5)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    arg_parser = argparse.ArgumentParser(description="Общая очередь URL (SQLite) для нескольких узлов.")
+    arg_parser.add_argument('db', help="Путь к файлу очереди (напр. output_files/work_queue.sqlite)")
+    sub = arg_parser.add_subparsers(dest='command', required=True)
+    import_cmd = sub.add_parser('import', help="Добавить URL из файла (по одному на строку)")
+    import_cmd.add_argument('url_file')
+    sub.add_parser('status', help="Количество URL по статусам")
+    args = arg_parser.parse_args()
+
+    lease_queue = LeaseQueue(args.db)
+    if args.command == 'import':
+        with open(args.url_file, 'r', encoding='utf-8') as f:
+            urls_to_add = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+        print(f"Добавлено URL: {lease_queue.add_urls(urls_to_add)} (в файле: {len(urls_to_add)})")
+    print(f"Статусы: {lease_queue.counts()}")
+    lease_queue.close()